@@ -6,6 +6,7 @@ import os
 import numpy as np
 from mol2_trajectory import Trajectory
 from pyichem import ints
+from pyichem.tables import write_table, table_name
 
 def main(args):
 	mol2_traj=Trajectory()
@@ -21,14 +22,14 @@ def main(args):
 		fingerprint = ints.Ints(mol2_traj.receptor_mol2, mol2_traj.ligand_mol2, type_int = 'MERG', new_hyd = True)
 		fingerprint.change_rules(['DAR'], [5.0])
 		fingerprint.calculate(input_file = 'interactions_newhyd.in')
-		fingerprint.map_results().to_csv('interactions_map_newhyd.csv', index = False)
+		write_table(fingerprint.map_results(), table_name('interactions_map_newhyd', args.output_format))
 
 	if args.default:
 		print('Calculating interactions using the default definitions')
 		fingerprint = ints.Ints(mol2_traj.receptor_mol2, mol2_traj.ligand_mol2, type_int = 'MERG', new_hyd = False)
 		fingerprint.change_rules(['DAR'], [5.0])
 		fingerprint.calculate(input_file = 'interactions.in')
-		fingerprint.map_results().to_csv('interactions_map.csv', index = False)
+		write_table(fingerprint.map_results(), table_name('interactions_map', args.output_format))
 
 	print('Calculation completed')
 	
@@ -42,6 +43,7 @@ if __name__ == "__main__":
 	parser.add_argument('-n', '--new', default = True, help = 'Skip IPA detection with the Newhyd defintion of hydrophobic contacts', action = 'store_false')
 	parser.add_argument('-rf', '--receptor_folder', default = None, help = 'Folder containing the receptor structures')
 	parser.add_argument('-lf', '--ligand_folder', default = None, help = 'Folder containing the ligand structures')
+	parser.add_argument('-of', '--output_format', default = 'csv', choices = ['csv', 'parquet', 'npz'], help = 'Format of the map files, the map files in Parquet or npz format are read by the scoring and training scripts like the CSV ones')
 
 	parser.set_defaults(func=main)
 	args=parser.parse_args()
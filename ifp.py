@@ -6,6 +6,7 @@ import os
 import numpy as np
 from mol2_trajectory import Trajectory
 from pyichem import ifp
+from pyichem.tables import write_table, table_name
 
 def main(args):
 	
@@ -19,9 +20,9 @@ def main(args):
 	fingerprint.calculate_lbl()
 
 	fingerprint.read_ifp()
-	print('Saving IFP to csv file\n')
-	fingerprint.fingerprints.to_csv('ifp.csv', index = False)
-	fingerprint.map_results().to_csv('ifp_map.csv', index = False)
+	print(f'Saving IFP to {args.output_format} file\n')
+	write_table(fingerprint.fingerprints, table_name('ifp', args.output_format))
+	write_table(fingerprint.map_results(), table_name('ifp_map', args.output_format))
 	print('IFP saved')
 	
 
@@ -30,6 +31,7 @@ def main(args):
 
 if __name__ == "__main__":
 	parser=argparse.ArgumentParser()
+	parser.add_argument('-of', '--output_format', default = 'csv', choices = ['csv', 'parquet', 'npz'], help = 'Format of the output tables, Parquet and npz files are compressed with bit-packed fingerprints')
 
 	parser.set_defaults(func=main)
 	args=parser.parse_args()
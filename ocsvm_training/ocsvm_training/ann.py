@@ -0,0 +1,191 @@
+import time
+import numpy as np
+
+class LSHNeighbours():
+	'''
+	Approximate KNN-average similarity for kernels with explicit features, such as IPAShortestPath.
+	The normalized feature vectors are hashed with random hyperplanes (SimHash), in each hash table the graphs are ordered by their hash code so that similar graphs are close in the ordering.
+	The candidate neighbours of a graph are the graphs within a window of ranks around it in the ordering of each table, so each graph has at most 2 x n_tables x window candidates whatever the number of graphs.
+	The orderings are cyclic (the last graph is followed by the first one) and the window covers at least (n+1)/2 ranks on each side, so each graph has at least n+1 distinct candidates in every table, also at the ends of the ordering.
+	The exact kernel values of the candidates are computed as tiles of the Gram matrix of the reordered graphs covering the band of the window, a block of consecutive graphs and the window after them, so the full Gram matrix is never computed.
+	The n+1 most similar candidates of each graph are kept, and the KNN-average is computed as in knn_average.
+	The number of kernel values computed by the last search, tiles included, is stored in n_evaluations.
+	:param n_tables: Number of hash tables, more tables increase the recall and the cost
+	:type n_tables: int
+	:param n_bits: Number of hyperplanes of each table
+	:type n_bits: int
+	:param candidates: Number of candidates of each graph as a multiple of n+1, used to set the window
+	:type candidates: int
+	:param window: Number of graphs on each side of a graph in the ordering of each table taken as candidates, if None candidates x (n+1) / (2 x n_tables). It is raised to (n+1)/2 if smaller
+	:type window: int, optional
+	:param block_size: Number of consecutive graphs of the ordering of each tile, if None the window size is used, each graph then computes about twice as many kernel values as it has candidates
+	:type block_size: int, optional
+	:param seed: Seed of the random hyperplanes
+	:type seed: int
+	'''
+	def __init__(self, n_tables = 4, n_bits = 16, candidates = 4, window = None, block_size = None, seed = 0):
+		if n_bits > 62:
+			raise ValueError('At most 62 hyperplanes can be used for each hash table')
+		self.n_tables = n_tables
+		self.n_bits = n_bits
+		self.candidates = candidates
+		self.window = window
+		self.block_size = block_size
+		self.seed = seed
+
+	def orderings(self, features):
+		'''
+		Orders the graphs by their hash code in each table.
+		:param features: Feature vectors of the graphs, a row for each graph
+		:type features: scipy sparse matrix
+		:returns: an ordering of the graphs for each table
+		:rtype: list of numpy arrays
+		'''
+		norms = np.sqrt(np.asarray(features.multiply(features).sum(axis = 1)).ravel())
+		norms[norms == 0] = 1
+		rng = np.random.default_rng(self.seed)
+		powers = 2**np.arange(self.n_bits, dtype = np.int64)[::-1]
+
+		orders = list()
+		for _ in range(self.n_tables):
+			projection = features @ rng.standard_normal((features.shape[1], self.n_bits))
+			codes = ((np.asarray(projection)/norms[:, None]) > 0) @ powers
+			orders.append(np.argsort(codes, kind = 'stable'))
+
+		return orders
+
+	def neighbours(self, kernel, n):
+		'''
+		Finds the approximate n+1 most similar graphs of each training graph of a fitted kernel, the graph itself included.
+		:param kernel: Fitted kernel with explicit features, it must provide the features, select and gram_tile methods as IPAShortestPath
+		:type kernel: graph kernel
+		:param n: Number of nearest neighbours
+		:type n: int
+		:returns: the kernel values and the indices of the neighbours, a row for each graph
+		:rtype: numpy array, numpy array
+		'''
+		features = kernel.features()
+		n_graphs = features.shape[0]
+		k = min(n+1, n_graphs)
+		window = self.window if self.window is not None else -(-self.candidates*k//(2*self.n_tables))
+		# at least k distinct graphs, the graph itself included, in the cyclic window of every table
+		window = max(window, k//2, 1)
+		# windows covering the whole cyclic ordering would count pairs twice, all the pairs are compared instead
+		cyclic = 2*window+1 < n_graphs
+		if not cyclic:
+			window = n_graphs-1
+		block_size = self.block_size if self.block_size is not None else max(1, window)
+
+		best_vals = np.full((n_graphs, k), -np.inf)
+		best_idx = np.full((n_graphs, k), -1, dtype = np.int64)
+		graphs = np.arange(n_graphs)
+		self.n_evaluations = 0
+
+		for order in self.orderings(features):
+			# consecutive graphs of the ordering are contiguous rows of the reordered kernel
+			ordered_kernel = kernel.select(order)
+			cand_vals = np.full((n_graphs, 2*window+1), -np.inf)
+			cand_idx = np.full((n_graphs, 2*window+1), -1, dtype = np.int64)
+			for start in range(0, n_graphs, block_size):
+				stop = min(start+block_size, n_graphs)
+				ranks = np.arange(start, stop+window) if cyclic else np.arange(start, n_graphs)
+				tile = ordered_kernel.gram_tile(slice(start, stop), ranks % n_graphs)
+				self.n_evaluations += tile.size
+
+				# the graph at rank p is compared with itself and the graphs at ranks p+1 to p+window, in both directions
+				offsets = ranks[None, :] - np.arange(start, stop)[:, None]
+				r, c = np.nonzero((offsets >= 0) & (offsets <= window))
+				offset = offsets[r, c]
+				a, b = order[start+r], order[ranks[c] % n_graphs]
+				cand_vals[a, offset] = tile[r, c]
+				cand_idx[a, offset] = b
+				back = offset > 0
+				cand_vals[b[back], window+offset[back]] = tile[r[back], c[back]]
+				cand_idx[b[back], window+offset[back]] = a[back]
+
+			# neighbours already found in a previous table are not counted twice
+			cand_vals[_known(best_idx, np.repeat(graphs, 2*window+1), cand_idx.ravel()).reshape(cand_idx.shape)] = -np.inf
+			vals = np.concatenate([best_vals, cand_vals], axis = 1)
+			idx = np.concatenate([best_idx, cand_idx], axis = 1)
+			top = np.argpartition(vals, vals.shape[1]-k, axis = 1)[:, vals.shape[1]-k:]
+			best_vals = np.take_along_axis(vals, top, axis = 1)
+			best_idx = np.take_along_axis(idx, top, axis = 1)
+
+		return best_vals, best_idx
+
+	def knn_average(self, kernel, n):
+		'''
+		Approximate KNN-average similarity of each training graph of a fitted kernel.
+		:param kernel: Fitted kernel with explicit features
+		:type kernel: graph kernel
+		:param n: Number of nearest neighbours
+		:type n: int
+		:returns: KNN-average similarity of each graph
+		:rtype: numpy array
+		'''
+		best_vals, _ = self.neighbours(kernel, n)
+		best_vals.sort(axis = 1)
+
+		return np.mean(best_vals[:, :-1], axis = 1)
+
+def compare_with_exact(graphs, kernel, approximate, S_knee = 1):
+	'''
+	Compares the MAD-KNN nu and the QMS2 knee obtained with the approximate and the exact KNN-average similarity, using the settings of training.py.
+	:param graphs: Input graphs
+	:type graphs: numpy array of graphs
+	:param kernel: The kernel used to compute the graph similairty, it must provide explicit features
+	:type kernel: graph kernel
+	:param approximate: Approximate nearest neighbours search
+	:type approximate: LSHNeighbours
+	:param S_knee: Sensibility of the kneed algorithm
+	:type S_knee: int
+	:returns: lines of the report
+	:rtype: list of str
+	'''
+	from ocsvm_training.mad_knn import MAD_KNN
+	from ocsvm_training.qms import QMS2
+
+	start = time.perf_counter()
+	gram = kernel.fit_transform(graphs)
+	exact_mad = MAD_KNN(graphs, kernel, gram)
+	try:
+		exact_mad.fit(find_n = True, plots = False)
+	except ValueError:
+		# nu = 0 is reported, training.py stops at the MAD-KNN training
+		pass
+	exact_qms2 = QMS2(graphs, kernel, gram)
+	exact_qms2.fit(find_n = True, direction = 'increasing', curve = 'concave', S_knee = S_knee, plots = False)
+	exact_time = time.perf_counter() - start
+
+	start = time.perf_counter()
+	approx_mad = MAD_KNN(graphs, kernel, approximate = approximate)
+	try:
+		approx_mad.fit(find_n = True, plots = False)
+	except ValueError:
+		# nu = 0 is reported, training.py stops at the MAD-KNN training
+		pass
+	approx_qms2 = QMS2(graphs, kernel, approximate = approximate)
+	approx_qms2.fit(find_n = True, direction = 'increasing', curve = 'concave', S_knee = S_knee, plots = False)
+	approx_time = time.perf_counter() - start
+
+	agreement = np.mean(exact_qms2.mask == approx_qms2.mask)
+
+	n_graphs = len(approx_qms2.vals)
+
+	return ['Comparison of the approximate and exact KNN-average similarity',
+		f'MAD-KNN nu: exact {exact_mad.nu}, approximate {approx_mad.nu}, difference {approx_mad.nu - exact_mad.nu}',
+		f'QMS2 knee: exact {exact_qms2.knee}, approximate {approx_qms2.knee}, difference {approx_qms2.knee - exact_qms2.knee}',
+		f'QMS2 selected graphs: exact {np.sum(exact_qms2.mask)}, approximate {np.sum(approx_qms2.mask)}, agreement {agreement:.4f}',
+		f'Maximum KNN-average difference: {np.max(np.abs(np.sort(exact_qms2.vals) - np.sort(approx_qms2.vals)))}',
+		f'Kernel values computed: exact {n_graphs**2}, approximate {approximate.n_evaluations} ({approximate.n_evaluations/max(n_graphs, 1):.1f} per graph, {approximate.n_evaluations/max(n_graphs**2, 1):.2%} of the Gram matrix)',
+		f'Time: exact {exact_time:.2f} s, approximate {approx_time:.2f} s\n']
+
+def _known(best_idx, rows, cols):
+	'''Mask of the pairs whose second graph is among the best candidates of the first one'''
+	n_graphs = len(best_idx)
+	# the indices shifted by one are sorted inside each row, rows are separated by multiples of n_graphs+1
+	keys = (np.sort(best_idx, axis = 1) + 1 + (n_graphs+1)*np.arange(n_graphs)[:, None]).ravel()
+	query = cols + 1 + (n_graphs+1)*rows
+	position = np.minimum(np.searchsorted(keys, query), len(keys)-1)
+
+	return keys[position] == query
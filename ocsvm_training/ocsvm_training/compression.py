@@ -0,0 +1,160 @@
+import argparse
+import sys
+import time
+import numpy as np
+import joblib
+from scipy import linalg
+from ocsvm_training.scoring_model import ScoringModel, export_scoring_model
+
+def reduced_set(gram, coef, n_vectors):
+	'''
+	Greedy reduced-set selection of the support vectors, as orthogonal matching pursuit in the feature space of the kernel.
+	At each step the support vector most correlated with the residual of the weight vector of the model is added, and the coefficients of the selected vectors are fitted again so that their weight vector is the projection of the weight vector of the model.
+	The selection is nested, the first n selected vectors are the selection of size n.
+	The projection lowers the decision values, the mean difference on the support vectors is returned as the correction of the intercept.
+	:param gram: Kernel matrix between the support vectors, NaN values are set to 0
+	:type gram: numpy array
+	:param coef: Dual coefficient of each support vector
+	:type coef: numpy array
+	:param n_vectors: Sizes of the reduced sets
+	:type n_vectors: list of int
+	:returns: the selected support vectors, in order of selection, and the coefficients and the intercept correction of the reduced set of each size
+	:rtype: numpy array, dict
+	'''
+	gram = np.nan_to_num(np.asarray(gram, dtype = np.float64))
+	coef = np.asarray(coef, dtype = np.float64)
+	sizes = sorted({min(n, len(coef)) for n in n_vectors})
+	norms = np.sqrt(np.maximum(np.diagonal(gram), 1e-12))
+
+	# projection of the weight vector of the model on each support vector
+	target = gram @ coef
+	residual = target.copy()
+	selected = list()
+	available = np.ones(len(coef), dtype = bool)
+	coefficients = dict()
+	for size in range(1, sizes[-1] + 1):
+		correlation = np.where(available, np.abs(residual)/norms, -np.inf)
+		selected.append(int(np.argmax(correlation)))
+		available[selected[-1]] = False
+		beta = linalg.lstsq(gram[np.ix_(selected, selected)], target[selected])[0]
+		residual = target - gram[:, selected] @ beta
+		if size in sizes:
+			coefficients[size] = (beta, np.mean(residual))
+
+	return np.array(selected), coefficients
+
+def compress(scoring_model, n_vectors):
+	'''
+	Scoring models approximating the decision function of a scoring model with a subset of its support vectors.
+	The intercept is corrected by the mean decision error on the support vectors, only the kernel values against the selected vectors are computed when scoring.
+	:param scoring_model: Scoring model exported by training.py, with a kernel providing select and gram_tile (IPAShortestPath)
+	:type scoring_model: ScoringModel
+	:param n_vectors: Sizes of the reduced sets
+	:type n_vectors: list of int
+	:returns: the compressed scoring model of each size
+	:rtype: dict
+	'''
+	kernel = scoring_model.kernel
+	if not hasattr(kernel, 'select') or not hasattr(kernel, 'gram_tile'):
+		raise TypeError(f'The kernel {type(kernel).__name__} does not support the compression of the model')
+
+	gram = kernel.gram_tile(slice(None), slice(None))
+	selected, coefficients = reduced_set(gram, scoring_model.dual_coef, n_vectors)
+
+	return {size: ScoringModel(kernel.select(selected[:size]).prune_features(), beta, scoring_model.intercept + offset) for size, (beta, offset) in coefficients.items()}
+
+def validate(scoring_model, compressed, graphs):
+	'''
+	Compares the compressed models with the original one on a validation library.
+	:param scoring_model: Original scoring model
+	:type scoring_model: ScoringModel
+	:param compressed: Compressed scoring models, by size
+	:type compressed: dict
+	:param graphs: Validation graphs, e.g. a library of docking poses
+	:type graphs: numpy array of graphs
+	:returns: lines of the report and maximum decision error of each size
+	:rtype: list of str, dict
+	'''
+	start = time.perf_counter()
+	exact_scores = scoring_model.score(graphs)
+	score_time = time.perf_counter() - start
+	exact_selected = exact_scores >= 0
+
+	report = [f'Compression of a model with {len(scoring_model.dual_coef)} support vectors, {len(graphs)} validation graphs scored',
+		f'Original: scoring {score_time:.2f} s, selected {np.sum(exact_selected)}']
+
+	scale = np.max(np.abs(exact_scores))
+	errors = dict()
+	for size, model in sorted(compressed.items()):
+		start = time.perf_counter()
+		scores = model.score(graphs)
+		score_time = time.perf_counter() - start
+
+		selected = scores >= 0
+		error = np.abs(scores - exact_scores)
+		errors[size] = np.max(error)
+		# agreement of the selected pose sets, intersection over union
+		union = np.sum(selected | exact_selected)
+		overlap = np.sum(selected & exact_selected)/union if union else 1.0
+		report.append(f'{size} vectors: scoring {score_time:.2f} s, selected {np.sum(selected)}, selection overlap {overlap:.4f}, agreement {np.mean(selected == exact_selected):.4f}, maximum decision error {errors[size]:.4g} (relative {errors[size]/scale:.4g}), mean decision error {np.mean(error):.4g}')
+
+	report[-1] += '\n'
+
+	return report, errors
+
+def main(args):
+	from pyichem import ints
+
+	model = joblib.load(args.model)
+	if not isinstance(model, ScoringModel):
+		if args.kernel is None:
+			raise ValueError(f'No kernel given for the model {args.model}')
+		kernel = joblib.load(args.kernel)
+		if not hasattr(kernel, 'select'):
+			raise TypeError(f'The kernel {type(kernel).__name__} does not support the compression of the model')
+		model = export_scoring_model(kernel, model, None)
+
+	interactions = ints.Ints([], [], type_int = args.type)
+	interactions.read_map_file(args.file)
+	if args.folder is not None:
+		interactions.output_location = [args.folder+loc for loc in interactions.output_location]
+	g = interactions.compute_graphs(subgraph = args.subgraph, graph_type = args.graph_type)
+	g = g[np.array([gt.n for gt in g]) > 2]
+	print(f'Validation graphs generated: {len(g)}')
+
+	print(f'Compressing the model to {", ".join(str(n) for n in args.n_vectors)} vectors')
+	compressed = compress(model, args.n_vectors)
+	report, errors = validate(model, compressed, g)
+
+	# smallest model within the tolerance, the largest one if none is
+	sizes = sorted(compressed)
+	if args.max_error is not None:
+		size = next((n for n in sizes if errors[n] <= args.max_error), sizes[-1])
+	else:
+		size = sizes[-1]
+	joblib.dump(compressed[size], args.output)
+	report.append(f'Compressed model with {size} vectors saved as: {args.output}')
+
+	print('\n'.join(report))
+	with open(args.report, 'w') as rep:
+		rep.writelines('\n'.join(report))
+
+
+if __name__ == "__main__":
+	parser=argparse.ArgumentParser(description = 'Compression of an OCSVM scoring model to a reduced set of support vectors, validated on a library of docking poses')
+	parser.add_argument('-m', '--model', help = 'Scoring model exported by training.py, or OCSVM model', required = True)
+	parser.add_argument('-k', '--kernel', default = None, help = 'Kernel of the OCSVM model, not needed for scoring models')
+	parser.add_argument('-f', '--file', help = 'Map file of the validation library generated by a script calculating the interactions', required = True)
+	parser.add_argument('-fo', '--folder', default = None, help = 'Folder conatining the interaction files')
+	parser.add_argument('-t', '--type', default = 'MERG', help = 'Type of interactions used in interaction detection.\navailble types: MERG, CENT, LIG, PROT')
+	parser.add_argument('-sg', '--subgraph', default = None, help = 'Available subgraph types: CENT, LIG, PROT, ELEC')
+	parser.add_argument('-gt', '--graph_type', default = 'grakel', choices = ['grakel', 'compact'], help = 'Format of the interaction graphs held in memory')
+	parser.add_argument('-n', '--n_vectors', type = int, nargs = '+', default = [25, 50, 100, 200], help = 'Sizes of the reduced sets tested')
+	parser.add_argument('-e', '--max_error', type = float, default = None, help = 'Maximum decision error on the validation library, the smallest model within the tolerance is saved, by default the largest model is saved')
+	parser.add_argument('-o', '--output', default = 'compressed_scoring.sav', help = 'Name of the compressed scoring model')
+	parser.add_argument('-r', '--report', default = 'compression_report.txt', help = 'Name of the report file')
+
+	parser.set_defaults(func=main)
+	args=parser.parse_args()
+	status = args.func(args)
+	sys.exit(status)
@@ -0,0 +1,201 @@
+import os
+import multiprocessing
+import hashlib
+import numpy as np
+from ocsvm_training.shortest_path import kernel_config
+
+class BlockedGram():
+	'''
+	Out-of-core computation of the Gram matrix of a set of graphs.
+	The matrix is computed in square tiles and written to a memory mapped .npy file, so that it never needs to be held in memory.
+	Completed tiles are recorded in a progress file, if the computation is interrupted it restarts from the first missing tile.
+	The progress file is stored with a key, the hash of the kernel configuration and of the features of the fitted kernel, and the computation is resumed only when the key is unchanged, so a folder left by different graphs or kernel settings is recomputed from scratch.
+	The returned memory mapped matrix can be given as Gram matrix to MAD_KNN, QMS2 and OneClassSVM.
+	The kernel must provide explicit features through the fit, gram_tile, dump_features and load_features methods, as IPAShortestPath.
+
+	Tiles can be distributed to a pool of processes, the features of the fitted kernel are shared with the processes as memory mapped files and each process writes its tiles directly in the matrix file.
+	Each entry of the matrix is computed by the same operations regardless of the tile it belongs to, so the result is identical for any number of processes.
+	:param kernel: The kernel used to compute the graph similairty
+	:type kernel: graph kernel
+	:param folder: Folder where the matrix and the progress file are stored
+	:type folder: str
+	:param tile_size: Number of rows and columns of each tile
+	:type tile_size: int
+	:param dtype: Type used to store the matrix
+	:type dtype: numpy dtype
+	:param n_jobs: Number of processes computing the tiles
+	:type n_jobs: int, optional
+	:param verbose: Print the progress of the computation
+	:type verbose: bool
+	'''
+	def __init__(self, kernel, folder, tile_size = 2048, dtype = np.float64, n_jobs = None, verbose = True):
+		if not hasattr(kernel, 'gram_tile'):
+			raise TypeError(f'The kernel {type(kernel).__name__} does not support the blocked computation of the Gram matrix')
+		self.kernel = kernel
+		self.folder = folder
+		self.tile_size = tile_size
+		self.dtype = np.dtype(dtype)
+		self.n_jobs = n_jobs
+		self.verbose = verbose
+
+	@property
+	def gram_file(self):
+		return os.path.join(self.folder, 'gram.npy')
+
+	@property
+	def progress_file(self):
+		return os.path.join(self.folder, f'tiles_{self.tile_size}.npy')
+
+	@property
+	def key_file(self):
+		return os.path.join(self.folder, f'tiles_{self.tile_size}.key')
+
+	def key(self):
+		'''
+		:returns: the key of the Gram matrix of the fitted kernel, the hash of the kernel configuration, of the matrix type and of the features of the training graphs
+		:rtype: str
+		'''
+		phi = self.kernel.features().tocsr()
+		digest = hashlib.sha256(f'{kernel_config(self.kernel)} {self.dtype.str} {phi.shape}'.encode())
+		for array in (phi.indptr, phi.indices, phi.data):
+			digest.update(np.ascontiguousarray(array).tobytes())
+		digest.update(repr(self.kernel.feature_keys()).encode())
+
+		return digest.hexdigest()
+
+	def compute(self, graphs):
+		'''
+		Fits the kernel and computes the missing tiles of the Gram matrix.
+		When resuming an interrupted computation the same graphs, in the same order, must be given.
+		:param graphs: Input graphs
+		:type graphs: list of graphs
+		:returns: the Gram matrix
+		:rtype: numpy memmap
+		'''
+		self.kernel.fit(graphs)
+
+		return self.fill(len(graphs))
+
+	def fill(self, n):
+		'''
+		Computes the missing tiles of the Gram matrix of an already fitted kernel.
+		:param n: Number of training graphs of the kernel
+		:type n: int
+		:returns: the Gram matrix
+		:rtype: numpy memmap
+		'''
+		n_tiles = -(-n // self.tile_size)
+		gram, done = self._open(n, n_tiles)
+
+		tiles = [(i, j) for i in range(n_tiles) for j in range(i, n_tiles)]
+		todo = [(i, j) for i, j in tiles if not done[i, j]]
+		completed = len(tiles) - len(todo)
+
+		if self.n_jobs is None or self.n_jobs == 1 or len(todo) < 2:
+			pool = None
+			results = (_write_tile(self.kernel, gram, i, j, self.tile_size) for i, j in todo)
+		else:
+			feature_folder = os.path.join(self.folder, 'features')
+			self.kernel.dump_features(feature_folder)
+			pool = multiprocessing.Pool(min(self.n_jobs, len(todo)), initializer = _init_worker, initargs = (type(self.kernel), self.kernel.normalize, feature_folder, self.gram_file, self.tile_size))
+			results = pool.imap_unordered(_tile_worker, todo)
+
+		try:
+			for i, j in results:
+				done[i, j] = 1
+				done.flush()
+				completed += 1
+				if self.verbose:
+					print(f'\rGram matrix tiles computed: {completed}/{len(tiles)}', end = '\n' if completed == len(tiles) else '')
+		finally:
+			if pool is not None:
+				pool.terminate()
+				pool.join()
+
+		return gram
+
+	def _open(self, n, n_tiles):
+		'''
+		Opens the matrix and progress files, new files are created if they do not exist or their key does not correspond to the current kernel and graphs.
+		'''
+		os.makedirs(self.folder, exist_ok = True)
+		key = self.key()
+		if os.path.isfile(self.gram_file) and os.path.isfile(self.progress_file) and os.path.isfile(self.key_file):
+			with open(self.key_file) as f:
+				stored_key = f.read().strip()
+			gram = np.lib.format.open_memmap(self.gram_file, mode = 'r+')
+			done = np.lib.format.open_memmap(self.progress_file, mode = 'r+')
+			if stored_key == key and gram.shape == (n, n) and gram.dtype == self.dtype and done.shape == (n_tiles, n_tiles):
+				if self.verbose:
+					print(f'Resuming the Gram matrix computation from {self.folder}')
+				return gram, done
+			del gram, done
+			if self.verbose:
+				print(f'The Gram matrix in {self.folder} was computed for other graphs or kernel settings, restarting the computation')
+
+		# the key is written last, an interruption while the files are created leaves a folder that is not resumed
+		if os.path.isfile(self.key_file):
+			os.remove(self.key_file)
+		gram = np.lib.format.open_memmap(self.gram_file, mode = 'w+', dtype = self.dtype, shape = (n, n))
+		done = np.lib.format.open_memmap(self.progress_file, mode = 'w+', dtype = np.uint8, shape = (n_tiles, n_tiles))
+		done.flush()
+		with open(self.key_file, 'w') as f:
+			f.write(key)
+
+		return gram, done
+
+def _write_tile(kernel, gram, i, j, tile_size):
+	'''
+	Computes the tile (i, j) of the Gram matrix, writes it and its transpose in the matrix and flushes it to disk.
+	'''
+	n = gram.shape[0]
+	rows = slice(i*tile_size, min((i+1)*tile_size, n))
+	cols = slice(j*tile_size, min((j+1)*tile_size, n))
+	tile = kernel.gram_tile(rows, cols)
+	gram[rows, cols] = tile
+	if i != j:
+		gram[cols, rows] = tile.T
+	gram.flush()
+
+	return i, j
+
+_worker_state = dict()
+
+def _init_worker(kernel_type, normalize, feature_folder, gram_file, tile_size):
+	'''
+	Loads the memory mapped features and matrix in a worker process.
+	'''
+	kernel = kernel_type(normalize = normalize)
+	kernel.load_features(feature_folder)
+	_worker_state['kernel'] = kernel
+	_worker_state['gram'] = np.lib.format.open_memmap(gram_file, mode = 'r+')
+	_worker_state['tile_size'] = tile_size
+
+def _tile_worker(tile):
+	return _write_tile(_worker_state['kernel'], _worker_state['gram'], tile[0], tile[1], _worker_state['tile_size'])
+
+def submatrix(gram, index, file, tile_size = 2048):
+	'''
+	Copies the rows and columns of a subset of the graphs of a Gram matrix to a new memory mapped matrix, e.g. the graphs selected by QMS2.
+	The copy is done tile by tile, so that only a tile of the matrix is held in memory.
+	:param gram: Gram matrix, it can be a memory mapped matrix
+	:type gram: numpy array
+	:param index: Indices of the graphs of the subset
+	:type index: numpy array of int
+	:param file: Name of the .npy file of the new matrix
+	:type file: str
+	:param tile_size: Number of rows and columns of each tile
+	:type tile_size: int
+	:returns: the Gram matrix of the subset
+	:rtype: numpy memmap
+	'''
+	index = np.asarray(index)
+	os.makedirs(os.path.dirname(file) or '.', exist_ok = True)
+	block = np.lib.format.open_memmap(file, mode = 'w+', dtype = gram.dtype, shape = (len(index), len(index)))
+	for start in range(0, len(index), tile_size):
+		rows = index[start:start+tile_size]
+		for col_start in range(0, len(index), tile_size):
+			block[start:start+tile_size, col_start:col_start+tile_size] = gram[np.ix_(rows, index[col_start:col_start+tile_size])]
+	block.flush()
+
+	return block
@@ -0,0 +1,144 @@
+import os
+import json
+import fcntl
+import contextlib
+import time
+import hashlib
+import numpy as np
+from ocsvm_training.shortest_path import graph_arrays, kernel_config
+
+class GramStore():
+	'''
+	Persistent store of Gram matrices, addressed by the content of the graphs and the kernel configuration.
+	The key of a matrix is the hash of the ordered graphs (adjacency matrix and node labels of each graph) and of the kernel parameters, so identical matrices computed by different runs are computed only once.
+	The matrices are stored as square .npy files, written by blocks of rows and memory mapped when loading, so a stored matrix is never copied in memory.
+	When the total size exceeds the budget the least recently used matrices are removed.
+	The index is read, modified and written under an exclusive lock, so training runs sharing a store do not lose entries.
+	:param folder: Folder of the store
+	:type folder: str
+	:param budget: Maximum size of the stored matrices in bytes, if None the size is not limited
+	:type budget: int, optional
+	:param block_size: Number of rows copied together
+	:type block_size: int
+	'''
+	def __init__(self, folder, budget = None, block_size = 1024):
+		self.folder = folder
+		self.budget = budget
+		self.block_size = block_size
+		os.makedirs(folder, exist_ok = True)
+
+	@property
+	def index_file(self):
+		return os.path.join(self.folder, 'index.json')
+
+	def _read_index(self):
+		if not os.path.isfile(self.index_file):
+			return dict()
+		with open(self.index_file) as f:
+			return json.load(f)
+
+	@contextlib.contextmanager
+	def _locked(self):
+		'''Exclusive lock of the index, held while it is read, modified and written'''
+		with open(os.path.join(self.folder, 'index.lock'), 'w') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+	def _write_index(self, index):
+		tmp_file = self.index_file + '.tmp'
+		with open(tmp_file, 'w') as f:
+			json.dump(index, f, indent = 1)
+		os.replace(tmp_file, self.index_file)
+
+	def key(self, graphs, kernel):
+		'''
+		:param graphs: Input graphs
+		:type graphs: list of graphs
+		:param kernel: Graph kernel
+		:type kernel: graph kernel
+		:returns: the key of the Gram matrix of the graphs
+		:rtype: str
+		'''
+		digest = hashlib.sha256(kernel_config(kernel).encode())
+		for x in graphs:
+			adj, labels = graph_arrays(x)
+			digest.update(np.array(adj.shape, dtype = np.int64).tobytes())
+			digest.update(np.ascontiguousarray(adj).tobytes())
+			digest.update('\x1f'.join(str(label) for label in labels).encode())
+
+		return digest.hexdigest()
+
+	def fit_transform(self, kernel, graphs):
+		'''
+		Fits the kernel on the graphs and returns their Gram matrix, loaded from the store if available.
+		:param kernel: Graph kernel
+		:type kernel: graph kernel
+		:param graphs: Input graphs
+		:type graphs: list of graphs
+		:returns: the Gram matrix, memory mapped if loaded from the store
+		:rtype: numpy array
+		'''
+		key = self.key(graphs, kernel)
+		gram = self.get(key)
+		if gram is None:
+			gram = kernel.fit_transform(graphs)
+			self.put(key, gram)
+		else:
+			# the fitted kernel is still needed to score new graphs
+			kernel.fit(graphs)
+
+		return gram
+
+	def get(self, key):
+		'''
+		:returns: the stored Gram matrix memory mapped in read-only mode, None if the key is not in the store
+		:rtype: numpy memmap
+		'''
+		with self._locked():
+			index = self._read_index()
+			if key not in index or not os.path.isfile(os.path.join(self.folder, index[key]['file'])):
+				return None
+			index[key]['last_used'] = time.time()
+			self._write_index(index)
+
+			return np.load(os.path.join(self.folder, index[key]['file']), mmap_mode = 'r')
+
+	def put(self, key, gram):
+		'''
+		Stores a Gram matrix and evicts the least recently used matrices exceeding the budget.
+		'''
+		file = f'{key}.npy'
+		# runs computing the same matrix write their own temporary file
+		tmp_file = os.path.join(self.folder, f'{key}.{os.getpid()}.tmp.npy')
+		stored = np.lib.format.open_memmap(tmp_file, mode = 'w+', dtype = gram.dtype, shape = gram.shape)
+		for start in range(0, gram.shape[0], self.block_size):
+			stored[start:start + self.block_size] = gram[start:start + self.block_size]
+		stored.flush()
+		del stored
+		os.replace(tmp_file, os.path.join(self.folder, file))
+
+		with self._locked():
+			index = self._read_index()
+			index[key] = {'file': file, 'shape': list(gram.shape), 'size': os.path.getsize(os.path.join(self.folder, file)), 'last_used': time.time()}
+			self._evict(index, keep = key)
+			self._write_index(index)
+
+	def _evict(self, index, keep = None):
+		'''
+		Removes the least recently used matrices until the store fits in the budget, the matrix just stored is kept.
+		'''
+		if self.budget is None:
+			return
+		total = sum(entry['size'] for entry in index.values())
+		for key in sorted(index, key = lambda k: index[k]['last_used']):
+			if total <= self.budget:
+				break
+			if key == keep:
+				continue
+			total -= index[key]['size']
+			file = os.path.join(self.folder, index.pop(key)['file'])
+			if os.path.isfile(file):
+				os.remove(file)
@@ -0,0 +1,158 @@
+import os
+import time
+import numpy as np
+import joblib
+from ocsvm_training.shortest_path import kernel_config
+
+class IncrementalGram():
+	'''
+	Gram matrix of a growing set of training graphs, kept on disk between training runs.
+	The folder stores the graphs, the fitted kernel (features of the graphs) and the Gram matrix as a memory mapped .npy file, together with the list of sources (e.g. map files) they come from.
+	When new sources are added only the features of the new graphs and the block of the Gram matrix between the new graphs and all the graphs are computed, the matrix is identical to the one of a full rebuild.
+	Each update writes the graphs, the kernel and the matrix to new files, the state file naming them is replaced last, so an interrupted update leaves the previous state intact.
+	The kernel must provide the extend and gram_tile methods, as IPAShortestPath.
+	:param folder: Folder where the state is stored
+	:type folder: str
+	:param kernel: The kernel used to compute the graph similairty, used only when the folder does not contain a state
+	:type kernel: graph kernel
+	:param tile_size: Number of rows computed and copied together
+	:type tile_size: int
+	:param settings: Settings used to generate the graphs (e.g. interaction type, subgraph, graph format), they must be the same as in the stored state
+	:type settings: dict, optional
+	'''
+	def __init__(self, folder, kernel, tile_size = 2048, settings = None):
+		if not hasattr(kernel, 'extend'):
+			raise TypeError(f'The kernel {type(kernel).__name__} does not support the incremental computation of the Gram matrix')
+		self.folder = folder
+		self.kernel = kernel
+		self.tile_size = tile_size
+		self.settings = dict() if settings is None else dict(settings)
+		self.sources = list()
+		self.graphs = None
+		self.version = 0
+		self.timings = {'graphs': 0.0, 'features': 0.0, 'gram': 0.0}
+
+		if os.path.isfile(self._file('state.sav')):
+			state = joblib.load(self._file('state.sav'))
+			if state['kernel'] != kernel_config(kernel):
+				raise ValueError(f'The state in {folder} was computed with a different kernel configuration: {state["kernel"]}')
+			if state['settings'] != self.settings:
+				raise ValueError(f'The state in {folder} was computed with different graph settings: {state["settings"]}')
+			self.sources = state['sources']
+			self.timings = state['timings']
+			self.version = state['version']
+			self.kernel = joblib.load(self._file(f'kernel_{self.version}.sav'))
+			self.graphs = joblib.load(self._file(f'graphs_{self.version}.sav'))
+
+	def _file(self, name):
+		return os.path.join(self.folder, name)
+
+	@property
+	def gram_file(self):
+		return self._file(f'gram_{self.version}.npy')
+
+	def new_sources(self, sources):
+		'''
+		:param sources: All the sources of the training graphs, the stored sources must be the first ones in the same order
+		:type sources: list of str
+		:returns: the sources not yet included in the Gram matrix
+		:rtype: list of str
+		'''
+		if list(sources[:len(self.sources)]) != self.sources:
+			raise ValueError(f'The sources must start with the ones already stored in {self.folder}: {", ".join(self.sources)}')
+
+		return list(sources[len(self.sources):])
+
+	def update(self, sources, graphs, graphs_time = 0.0):
+		'''
+		Adds the graphs of new sources and computes the new block of the Gram matrix.
+		:param sources: New sources
+		:type sources: list of str
+		:param graphs: Graphs of the new sources
+		:type graphs: numpy array of graphs
+		:param graphs_time: Time spent computing the new graphs, used to estimate the time of a full rebuild
+		:type graphs_time: float
+		:returns: all the graphs, the Gram matrix and a report of the time saved by the update
+		:rtype: numpy array, numpy memmap, list of str
+		'''
+		os.makedirs(self.folder, exist_ok = True)
+		n_old = 0 if self.graphs is None else len(self.graphs)
+		n_new = len(graphs)
+
+		if n_old and not n_new:
+			# the stored matrix is still valid, only the sources are recorded
+			features_time = gram_time = 0.0
+			gram = np.load(self.gram_file, mmap_mode = 'r')
+			self.sources = self.sources + list(sources)
+			self.timings['graphs'] += graphs_time
+			self._write_state()
+		else:
+			start = time.perf_counter()
+			if self.graphs is None:
+				self.kernel.fit(graphs)
+				self.graphs = graphs
+			else:
+				self.kernel.extend(graphs)
+				self.graphs = np.concatenate([self.graphs, graphs])
+			features_time = time.perf_counter() - start
+
+			previous = self.version
+			self.version += 1
+			start = time.perf_counter()
+			gram, block_time = self._enlarge(previous, n_old, n_old + n_new)
+			gram_time = time.perf_counter() - start
+
+			# a full rebuild computes the graphs and the features of all the sources, and all the rows of the matrix
+			total = n_old + n_new
+			self.timings = {'graphs': self.timings['graphs'] + graphs_time, 'features': self.timings['features'] + features_time, 'gram': block_time*total/n_new}
+			self.sources = self.sources + list(sources)
+			joblib.dump(self.kernel, self._file(f'kernel_{self.version}.sav'))
+			joblib.dump(self.graphs, self._file(f'graphs_{self.version}.sav'))
+			self._write_state()
+			for name in (f'gram_{previous}.npy', f'kernel_{previous}.sav', f'graphs_{previous}.sav'):
+				if os.path.isfile(self._file(name)):
+					os.remove(self._file(name))
+
+		update_time = graphs_time + features_time + gram_time
+		full_time = sum(self.timings.values())
+
+		report = [f'Incremental update of the Gram matrix stored in: {self.folder}',
+			f'Graphs reused: {n_old}, new graphs: {n_new}, new sources: {", ".join(sources) if len(sources) else "none"}',
+			f'Update time: {update_time:.2f} s (graphs {graphs_time:.2f} s, features {features_time:.2f} s, Gram matrix block {gram_time:.2f} s)',
+			f'Estimated full rebuild time: {full_time:.2f} s, time saved: {full_time - update_time:.2f} s\n']
+
+		return self.graphs, gram, report
+
+	def _write_state(self):
+		'''
+		Replaces the state file, the files of the current version must already be written.
+		'''
+		tmp_file = self._file(f'state.{os.getpid()}.tmp.sav')
+		joblib.dump({'sources': self.sources, 'kernel': kernel_config(self.kernel), 'settings': self.settings, 'version': self.version, 'timings': self.timings}, tmp_file)
+		os.replace(tmp_file, self._file('state.sav'))
+
+	def _enlarge(self, previous, n_old, n):
+		'''
+		Writes the enlarged Gram matrix of the current version, copying the matrix of the previous version and computing the rows of the new graphs and their transpose.
+		Returns the matrix and the time spent computing the new rows.
+		'''
+		gram = np.lib.format.open_memmap(self.gram_file, mode = 'w+', dtype = np.float64, shape = (n, n))
+		if n_old:
+			old = np.load(self._file(f'gram_{previous}.npy'), mmap_mode = 'r')
+			for start in range(0, n_old, self.tile_size):
+				stop = min(start + self.tile_size, n_old)
+				gram[start:stop, :n_old] = old[start:stop]
+			del old
+
+		block_time = 0.0
+		for start in range(n_old, n, self.tile_size):
+			rows = slice(start, min(start + self.tile_size, n))
+			tile_start = time.perf_counter()
+			tile = self.kernel.gram_tile(rows, slice(0, n))
+			block_time += time.perf_counter() - tile_start
+			gram[rows, :] = tile
+			gram[:start, rows] = tile[:, :start].T
+		gram.flush()
+		del gram
+
+		return np.load(self.gram_file, mmap_mode = 'r'), block_time
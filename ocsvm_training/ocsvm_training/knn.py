@@ -0,0 +1,66 @@
+import numpy as np
+
+def knn_average(dist, n, block_size = 1024, dtype = None):
+	'''
+	Computes the KNN-average similarity of each row of a similarity matrix.
+	The n+1 largest values of each row are selected, the largest one (the self-similarity) is discarded and the remaining n are averaged.
+	The result is the same obtained by averaging the columns [-n-1:-1] of the row-sorted matrix, NaN values are treated as the largest values as in np.sort.
+	Rows are processed in blocks using a partial sort, so that only a block of rows is copied in memory at any time.
+	:param dist: Similarity matrix, it can also be a memory mapped array
+	:type dist: numpy array
+	:param n: Number of nearest neighbours
+	:type n: int
+	:param block_size: Number of rows processed together
+	:type block_size: int
+	:param dtype: Type used for the computation, e.g. np.float32 to halve the memory used by each block. If None the type of dist is used
+	:type dtype: numpy dtype, optional
+	:returns: KNN-average similarity of each row
+	:rtype: numpy array
+	'''
+	n_rows, n_cols = dist.shape
+	k = min(n+1, n_cols)
+	vals = np.empty(n_rows, dtype = dtype if dtype is not None else np.float64)
+
+	for start in range(0, n_rows, block_size):
+		block = np.asarray(dist[start:start+block_size], dtype = dtype)
+		top = np.partition(block, n_cols-k, axis = 1)[:, n_cols-k:]
+		top.sort(axis = 1)
+		vals[start:start+block_size] = np.mean(top[:, :-1], axis = 1)
+
+	return vals
+
+class TiledNeighbours():
+	'''
+	Exact KNN-average similarity for kernels with explicit features, such as IPAShortestPath, without storing the Gram matrix.
+	The rows of the Gram matrix are computed by blocks of training graphs and reduced with knn_average, so the values are identical to the ones of the full Gram matrix while only a block of rows is held in memory.
+	It has the interface of LSHNeighbours and can be given as the approximate search of MAD_KNN and QMS2, the cost is still the one of the full Gram matrix (N x N kernel values).
+	The number of kernel values computed by the last search is stored in n_evaluations.
+	:param block_size: Number of rows of the Gram matrix computed together
+	:type block_size: int
+	:param dtype: Type used for the nearest neighbours search, np.float32 reduces the memory usage
+	:type dtype: numpy dtype, optional
+	'''
+	def __init__(self, block_size = 1024, dtype = None):
+		self.block_size = block_size
+		self.dtype = dtype
+
+	def knn_average(self, kernel, n):
+		'''
+		KNN-average similarity of each training graph of a fitted kernel.
+		:param kernel: Fitted kernel with explicit features, it must provide the features and gram_tile methods as IPAShortestPath
+		:type kernel: graph kernel
+		:param n: Number of nearest neighbours
+		:type n: int
+		:returns: KNN-average similarity of each graph
+		:rtype: numpy array
+		'''
+		n_graphs = kernel.features().shape[0]
+		vals = np.empty(n_graphs, dtype = self.dtype if self.dtype is not None else np.float64)
+		self.n_evaluations = 0
+
+		for start in range(0, n_graphs, self.block_size):
+			tile = kernel.gram_tile(slice(start, start+self.block_size), slice(None))
+			self.n_evaluations += tile.size
+			vals[start:start+self.block_size] = knn_average(tile, n, block_size = self.block_size, dtype = self.dtype)
+
+		return vals
@@ -1,6 +1,8 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.stats import median_abs_deviation
+from ocsvm_training.knn import knn_average
+from ocsvm_training.qms import show_plot
 
 class MAD_KNN():
 	'''
@@ -11,18 +13,34 @@ class MAD_KNN():
 	:type data: list of graphs
 	:param kernel: The kernel used to compute the graph similairty
 	:type kernel: graph kernel
+	:param gram: Precomputed Gram matrix of the input graphs, if None it is computed with the kernel when needed
+	:type gram: numpy array, optional
+	:param block_size: Number of rows of the Gram matrix processed together when searching the nearest neighbours
+	:type block_size: int, optional
+	:param dtype: Type used for the nearest neighbours search, np.float32 reduces the memory usage
+	:type dtype: numpy dtype, optional
+	:param approximate: Approximate nearest neighbours search (e.g. LSHNeighbours) used instead of the Gram matrix, the kernel must provide explicit features
+	:type approximate: object, optional
+	:param store: Persistent store of Gram matrices (GramStore), the Gram matrix is loaded from it when available and saved to it when computed
+	:type store: GramStore, optional
 	'''
-	def __init__(self, data, kernel):
+	def __init__(self, data, kernel, gram = None, block_size = 1024, dtype = None, approximate = None, store = None):
 		self.graphs = data
 		self.kernel = kernel
+		self.block_size = block_size
+		self.dtype = dtype
+		self.approximate = approximate
+		self.store = store
+		if gram is not None:
+			self.dist = gram
 
 	def find_vals(self, dist, n_end):
-		vals = np.mean(dist[:,n_end-1:-1], axis = 1)
+		vals = knn_average(dist, -n_end, block_size = self.block_size, dtype = self.dtype)
 		vals[np.isnan(vals)] = 0
 
 		return np.sort(vals)
 
-	def fit(self, n = 7, plots = True, find_n = False):
+	def fit(self, n = 7, plots = True, find_n = False, plot_prefix = None):
 		'''
 		Find the nu value for the given dataset.
 		The method can be called multiple times changing the parameters, without the need to recompute the similarity matrix.
@@ -33,14 +51,22 @@ class MAD_KNN():
 		:type plots: bool
 		:param find_n: Defines K of KNN as the value corresponding to 3% of the data
 		:type find_n: bool
+		:param plot_prefix: if given the plot is saved as {plot_prefix}_mad.png instead of being shown
+		:type plot_prefix: str, optional
+		:raises ValueError: if no graph is an outlier, nu is then set to 0 before raising
 		'''
 		if find_n:
 			n = max(10, int(0.03*len(self.graphs)))
 
-		if not hasattr(self, 'dist'):
-			self.dist = self.kernel.fit_transform(self.graphs)
-			self.sorted_dist = np.sort(self.dist)
-		self.vals = self.find_vals(self.sorted_dist, -n)
+		if self.approximate is not None and not hasattr(self, 'dist'):
+			self.kernel.fit(self.graphs)
+			vals = self.approximate.knn_average(self.kernel, n)
+			vals[np.isnan(vals)] = 0
+			self.vals = np.sort(vals)
+		else:
+			if not hasattr(self, 'dist'):
+				self.dist = self.kernel.fit_transform(self.graphs) if self.store is None else self.store.fit_transform(self.kernel, self.graphs)
+			self.vals = self.find_vals(self.dist, -n)
 
 		mad = median_abs_deviation(self.vals, scale= 'normal')
 		median = np.median(self.vals)
@@ -59,4 +85,10 @@ class MAD_KNN():
 			ax.legend()
 			ax.set_xlabel('Rank')
 			ax.set_ylabel('KNN-average similarity')
-			plt.show()
\ No newline at end of file
+			show_plot(plot_prefix, 'mad')
+
+		if self.nu == 0:
+			message = 'No outlier found by the MAD-KNN method (nu = 0), an OCSVM cannot be trained with this nu'
+			if self.approximate is not None:
+				message += '. The approximate search can miss the nearest neighbours and underestimate the KNN-average similarity, increase its number of candidates (-lc in training.py) or use the exact search'
+			raise ValueError(message)
@@ -0,0 +1,173 @@
+import time
+import numpy as np
+from scipy import linalg
+from sklearn.svm import OneClassSVM
+from sklearn.linear_model import SGDOneClassSVM
+from ocsvm_training.shortest_path import unfitted_copy
+
+class NystroemOCSVM():
+	'''
+	One-class SVM trained on a Nyström approximation of a precomputed kernel.
+	The kernel values between the graphs and m landmark graphs (N x m) are mapped to m features whose dot products approximate the kernel, and a linear one-class model is trained on them.
+	The model is used as a precomputed OCSVM whose kernel matrix has a column for each landmark, so a kernel fitted on the landmarks can be used for scoring in place of the kernel fitted on all the training graphs.
+	:param nu: nu parameter of the one-class model
+	:type nu: float
+	:param solver: Linear one-class model, libsvm (OneClassSVM with linear kernel) or sgd (SGDOneClassSVM, linear time in the number of graphs but with larger decision errors)
+	:type solver: str
+	:param seed: Seed of the sgd solver
+	:type seed: int
+	'''
+	def __init__(self, nu = 0.01, solver = 'libsvm', seed = 0):
+		if solver not in ('libsvm', 'sgd'):
+			raise ValueError(f'Unknown solver {solver}, available solvers: libsvm, sgd')
+		self.nu = nu
+		self.solver = solver
+		self.seed = seed
+
+	def fit(self, landmark_gram, gram):
+		'''
+		Builds the feature map and trains the linear model.
+		:param landmark_gram: Kernel matrix between the landmark graphs (m x m)
+		:type landmark_gram: numpy array
+		:param gram: Kernel matrix between the training graphs and the landmark graphs (N x m)
+		:type gram: numpy array
+		:returns: the fitted model
+		:rtype: NystroemOCSVM
+		'''
+		U, S, V = linalg.svd(np.nan_to_num(landmark_gram))
+		S = np.maximum(S, 1e-12)
+		self.normalization_ = np.dot(U/np.sqrt(S), V)
+
+		features = self.transform(gram)
+		if self.solver == 'libsvm':
+			self.model_ = OneClassSVM(kernel = 'linear', nu = self.nu)
+		else:
+			self.model_ = SGDOneClassSVM(nu = self.nu, random_state = self.seed)
+		self.model_.fit(features)
+
+		return self
+
+	def transform(self, gram):
+		'''
+		:param gram: Kernel matrix between graphs and the landmark graphs, NaN values are set to 0
+		:type gram: numpy array
+		:returns: Nyström features of the graphs
+		:rtype: numpy array
+		'''
+		return np.dot(np.nan_to_num(gram), self.normalization_.T)
+
+	def decision_function(self, gram):
+		'''
+		:param gram: Kernel matrix between graphs and the landmark graphs
+		:type gram: numpy array
+		:returns: signed distance from the separating hyperplane, positive for inliers
+		:rtype: numpy array
+		'''
+		return self.model_.decision_function(self.transform(gram))
+
+	def predict(self, gram):
+		return self.model_.predict(self.transform(gram))
+
+	@property
+	def n_support_(self):
+		'''Number of support vectors of the libsvm solver, the sgd solver has none'''
+		if self.solver != 'libsvm':
+			raise AttributeError('Nyström models trained with the sgd solver have no support vectors')
+		return self.model_.n_support_
+
+	@property
+	def n_landmarks_(self):
+		'''Number of landmark graphs'''
+		return self.normalization_.shape[0]
+
+def select_landmarks(n_graphs, n_components, seed = 0):
+	'''
+	Uniform random choice of the landmark graphs.
+	:returns: sorted indices of the landmarks
+	:rtype: numpy array
+	'''
+	rng = np.random.default_rng(seed)
+	return np.sort(rng.choice(n_graphs, size = min(n_components, n_graphs), replace = False))
+
+def nystroem_training(graphs, kernel, nu, n_components, solver = 'libsvm', seed = 0, timings = None):
+	'''
+	Trains a NystroemOCSVM computing only the kernel values against the landmark graphs (N x m and m x m blocks).
+	:param graphs: Training graphs
+	:type graphs: numpy array of graphs
+	:param kernel: The kernel used to compute the graph similairty, an unfitted copy is fitted on the landmarks
+	:type kernel: graph kernel
+	:param nu: nu parameter of the one-class model
+	:type nu: float
+	:param n_components: Number of landmark graphs
+	:type n_components: int
+	:param solver: Linear one-class model, libsvm or sgd
+	:type solver: str
+	:param timings: if given, the time spent computing the kernel blocks (gram) and fitting the model (fit) are stored in it
+	:type timings: dict, optional
+	:returns: the kernel fitted on the landmarks, the model and the kernel matrix between the training graphs and the landmarks
+	:rtype: graph kernel, NystroemOCSVM, numpy array
+	'''
+	start = time.perf_counter()
+	landmarks = select_landmarks(len(graphs), n_components, seed)
+	landmark_kernel = unfitted_copy(kernel)
+	landmark_gram = landmark_kernel.fit_transform(graphs[landmarks])
+	gram = landmark_kernel.transform(graphs)
+	gram_time = time.perf_counter() - start
+	start = time.perf_counter()
+	model = NystroemOCSVM(nu = nu, solver = solver, seed = seed).fit(landmark_gram, gram)
+	if timings is not None:
+		timings.update(gram = gram_time, fit = time.perf_counter() - start)
+
+	return landmark_kernel, model, gram
+
+def benchmark(graphs, kernel, nu, n_components_list, validation = None, solver = 'libsvm', seed = 0):
+	'''
+	Compares Nyström models with different numbers of landmarks with the exact OCSVM model.
+	The decision values are compared on the training graphs, and on the validation graphs if given.
+	The training time includes the computation of the kernel matrices (N x N for the exact model, N x m and m x m for the Nyström models), reported separately from the fit of the model.
+	:param graphs: Training graphs
+	:type graphs: numpy array of graphs
+	:param kernel: The kernel used to compute the graph similairty
+	:type kernel: graph kernel
+	:param nu: nu parameter of the models
+	:type nu: float
+	:param n_components_list: Numbers of landmarks to test
+	:type n_components_list: list of int
+	:param validation: Graphs used to compare the decision values, e.g. a library of docking poses
+	:type validation: numpy array of graphs, optional
+	:param solver: Linear one-class model of the Nyström models, libsvm or sgd
+	:type solver: str
+	:returns: lines of the report
+	:rtype: list of str
+	'''
+	test = graphs if validation is None else validation
+
+	start = time.perf_counter()
+	exact_kernel = unfitted_copy(kernel)
+	exact_gram = exact_kernel.fit_transform(graphs)
+	gram_time = time.perf_counter() - start
+	start = time.perf_counter()
+	exact_model = OneClassSVM(kernel = 'precomputed', nu = nu).fit(np.nan_to_num(exact_gram))
+	fit_time = time.perf_counter() - start
+	start = time.perf_counter()
+	exact_scores = exact_model.decision_function(np.nan_to_num(exact_kernel.transform(test)))
+	score_time = time.perf_counter() - start
+
+	report = [f'Nyström benchmark, nu {nu}, {solver} solver, {len(graphs)} training graphs, {len(test)} {"training" if validation is None else "validation"} graphs scored',
+		f'Exact: training {gram_time + fit_time:.2f} s (Gram matrix {gram_time:.2f} s, fit {fit_time:.2f} s), scoring {score_time:.2f} s, support vectors {exact_model.n_support_[0]}, selected {np.sum(exact_scores >= 0)}']
+
+	scale = np.max(np.abs(exact_scores))
+	for n_components in n_components_list:
+		timings = dict()
+		landmark_kernel, model, _ = nystroem_training(graphs, kernel, nu, n_components, solver, seed, timings)
+		start = time.perf_counter()
+		scores = model.decision_function(landmark_kernel.transform(test))
+		score_time = time.perf_counter() - start
+
+		error = np.abs(scores - exact_scores)
+		agreement = np.mean((scores >= 0) == (exact_scores >= 0))
+		report.append(f'm = {min(n_components, len(graphs))}: training {timings["gram"] + timings["fit"]:.2f} s (kernel blocks {timings["gram"]:.2f} s, fit {timings["fit"]:.2f} s), scoring {score_time:.2f} s, selected {np.sum(scores >= 0)}, agreement {agreement:.4f}, maximum decision error {np.max(error):.4g} (relative {np.max(error)/scale:.4g}), mean decision error {np.mean(error):.4g}')
+
+	report[-1] += '\n'
+
+	return report
@@ -0,0 +1,225 @@
+import math
+import time
+import numpy as np
+from scipy import sparse
+from sklearn.svm import OneClassSVM
+from ocsvm_training.scoring_model import ScoringModel
+
+class DecisionBound():
+	'''
+	Upper bound of the decision function of a model using an IPAShortestPath kernel, used to skip the exact kernel evaluation of poses that cannot be selected.
+	The features are grouped in blocks by the labels of the path ends, and optionally by the bin of the path length. The kernel value is bounded by the sum over the blocks of the products of the norms of the two graphs in the block (Cauchy-Schwarz inequality).
+	Since the kernel values are not negative, the support vectors with negative or zero coefficients (e.g. compressed models) are left out of the bound.
+
+	The bound is evaluated as a two-level cascade:
+	the first level sums the norms of the support vectors weighted by their coefficients in each block beforehand, it costs a product with a value for each block per pose, but it does not clip the normalized kernel values to 1;
+	the poses it does not prune go to the second level, bounding each support vector separately (n_blocks x n_support values per pose).
+	The number of levels used is calibrated on the first poses given to decision: the measured time of each level is compared with the exact time saved by the poses it prunes, estimated from the measured exact time per unit of cost of the evaluated poses (the cost of a pose is the number of training graphs sharing each of its features).
+	The levels costing more than they save are not used afterwards, so when the bound does not pay off it costs only its evaluation on the calibration poses.
+	:param kernel: Fitted kernel providing feature_keys and features
+	:type kernel: IPAShortestPath
+	:param dual_coef: Dual coefficient of each support vector
+	:type dual_coef: numpy array
+	:param intercept: Intercept of the decision function
+	:type intercept: float
+	:param support: Training graphs of the kernel used as support vectors, if None all the training graphs
+	:type support: array of indices, optional
+	:param bin_width: Width of the bins of the path lengths, if None the blocks are the label pairs only. Smaller bins give tighter and more expensive bounds
+	:type bin_width: float, optional
+	:param calibration_size: Number of poses used to measure the cost and the saving of the levels
+	:type calibration_size: int
+	'''
+	def __init__(self, kernel, dual_coef, intercept, support = None, bin_width = None, calibration_size = 256):
+		self.bin_width = bin_width if bin_width else None
+		self.calibration_size = calibration_size
+		# number of levels used, set by the calibration, and measured times of the scored poses
+		self.n_levels = None
+		self.bound_time = 0.0
+		self.saved_time = 0.0
+		self.normalize = kernel.normalize
+		self.intercept = float(intercept)
+		coef = np.maximum(np.asarray(dual_coef, dtype = np.float64), 0)
+		self.blocks = dict()
+		keys = kernel.feature_keys()
+		columns = np.array([self.blocks.setdefault(self._block(key), len(self.blocks)) for key in keys], dtype = np.int64)
+
+		phi = kernel.features()
+		# the exact kernel values cost a multiply-add for each training graph sharing a feature of the pose
+		self.feature_cost = dict(zip(keys, np.diff(phi.tocsc().indptr).tolist()))
+		if support is not None:
+			phi = phi[support]
+		positive = np.flatnonzero(coef > 0)
+		self.coef = coef[positive]
+		squares = phi[positive].multiply(phi[positive]).tocsr()
+		self.diag = np.asarray(squares.sum(axis = 1)).ravel()
+		self.block_norms = np.sqrt((squares @ _block_matrix(columns, len(self.blocks))).toarray())
+
+		# first level, the weighted norms of the support vectors summed in each block
+		weights = self.coef.copy()
+		if self.normalize:
+			with np.errstate(divide = 'ignore', invalid = 'ignore'):
+				weights = np.where(self.diag > 0, weights/np.sqrt(self.diag), 0)
+		self.block_weights = self.block_norms.T @ weights
+
+	def _block(self, key):
+		if self.bin_width is None:
+			return key[0], key[1]
+		return key[0], key[1], math.floor(key[2]/self.bin_width)
+
+	def _query_norms(self, query):
+		'''Norms of the features of the poses in each block, and estimated cost of their exact kernel values'''
+		# blocks absent from the support vectors do not contribute to the kernel values
+		columns = np.array([self.blocks.get(self._block(key), -1) for key in query.keys], dtype = np.int64)
+		norms = np.sqrt((query.phi.multiply(query.phi).tocsr() @ _block_matrix(columns, len(self.blocks))).toarray())
+		feature_cost = np.array([self.feature_cost.get(key, 0) for key in query.keys], dtype = np.float64)
+		exact_cost = (query.phi != 0).astype(np.float64) @ feature_cost
+
+		return norms, exact_cost
+
+	def _first_level(self, norms, diag):
+		raw = norms @ self.block_weights
+		if self.normalize:
+			with np.errstate(divide = 'ignore', invalid = 'ignore'):
+				raw = np.minimum(raw/np.sqrt(diag), np.sum(self.coef))
+			raw[np.isnan(raw)] = 0
+
+		return raw + self.intercept
+
+	def _second_level(self, norms, diag):
+		km = norms @ self.block_norms.T
+		if self.normalize:
+			with np.errstate(divide = 'ignore', invalid = 'ignore'):
+				km = np.minimum(km / np.sqrt(np.outer(diag, self.diag)), 1)
+			km[np.isnan(km)] = 0
+
+		return km @ self.coef + self.intercept
+
+	def bound(self, query):
+		'''
+		:param query: Features of the poses
+		:type query: QueryFeatures
+		:returns: upper bound of the decision value of each pose, the tighter second level for all the poses
+		:rtype: numpy array
+		'''
+		norms, _ = self._query_norms(query)
+
+		return np.minimum(self._first_level(norms, query.diag), self._second_level(norms, query.diag))
+
+	def prunable(self, query):
+		'''
+		:param query: Features of the poses
+		:type query: QueryFeatures
+		:returns: mask of the poses whose decision value is certainly negative according to the two levels
+		:rtype: numpy array
+		'''
+		return self._prune(query, 2)[1]
+
+	def _prune(self, query, n_levels):
+		'''
+		Applies the first n_levels levels of the bound.
+		Returns the bound of each pose, the mask of the pruned poses, the estimated exact cost of each pose, and the time and the cost of the poses pruned by each level.
+		'''
+		start = time.perf_counter()
+		norms, exact_cost = self._query_norms(query)
+		bound = self._first_level(norms, query.diag)
+		pruned = self._negative(bound)
+		times = [time.perf_counter() - start, 0.0]
+		costs = [np.sum(exact_cost[pruned]), 0.0]
+
+		left = np.flatnonzero(~pruned)
+		if n_levels > 1 and len(left):
+			start = time.perf_counter()
+			second = self._second_level(norms[left], query.diag[left])
+			bound[left] = np.minimum(bound[left], second)
+			pruned[left] = self._negative(second)
+			times[1] = time.perf_counter() - start
+			costs[1] = np.sum(exact_cost[left[pruned[left]]])
+
+		return bound, pruned, exact_cost, times, costs
+
+	def decision(self, query, exact):
+		'''
+		Decision values of the poses, the exact values are computed only for the poses not pruned by the bound.
+		The pruned poses get their upper bound, which is negative, so the selected poses and their decision values are the ones of the exact evaluation.
+		The first call calibrates the number of levels on its first calibration_size poses.
+		:param query: Features of the poses
+		:type query: QueryFeatures
+		:param exact: Function computing the exact decision values of the poses at the given indices
+		:type exact: callable
+		:returns: the decision values and the mask of the pruned poses
+		:rtype: numpy array, numpy array
+		'''
+		n = len(query)
+		values = np.empty(n)
+		pruned = np.zeros(n, dtype = bool)
+		split = min(n, self.calibration_size) if self.n_levels is None else 0
+		for index in (np.arange(split), np.arange(split, n)):
+			if not len(index):
+				continue
+			if self.n_levels == 0:
+				values[index] = exact(index)
+				continue
+
+			bound, chunk_pruned, exact_cost, times, costs = self._prune(query.select(index), 2 if self.n_levels is None else self.n_levels)
+			evaluated = index[~chunk_pruned]
+			start = time.perf_counter()
+			if len(evaluated):
+				values[evaluated] = exact(evaluated)
+			exact_time = time.perf_counter() - start
+			values[index[chunk_pruned]] = bound[chunk_pruned]
+			pruned[index] = chunk_pruned
+
+			# exact time per unit of estimated cost, measured on the evaluated poses
+			evaluated_cost = np.sum(exact_cost[~chunk_pruned])
+			saved = [exact_time*cost/evaluated_cost if evaluated_cost > 0 else 0.0 for cost in costs]
+			self.bound_time += sum(times)
+			self.saved_time += sum(saved)
+			if self.n_levels is None:
+				self.n_levels = _levels(times, saved, evaluated_cost)
+
+		return values, pruned
+
+	def _negative(self, bound):
+		# margin covering the rounding errors of the bound and of the exact decision value
+		margin = 1e-9*(np.abs(bound - self.intercept) + abs(self.intercept))
+
+		return bound < -margin
+
+def decision_bound(kernel, model, bin_width = None):
+	'''
+	Builds the DecisionBound of a kernel and model pair.
+	:param kernel: Fitted kernel
+	:type kernel: graph kernel
+	:param model: OneClassSVM with precomputed kernel or ScoringModel
+	:type model: model
+	:param bin_width: Width of the bins of the path lengths, if None the blocks are the label pairs only
+	:type bin_width: float, optional
+	:returns: the bound, None if the kernel or the model are not supported
+	:rtype: DecisionBound
+	'''
+	if not hasattr(kernel, 'feature_keys'):
+		return None
+	if isinstance(model, ScoringModel):
+		return DecisionBound(kernel, model.dual_coef, model.intercept, bin_width = bin_width)
+	if isinstance(model, OneClassSVM) and model.kernel == 'precomputed':
+		return DecisionBound(kernel, model.dual_coef_[0], model.intercept_[0], support = model.support_, bin_width = bin_width)
+
+	return None
+
+def _levels(times, saved, evaluated_cost):
+	'''Number of levels of the bound whose measured time is lower than the exact time they save'''
+	if evaluated_cost == 0:
+		# all the poses were pruned
+		return 2
+	if saved[1] > times[1] and sum(saved) > sum(times):
+		return 2
+	if saved[0] > times[0]:
+		return 1
+
+	return 0
+
+def _block_matrix(columns, n_blocks):
+	'''Sparse matrix summing the features of each block, columns set to -1 are dropped'''
+	known = np.flatnonzero(columns >= 0)
+
+	return sparse.csr_matrix((np.ones(len(known)), (known, columns[known])), shape = (len(columns), n_blocks))
@@ -1,6 +1,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from kneed import KneeLocator
+from ocsvm_training.knn import knn_average
 
 class QMS():
 	'''
@@ -11,17 +12,52 @@ class QMS():
 	:type data: list of graphs
 	:param kernel: The kernel used to compute the graph similairty
 	:type kernel: graph kernel
+	:param gram: Precomputed Gram matrix of the input graphs, if None it is computed with the kernel when needed
+	:type gram: numpy array, optional
+	:param block_size: Number of rows of the Gram matrix processed together when searching the nearest neighbours
+	:type block_size: int, optional
+	:param dtype: Type used for the nearest neighbours search, np.float32 reduces the memory usage
+	:type dtype: numpy dtype, optional
+	:param approximate: Approximate nearest neighbours search (e.g. LSHNeighbours) used instead of the Gram matrix, the kernel must provide explicit features
+	:type approximate: object, optional
+	:param store: Persistent store of Gram matrices (GramStore), the Gram matrix is loaded from it when available and saved to it when computed
+	:type store: GramStore, optional
 	'''
-	def __init__(self, data, kernel):
+	def __init__(self, data, kernel, gram = None, block_size = 1024, dtype = None, approximate = None, store = None):
 		self.graphs = data
 		self.kernel = kernel
+		self.block_size = block_size
+		self.dtype = dtype
+		self.approximate = approximate
+		self.store = store
+		if gram is not None:
+			self.dist = gram
 
 	def _find_vals(self, dist, n_end):
 		
-		return np.mean(dist[:,n_end-1:-1], axis = 1)
+		return knn_average(dist, -n_end, block_size = self.block_size, dtype = self.dtype)
 
 
-	def _find_knee(self, n = 7, curve = 'convex', direction = 'decreasing', S_knee = 1, plots = True, find_n = False, interp_method = 'interp1d', polynomial_degree = 7):
+	def _compute_vals(self, n, find_n):
+		'''
+		Computes the KNN-average similarity of the graphs, only at the first call.
+		'''
+		if find_n:
+			n = max(10, int(0.03*len(self.graphs)))
+
+		if self.approximate is not None and not hasattr(self, 'dist'):
+			if not hasattr(self, 'vals'):
+				self.kernel.fit(self.graphs)
+				self.vals = self.approximate.knn_average(self.kernel, n)
+				self.vals[np.isnan(self.vals)] = 0
+		else:
+			if not hasattr(self, 'dist'):
+				self.dist = self.kernel.fit_transform(self.graphs) if self.store is None else self.store.fit_transform(self.kernel, self.graphs)
+			if not hasattr(self, 'vals'):
+				self.vals = self._find_vals(self.dist, -n)
+				self.vals[np.isnan(self.vals)] = 0
+
+	def _find_knee(self, n = 7, curve = 'convex', direction = 'decreasing', S_knee = 1, plots = True, find_n = False, interp_method = 'interp1d', polynomial_degree = 7, plot_prefix = None):
 		'''
 		Find the knee for the pairwise similairty distribution.
 		The method can be called multiple times changing the parameters, without the need to recompute the similarity matrix.
@@ -43,16 +79,11 @@ class QMS():
 		:type interp_method: string
 		:param polynomial_degree: kneed parameter
 		:tpye polynomial_degree: int
+		:param plot_prefix: if given the plots are saved as {plot_prefix}_knee.png and {plot_prefix}_knee_normalized.png instead of being shown
+		:type plot_prefix: str, optional
 		'''
 
-		if find_n:
-			n = max(10, int(0.03*len(self.graphs)))
-
-		if not hasattr(self, 'dist'):
-			self.dist = self.kernel.fit_transform(self.graphs)
-			self.sorted_dist = np.sort(self.dist)
-			self.vals = self._find_vals(self.sorted_dist, -n)
-			self.vals[np.isnan(self.vals)] = 0
+		self._compute_vals(n, find_n)
 		
 		knee_finder = KneeLocator(np.arange(len(self.vals)), np.sort(self.vals), curve = curve, direction = direction, S = S_knee, interp_method = interp_method, polynomial_degree= polynomial_degree)
 		if knee_finder.knee_y is None:
@@ -61,23 +92,134 @@ class QMS():
 			self.knee = knee_finder.knee_y
 		if plots:
 			knee_finder.plot_knee()
-			plt.show()
+			show_plot(plot_prefix, 'knee')
 			knee_finder.plot_knee_normalized()
-			plt.show()
-			
+			show_plot(plot_prefix, 'knee_normalized')
+
+	def knee_sweep(self, S_values, n = 7, curve = 'convex', direction = 'decreasing', find_n = False, interp_method = 'interp1d', polynomial_degree = 7):
+		'''
+		Finds the knee for several sensibility values of the kneed algorithm at once.
+		The results are identical to calling _find_knee with each sensibility value.
+		:param S_values: Sensibility values
+		:type S_values: list of float
+		:returns: the knee for each sensibility value, NaN if no knee is found
+		:rtype: numpy array
+		'''
+		self._compute_vals(n, find_n)
+
+		return sweep_knees(np.sort(self.vals), S_values, curve = curve, direction = direction, interp_method = interp_method, polynomial_degree = polynomial_degree)
+
+def sweep_knees(y, S_values, curve = 'convex', direction = 'decreasing', interp_method = 'interp1d', polynomial_degree = 7):
+	'''
+	Offline kneedle knee of a curve for several sensibility values, sharing the difference curve.
+	The sensibility only changes the threshold of each local maximum of the difference curve: after the local maximum p the knee is found if the difference curve falls below y_diff[p] - S*step before the next local extremum.
+	The lowest value of the difference curve after each local maximum is computed once, the knee for a sensibility is the first local maximum whose threshold is crossed.
+	:param y: Sorted values of the curve, the x values are their ranks
+	:type y: numpy array
+	:param S_values: Sensibility values
+	:type S_values: list of float
+	:returns: the y value of the knee for each sensibility value, NaN if no knee is found
+	:rtype: numpy array
+	'''
+	S_values = np.asarray(S_values, dtype = float)
+	knee_finder = KneeLocator(np.arange(len(y)), y, curve = curve, direction = direction, S = 1, interp_method = interp_method, polynomial_degree = polynomial_degree)
+	y_difference = knee_finder.y_difference
+	last = len(y_difference) - 1
+	step = np.abs(np.diff(knee_finder.x_normalized).mean())
+
+	# the detection after a maximum stops at the next local extremum, a point that is also a minimum never starts it
+	events = np.union1d(knee_finder.maxima_indices, knee_finder.minima_indices)
+	active = np.setdiff1d(knee_finder.maxima_indices, knee_finder.minima_indices)
+	active = active[active < last]
+	following = np.searchsorted(events, active, side = 'right')
+	ends = np.minimum(np.append(events, last)[following], last)
+	lowest = np.array([y_difference[p+1:e+1].min() for p, e in zip(active, ends)])
+
+	knees = np.full(len(S_values), np.nan)
+	if len(active):
+		# thresholds computed as in kneed, so that ties are resolved in the same way
+		accepted = lowest[None, :] < y_difference[active][None, :] - S_values[:, None]*step
+		found = accepted.any(axis = 1)
+		first = active[np.argmax(accepted, axis = 1)]
+		if (curve == 'convex') == (direction == 'decreasing'):
+			index = first
+		else:
+			index = len(y) - 1 - first
+		# as in kneed, a knee at rank 0 is not reported
+		found &= index != 0
+		knees[found] = np.asarray(y)[index[found]]
+
+	return knees
+
+def select_sensibility(S_values, knees, rule = 'stable'):
+	'''
+	Selects the sensibility value of the kneed algorithm from a sweep.
+	:param S_values: Sensibility values
+	:type S_values: list of float
+	:param knees: Knee found for each sensibility value, NaN if no knee is found
+	:type knees: numpy array
+	:param rule: stable, the smallest sensibility of the longest run of consecutive values giving the same knee; min, the smallest sensibility giving a knee; max, the largest sensibility giving a knee
+	:type rule: str
+	:returns: the selected sensibility
+	:rtype: float
+	'''
+	S_values = np.asarray(S_values, dtype = float)
+	order = np.argsort(S_values)
+	S_values, knees = S_values[order], np.asarray(knees)[order]
+	valid = ~np.isnan(knees)
+	if not valid.any():
+		raise ValueError('The given dataset does not present a knee/elbow with the desired characteristics for any sensibility value')
+
+	if rule == 'min':
+		return S_values[valid][0]
+	if rule == 'max':
+		return S_values[valid][-1]
+	if rule != 'stable':
+		raise ValueError(f'Unknown rule {rule}, available rules: stable, min, max')
+
+	# runs of consecutive sensibility values giving the same knee
+	starts = np.flatnonzero(np.r_[True, knees[1:] != knees[:-1]])
+	lengths = np.diff(np.r_[starts, len(knees)])
+	lengths[~valid[starts]] = 0
+
+	return S_values[starts[np.argmax(lengths)]]
+
+def plot_knee_sweep(S_values, knees, S_selected = None, plot_prefix = None):
+	'''
+	Plots the knee found for each sensibility value.
+	:param plot_prefix: if given the plot is saved as {plot_prefix}_knee_sweep.png instead of being shown
+	:type plot_prefix: str, optional
+	'''
+	fig, ax = plt.subplots()
+	ax.plot(S_values, knees, marker = 'o', color = 'blue')
+	if S_selected is not None:
+		ax.axvline(S_selected, color = 'red', linestyle = '--', label = f'Selected sensibility: {S_selected:g}')
+		ax.legend()
+	ax.set_xlabel('Sensibility')
+	ax.set_ylabel('Knee KNN-average similarity')
+	show_plot(plot_prefix, 'knee_sweep')
+
+def show_plot(plot_prefix, name):
+	'''Shows the current figure, or saves and closes it if a prefix is given'''
+	if plot_prefix is None:
+		plt.show()
+	else:
+		plt.savefig(f'{plot_prefix}_{name}.png')
+		plt.close()
+
 
 
 class QMS2(QMS):
 	'''
 	Implementation of the QMS2 method
 	'''
-	def __init__(self, data, kernel):
-		super().__init__(data, kernel)
+	def __init__(self, data, kernel, gram = None, block_size = 1024, dtype = None, approximate = None, store = None):
+		super().__init__(data, kernel, gram, block_size, dtype, approximate, store)
 		self.graphs = data
 		self.kernel = kernel
 
 
-	def fit(self, n = 7, curve = 'convex', direction = 'decreasing', S_knee = 1, plots = True, find_n = False, interp_method = 'interp1d', polynomial_degree = 7):
+	def fit(self, n = 7, curve = 'convex', direction = 'decreasing', S_knee = 1, plots = True, find_n = False, interp_method = 'interp1d', polynomial_degree = 7, plot_prefix = None):
 		'''
 		Select the graphs to be used for model training.
 		:param n: Number of nearest neighbours for the analysis
@@ -96,11 +238,13 @@ class QMS2(QMS):
 		:type interp_method: string
 		:param polynomial_degree: kneed parameter
 		:tpye polynomial_degree: int
+		:param plot_prefix: if given the plots are saved to files starting with the prefix instead of being shown
+		:type plot_prefix: str, optional
 		:returns: graphs to be used for model training
 		:rtype: list of graphs
 		'''
 
-		self._find_knee(n = n, curve = curve, direction = direction, S_knee = S_knee, plots = plots, find_n = find_n, interp_method = interp_method, polynomial_degree = polynomial_degree)
+		self._find_knee(n = n, curve = curve, direction = direction, S_knee = S_knee, plots = plots, find_n = find_n, interp_method = interp_method, polynomial_degree = polynomial_degree, plot_prefix = plot_prefix)
 
 		self.mask = self.vals > self.knee
 
@@ -128,15 +272,15 @@ class QMS1(QMS):
 	:param polynomial_degree: kneed parameter
 	:tpye polynomial_degree: int
 	'''
-	def __init__(self, data, kernel):
-		super().__init__(data, kernel)
+	def __init__(self, data, kernel, gram = None, block_size = 1024, dtype = None, approximate = None, store = None):
+		super().__init__(data, kernel, gram, block_size, dtype, approximate, store)
 		self.graphs = data
 		self.kernel = kernel
 
 
-	def fit(self, n = 7, curve = 'convex', direction = 'decreasing', S_knee = 1, eta = 0, plots = True, find_n = False, interp_method = 'interp1d', polynomial_degree = 7):
+	def fit(self, n = 7, curve = 'convex', direction = 'decreasing', S_knee = 1, eta = 0, plots = True, find_n = False, interp_method = 'interp1d', polynomial_degree = 7, plot_prefix = None):
 
-		self._find_knee(n = n, curve = curve, direction = direction, S_knee = S_knee, plots = plots, find_n = find_n, interp_method = interp_method, polynomial_degree = polynomial_degree)
+		self._find_knee(n = n, curve = curve, direction = direction, S_knee = S_knee, plots = plots, find_n = find_n, interp_method = interp_method, polynomial_degree = polynomial_degree, plot_prefix = plot_prefix)
 
 		self.mask = self.vals > self.knee 
 
@@ -0,0 +1,115 @@
+import os
+import fcntl
+import zipfile
+import hashlib
+import warnings
+import contextlib
+import numpy as np
+
+class ScoreCache():
+	'''
+	Persistent cache of the scores of docking poses.
+	The scores of each model are stored in a .npz file named after the hash of the model artifacts (kernel and model files), a retrained model gets a new file.
+	Each score is addressed by the hash of the content of the IPA file of the pose and of the options used to build its graph, so moved or renamed poses are still found and modified poses are scored again.
+	Scores of graphs with less than three nodes are stored as NaN, like in the results.
+	The file of a model is read, updated and replaced under an exclusive lock, so scoring runs sharing a cache do not lose or corrupt scores.
+	:param folder: Folder of the cache
+	:type folder: str
+	'''
+	def __init__(self, folder):
+		self.folder = folder
+		os.makedirs(folder, exist_ok = True)
+
+	def _file(self, model_key):
+		return os.path.join(self.folder, f'{model_key}.npz')
+
+	def _load(self, model_key):
+		if not os.path.isfile(self._file(model_key)):
+			return dict()
+		try:
+			with np.load(self._file(model_key)) as stored:
+				return dict(zip(stored['keys'].tolist(), stored['scores'].tolist()))
+		except (OSError, ValueError, EOFError, KeyError, zipfile.BadZipFile) as error:
+			warnings.warn(f'The cached scores in {self._file(model_key)} cannot be read ({error}), the poses are scored again and the file is replaced')
+			return dict()
+
+	@contextlib.contextmanager
+	def _locked(self, model_key):
+		'''Exclusive lock of the file of a model, held while it is read, updated and replaced'''
+		with open(os.path.join(self.folder, f'{model_key}.lock'), 'w') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+	def get(self, model_key, pose_keys):
+		'''
+		:param model_key: Key of the model
+		:type model_key: str
+		:param pose_keys: Key of each pose
+		:type pose_keys: list of str
+		:returns: the cached scores, and a mask of the poses found in the cache
+		:rtype: numpy array, numpy array
+		'''
+		cached = self._load(model_key)
+		pose_keys = [b'' if key is None else key.encode() for key in pose_keys]
+		found = np.array([key in cached for key in pose_keys], dtype = bool)
+		scores = np.array([cached.get(key, np.nan) for key in pose_keys], dtype = np.float64)
+
+		return scores, found
+
+	def put(self, model_key, pose_keys, scores):
+		'''
+		Adds the scores of the poses to the cache of a model, poses without key are skipped.
+		'''
+		with self._locked(model_key):
+			cached = self._load(model_key)
+			cached.update((key.encode(), score) for key, score in zip(pose_keys, np.asarray(scores, dtype = np.float64).tolist()) if key is not None)
+
+			# each process writes its own file, the replacement is atomic
+			tmp_file = os.path.join(self.folder, f'{model_key}.{os.getpid()}.tmp.npz')
+			np.savez(tmp_file, keys = np.array(list(cached), dtype = 'S64'), scores = np.array(list(cached.values()), dtype = np.float64))
+			os.replace(tmp_file, self._file(model_key))
+
+def file_key(files, options = None):
+	'''
+	:param files: Files of a model, e.g. kernel and model
+	:type files: list of str
+	:param options: Options changing the scores of the model
+	:type options: dict, optional
+	:returns: the hash of the content of the files and of the options
+	:rtype: str
+	'''
+	digest = hashlib.sha256()
+	if options is not None:
+		digest.update(repr(sorted(options.items())).encode())
+	for file in files:
+		with open(file, 'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				digest.update(block)
+		digest.update(b'\x1f')
+
+	return digest.hexdigest()
+
+def pose_keys(ipa_files, options):
+	'''
+	:param ipa_files: IPA file of each pose
+	:type ipa_files: list of str
+	:param options: Options used to build the graphs, e.g. interaction type and subgraph
+	:type options: dict
+	:returns: the key of each pose, None for missing files
+	:rtype: list of str
+	'''
+	prefix = repr(sorted(options.items())).encode()
+	keys = list()
+	for file in ipa_files:
+		if not os.path.isfile(file):
+			keys.append(None)
+			continue
+		digest = hashlib.sha256(prefix)
+		with open(file, 'rb') as f:
+			digest.update(f.read())
+		keys.append(digest.hexdigest())
+
+	return keys
@@ -0,0 +1,69 @@
+import numpy as np
+from ocsvm_training.shortest_path import unfitted_copy
+
+class ScoringModel():
+	'''
+	OCSVM model reduced to what is needed to score new graphs: a kernel fitted only on the support vectors, their dual coefficients and the intercept.
+	The self-similarity of the support vectors used for the kernel normalization is kept by the kernel.
+	The kernel values of the scored graphs are computed only against the support vectors, the decision values are the ones of the full kernel and model up to rounding errors.
+	:param kernel: Kernel fitted on the support vectors
+	:type kernel: graph kernel
+	:param dual_coef: Dual coefficient of each support vector
+	:type dual_coef: numpy array
+	:param intercept: Intercept of the decision function
+	:type intercept: float
+	'''
+	def __init__(self, kernel, dual_coef, intercept):
+		self.kernel = kernel
+		self.dual_coef = np.asarray(dual_coef, dtype = np.float64)
+		self.intercept = float(intercept)
+
+	@property
+	def n_support_(self):
+		return np.array([len(self.dual_coef)])
+
+	def decision_function(self, gram):
+		'''
+		:param gram: Kernel matrix between the graphs and the support vectors
+		:type gram: numpy array
+		:returns: signed distance from the separating hyperplane, positive for inliers
+		:rtype: numpy array
+		'''
+		# the intercept is -rho of libsvm, the values equal the ones of OneClassSVM up to the rounding of the sums
+		return np.asarray(gram, dtype = np.float64) @ self.dual_coef + self.intercept
+
+	def predict(self, gram):
+		return np.where(self.decision_function(gram) >= 0, 1, -1)
+
+	def score(self, graphs):
+		'''
+		:param graphs: Graphs to score
+		:type graphs: list of graphs
+		:returns: decision value of each graph
+		:rtype: numpy array
+		'''
+		gram = self.kernel.transform(graphs)
+		gram[np.isnan(gram)] = 0
+
+		return self.decision_function(gram)
+
+def export_scoring_model(kernel, model, graphs):
+	'''
+	Builds the ScoringModel of an OCSVM trained with a precomputed kernel.
+	Kernels with explicit features (IPAShortestPath) keep the features of the support vectors, other kernels are fitted again on the support vector graphs.
+	:param kernel: Kernel fitted on the training graphs
+	:type kernel: graph kernel
+	:param model: Fitted OneClassSVM with precomputed kernel
+	:type model: OneClassSVM
+	:param graphs: Training graphs of the model, in the order used for the Gram matrix
+	:type graphs: numpy array of graphs
+	:returns: the scoring model
+	:rtype: ScoringModel
+	'''
+	support = model.support_
+	if hasattr(kernel, 'select'):
+		sv_kernel = kernel.select(support).prune_features()
+	else:
+		sv_kernel = unfitted_copy(kernel).fit(graphs[support])
+
+	return ScoringModel(sv_kernel, model.dual_coef_[0], model.intercept_[0])
@@ -0,0 +1,420 @@
+import os
+import copy
+import tempfile
+import numpy as np
+from scipy import sparse
+from grakel import ShortestPath
+
+class IPAShortestPath():
+	'''
+	Shortest path kernel computed through explicit sparse feature vectors.
+	Each graph is described by the counts of its (label of u, label of v, shortest path length between u and v) triples, the kernel is the dot product of the counts.
+	The kernel values are identical to the ones of grakel ShortestPath with node labels, the Gram matrices are computed as sparse matrix products instead of dense ones.
+	The kernel accepts IPAGraph objects, grakel graphs built from an adjacency matrix and iterables of adjacency matrix and node labels.
+	:param normalize: Normalize the kernel values by the self-similarity of the graphs
+	:type normalize: bool
+	:param n_jobs: Number of processes used to compute the Gram matrix in fit_transform, the result does not depend on the number of processes
+	:type n_jobs: int, optional
+	:param tile_size: Size of the tiles of the Gram matrix distributed to the processes
+	:type tile_size: int, optional
+	'''
+	def __init__(self, normalize = False, n_jobs = None, tile_size = 2048):
+		self.normalize = normalize
+		self.n_jobs = n_jobs
+		self.tile_size = tile_size
+
+	def fit(self, X, y = None):
+		'''
+		Computes the features of the training graphs.
+		:param X: Input graphs
+		:type X: list of graphs
+		:returns: the fitted kernel
+		:rtype: IPAShortestPath
+		'''
+		self._enum = dict()
+		self._phi_X = self._features(X, self._enum)
+		self._X_diag = _squared_norms(self._phi_X)
+
+		return self
+
+	def fit_transform(self, X, y = None):
+		'''
+		Fits the kernel and computes the Gram matrix of the training graphs.
+		:param X: Input graphs
+		:type X: list of graphs
+		:returns: the Gram matrix
+		:rtype: numpy array
+		'''
+		self.fit(X)
+
+		if self.n_jobs is None or self.n_jobs == 1:
+			return self.gram_tile(slice(None), slice(None))
+
+		from ocsvm_training.gram import BlockedGram
+		with tempfile.TemporaryDirectory() as folder:
+			gram = BlockedGram(self, folder, tile_size = self.tile_size, n_jobs = self.n_jobs, verbose = False).fill(len(self._X_diag))
+			km = np.array(gram)
+			del gram
+
+		return km
+
+	def extend(self, X):
+		'''
+		Adds graphs to the training graphs of a fitted kernel, computing only their features.
+		The result is identical to fitting the kernel on the previous training graphs followed by the new ones.
+		:param X: New graphs
+		:type X: list of graphs
+		:returns: the fitted kernel
+		:rtype: IPAShortestPath
+		'''
+		phi_new = self._features(X, self._enum)
+		# the previous graphs have no occurrence of the features first found in the new graphs
+		phi_old = sparse.csr_matrix((self._phi_X.data, self._phi_X.indices, self._phi_X.indptr), shape = (self._phi_X.shape[0], len(self._enum)))
+		self._phi_X = sparse.vstack([phi_old, phi_new], format = 'csr')
+		self._X_diag = np.concatenate([self._X_diag, _squared_norms(phi_new)])
+
+		return self
+
+	def gram_tile(self, rows, cols):
+		'''
+		Computes a block of the Gram matrix of the training graphs.
+		The values are identical to the corresponding entries of fit_transform.
+		:param rows: Training graphs corresponding to the rows of the block
+		:type rows: slice or array of indices
+		:param cols: Training graphs corresponding to the columns of the block
+		:type cols: slice or array of indices
+		:returns: the block of the Gram matrix
+		:rtype: numpy array
+		'''
+		km = (self._phi_X[rows] @ self._phi_X[cols].T).toarray()
+
+		if self.normalize:
+			return np.divide(km, np.sqrt(np.outer(self._X_diag[rows], self._X_diag[cols])))
+		else:
+			return km
+
+	def transform(self, X):
+		'''
+		Computes the kernel values between the given graphs and the training graphs.
+		Features absent from the training graphs contribute only to the self-similarity of the given graphs.
+		:param X: Input graphs
+		:type X: list of graphs
+		:returns: kernel matrix with a row for each given graph and a column for each training graph
+		:rtype: numpy array
+		'''
+		query = QueryFeatures(X)
+		# self-similarity of the transformed graphs returned by diagonal, as in grakel
+		self._Y_diag = query.diag
+
+		return self.transform_features(query)
+
+	def transform_features(self, query):
+		'''
+		Computes the kernel values between graphs whose features were already extracted and the training graphs.
+		The same QueryFeatures can be used by several kernels, the values are identical to the ones of transform.
+		The kernel is not modified, so it can be shared by threads, the self-similarity of the input graphs is query.diag.
+		:param query: Features of the input graphs
+		:type query: QueryFeatures
+		:returns: kernel matrix with a row for each given graph and a column for each training graph
+		:rtype: numpy array
+		'''
+		if not hasattr(self, '_phi_X'):
+			raise ValueError('The kernel must be fitted before calling transform')
+
+		km = (query.phi @ query.mapping(self._enum, self._phi_X.shape[1]) @ self._phi_X.T).toarray()
+
+		if self.normalize:
+			return km / np.sqrt(np.outer(query.diag, self._X_diag))
+		else:
+			return km
+
+	def features(self):
+		'''
+		:returns: the sparse feature vectors of the training graphs, a row for each graph
+		:rtype: scipy csr matrix
+		'''
+		return self._phi_X
+
+	def feature_keys(self):
+		'''
+		:returns: the (label of u, label of v, shortest path length) triple of each column of the features
+		:rtype: list of tuples
+		'''
+		keys = [None]*len(self._enum)
+		for key, column in self._enum.items():
+			keys[column] = key
+
+		return keys
+
+	def select(self, index):
+		'''
+		Kernel fitted on a subset of the training graphs, without recomputing their features.
+		The map from features to columns is shared with the original kernel.
+		:param index: Training graphs of the new kernel, in the given order
+		:type index: array of indices or boolean mask
+		:returns: the fitted kernel
+		:rtype: IPAShortestPath
+		'''
+		kernel = type(self)(normalize = self.normalize, n_jobs = self.n_jobs, tile_size = self.tile_size)
+		kernel._enum = self._enum
+		kernel._phi_X = self._phi_X[index]
+		kernel._X_diag = self._X_diag[index]
+
+		return kernel
+
+	def prune_features(self):
+		'''
+		Removes from the map from features to columns the features absent from the training graphs, e.g. after select.
+		The kernel values are unchanged, transform only needs to look up the remaining features.
+		:returns: the kernel
+		:rtype: IPAShortestPath
+		'''
+		used = np.unique(self._phi_X.indices)
+		columns = np.full(len(self._enum), -1, dtype = np.int64)
+		columns[used] = np.arange(len(used))
+		self._enum = {key: int(columns[column]) for key, column in self._enum.items() if columns[column] >= 0}
+		self._phi_X = sparse.csr_matrix((self._phi_X.data, columns[self._phi_X.indices], self._phi_X.indptr), shape = (self._phi_X.shape[0], len(used)))
+
+		return self
+
+	def dump_features(self, folder):
+		'''
+		Saves the features of the training graphs as .npy files, so that they can be memory mapped by other processes.
+		:param folder: Folder where the features are saved
+		:type folder: str
+		'''
+		os.makedirs(folder, exist_ok = True)
+		for name, array in (('data', self._phi_X.data), ('indices', self._phi_X.indices), ('indptr', self._phi_X.indptr), ('shape', np.array(self._phi_X.shape)), ('diag', self._X_diag)):
+			np.save(os.path.join(folder, f'phi_{name}.npy'), array)
+
+	def load_features(self, folder, mmap_mode = 'r'):
+		'''
+		Loads the features of the training graphs saved by dump_features, by default the arrays are memory mapped.
+		The map from features to columns is not saved, the loaded kernel can compute the Gram matrix of the training graphs but not transform new graphs.
+		:param folder: Folder containing the features
+		:type folder: str
+		:param mmap_mode: Memory map mode used by np.load
+		:type mmap_mode: str, optional
+		'''
+		data, indices, indptr, diag = (np.load(os.path.join(folder, f'phi_{name}.npy'), mmap_mode = mmap_mode) for name in ('data', 'indices', 'indptr', 'diag'))
+		shape = tuple(np.load(os.path.join(folder, 'phi_shape.npy')).tolist())
+		self._phi_X = sparse.csr_matrix((data, indices, indptr), shape = shape, copy = False)
+		self._X_diag = diag
+
+	def diagonal(self):
+		'''
+		:returns: self-similarity of the training graphs, and of the last transformed graphs if transform was called
+		:rtype: numpy array or tuple of numpy arrays
+		'''
+		if hasattr(self, '_Y_diag'):
+			return self._X_diag, self._Y_diag
+		return self._X_diag
+
+	@staticmethod
+	def _features(X, enum):
+		'''
+		Builds the sparse feature matrix of a set of graphs.
+		:param X: Input graphs
+		:type X: list of graphs
+		:param enum: map from feature to column, updated with the unseen features
+		:type enum: dict
+		:returns: feature matrix with a row for each graph
+		:rtype: scipy csr matrix
+		'''
+		indptr = [0]
+		indices = list()
+		data = list()
+		for x in X:
+			for key, count in path_counts(x):
+				column = enum.get(key)
+				if column is None:
+					column = len(enum)
+					enum[key] = column
+				indices.append(column)
+				data.append(count)
+			indptr.append(len(indices))
+
+		return sparse.csr_matrix((np.array(data, dtype = np.float64), np.array(indices, dtype = np.int64), np.array(indptr, dtype = np.int64)), shape = (len(indptr)-1, len(enum)))
+
+class QueryFeatures():
+	'''
+	Features of graphs to be compared with the training graphs of one or more fitted IPAShortestPath kernels.
+	The shortest paths, the counts of the triples and the self-similarities are computed once, each kernel only maps the triples to its own features.
+	:param X: Input graphs
+	:type X: list of graphs
+	'''
+	def __init__(self, X):
+		enum = dict()
+		self.phi = IPAShortestPath._features(X, enum)
+		self.keys = list(enum)
+		self.diag = _squared_norms(self.phi)
+
+	def __len__(self):
+		return self.phi.shape[0]
+
+	def select(self, index):
+		'''
+		:param index: Graphs to keep, in the given order
+		:type index: array of indices or boolean mask
+		:returns: the features of a subset of the graphs
+		:rtype: QueryFeatures
+		'''
+		query = copy.copy(self)
+		query.phi = self.phi[index]
+		query.diag = self.diag[index]
+
+		return query
+
+	def mapping(self, enum, n_features):
+		'''
+		:param enum: Map from triple to column of the training features of a kernel
+		:type enum: dict
+		:param n_features: Number of training features
+		:type n_features: int
+		:returns: sparse matrix mapping the columns of the query features to the columns of the training features, the triples absent from the training graphs are dropped
+		:rtype: scipy csr matrix
+		'''
+		columns = np.fromiter((enum.get(key, -1) for key in self.keys), dtype = np.int64, count = len(self.keys))
+		known = np.flatnonzero(columns >= 0)
+
+		return sparse.csr_matrix((np.ones(len(known)), (known, columns[known])), shape = (len(columns), n_features))
+
+def shares_query_features(kernel):
+	'''
+	:param kernel: Fitted graph kernel
+	:type kernel: graph kernel
+	:returns: True if the kernel values can be computed from QueryFeatures by transform_query, i.e. IPAShortestPath and grakel ShortestPath with node labels
+	:rtype: bool
+	'''
+	if hasattr(kernel, 'transform_features'):
+		return True
+	# grakel counts the same triples as IPAShortestPath, with the same Floyd-Warshall path lengths
+	return isinstance(kernel, ShortestPath) and kernel.with_labels and kernel.algorithm_type in ('auto', 'floyd_warshall') and hasattr(kernel, '_enum')
+
+def transform_query(kernel, query):
+	'''
+	Kernel values between graphs whose features were already extracted and the training graphs of a kernel supported by shares_query_features.
+	The values are identical to the ones of the transform method of the kernel, the kernel is not modified.
+	:param kernel: Fitted graph kernel
+	:type kernel: graph kernel
+	:param query: Features of the input graphs
+	:type query: QueryFeatures
+	:returns: kernel matrix with a row for each given graph and a column for each training graph
+	:rtype: numpy array
+	'''
+	if hasattr(kernel, 'transform_features'):
+		return kernel.transform_features(query)
+
+	if hasattr(kernel, '_phi_X'):
+		phi_x = kernel._phi_X
+	else:
+		# fitted without fit_transform, the dense features are built as in grakel transform
+		phi_x = np.zeros((kernel._nx, len(kernel._enum)))
+		for i, counts in kernel.X.items():
+			for j, count in counts.items():
+				phi_x[i, j] = count
+	km = np.asarray(query.phi @ query.mapping(kernel._enum, len(kernel._enum)) @ phi_x.T)
+
+	if kernel.normalize:
+		# grakel transform recomputes the self-similarity of the training graphs from their features
+		return km / np.sqrt(np.outer(query.diag, np.sum(np.square(phi_x), axis = 1)))
+	else:
+		return km
+
+def unfitted_copy(kernel):
+	'''
+	Copy of a kernel with the same parameters and without the fitted state.
+	grakel kernels keep the feature matrix and the self-similarities computed by fit_transform or transform through later calls to fit, so a fitted kernel must not be copied and fitted again on other graphs.
+	:param kernel: Graph kernel
+	:type kernel: graph kernel
+	:returns: the unfitted kernel
+	:rtype: graph kernel
+	'''
+	if hasattr(kernel, 'get_params'):
+		from sklearn.base import clone
+		return clone(kernel)
+
+	return type(kernel)(normalize = kernel.normalize, n_jobs = kernel.n_jobs, tile_size = kernel.tile_size)
+
+def kernel_config(kernel):
+	'''
+	Description of the kernel parameters determining the kernel values, the parameters controlling only the computation are excluded.
+	Used to check that stored matrices (GramStore, IncrementalGram) were computed with the same kernel.
+	:param kernel: Graph kernel
+	:type kernel: graph kernel
+	:returns: the class of the kernel and its parameters
+	:rtype: str
+	'''
+	if hasattr(kernel, 'get_params'):
+		params = kernel.get_params()
+	else:
+		params = {'normalize': getattr(kernel, 'normalize', None)}
+	params = {name: value for name, value in params.items() if name not in ('n_jobs', 'verbose', 'tile_size')}
+
+	return f'{type(kernel).__name__}{sorted((name, repr(value)) for name, value in params.items())}'
+
+def _squared_norms(phi):
+	'''Sum of the squared features of each row of a sparse matrix'''
+	return np.asarray(phi.multiply(phi).sum(axis = 1)).ravel()
+
+def graph_arrays(x):
+	'''
+	Extracts the weighted adjacency matrix and the node labels of a graph.
+	:param x: IPAGraph, grakel graph or iterable of adjacency matrix and node labels
+	:type x: graph
+	:returns: the adjacency matrix and the label of each node
+	:rtype: numpy array, list
+	'''
+	if hasattr(x, 'adjacency') and hasattr(x, 'node_labels'):
+		adj = x.adjacency()
+		labels = x.node_labels
+	elif hasattr(x, 'get_adjacency_matrix'):
+		adj = x.get_adjacency_matrix()
+		labels = x.get_labels()
+	else:
+		adj, labels = list(x)[:2]
+	adj = np.asarray(adj, dtype = float)
+
+	return adj, [labels[i] for i in range(adj.shape[0])]
+
+def floyd_warshall(adjacency_matrix):
+	'''
+	Shortest path matrix of a weighted graph, zero entries of the adjacency matrix are missing edges.
+	The relaxation follows the same order as grakel, giving identical path lengths.
+	'''
+	dist = np.array(adjacency_matrix, copy = True).astype(float)
+	dist[dist == 0] = float('Inf')
+	np.fill_diagonal(dist, 0)
+
+	for k in range(dist.shape[0]):
+		np.minimum(dist, dist[:, k, None] + dist[None, k, :], out = dist)
+
+	return dist
+
+def path_counts(x):
+	'''
+	Counts the (label of u, label of v, shortest path length) triples of a graph, for all pairs of different connected nodes.
+	:param x: Input graph
+	:type x: graph
+	:returns: the triples and their number of occurrences
+	:rtype: list of tuples
+	'''
+	adj, labels = graph_arrays(x)
+	n = len(labels)
+	if n < 2:
+		return []
+
+	S = floyd_warshall(adj)
+	u, v = np.nonzero(~np.eye(n, dtype = bool) & np.isfinite(S))
+	label_values, codes = np.unique(np.asarray(labels, dtype = object).astype(str), return_inverse = True)
+
+	lengths, length_codes = np.unique(S[u, v], return_inverse = True)
+	n_labels = len(label_values)
+
+	keys, counts = np.unique((codes[u]*n_labels + codes[v])*len(lengths) + length_codes, return_counts = True)
+	pairs, length_idx = np.divmod(keys, len(lengths))
+	first, second = np.divmod(pairs, n_labels)
+	label_values = label_values.tolist()
+	lengths = lengths.tolist()
+
+	return [((label_values[a], label_values[b], lengths[c]), count) for a, b, c, count in zip(first.tolist(), second.tolist(), length_idx.tolist(), counts.tolist())]
@@ -0,0 +1,147 @@
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.svm import OneClassSVM as OCSVM
+from ocsvm_training.mad_knn import MAD_KNN
+from ocsvm_training.qms import QMS2
+
+COLUMNS = ['kernel', 'method', 'K', 'nu', 'graphs', 'support_vectors', 'inliers', 'fit_time', 'gram_time', 'error']
+
+def sweep(graphs, kernels, K_values = None, nu_values = (), qms2_nu = 0.01, S_knee = 1, n_jobs = None, output = None, verbose = True):
+	'''
+	Fits OneClassSVM models for a grid of heuristics and parameters.
+	The Gram matrix is computed once for each kernel, then the nu of MAD-KNN and the QMS2 selection are computed for each K and all the models are fitted in parallel on the same matrix.
+	For each kernel the fitted models are:
+		method nu, a model for each value in nu_values trained on all the graphs
+		method mad, a model for each K trained on all the graphs with the MAD-KNN nu
+		method qms2, a model for each K trained with qms2_nu on the graphs selected by QMS2
+	A setting whose heuristic fails (e.g. QMS2 finds no knee) or whose model cannot be fitted is recorded with its error message and without results, the sweep goes on with the other settings.
+	:param graphs: Training graphs
+	:type graphs: numpy array of graphs
+	:param kernels: Kernel configurations, name and kernel
+	:type kernels: dict
+	:param K_values: Number of nearest neighbours of the heuristics, if None 3% of the graphs is used
+	:type K_values: list of int, optional
+	:param nu_values: nu values of the models trained on all the graphs
+	:type nu_values: list of float
+	:param qms2_nu: nu of the models trained on the QMS2 selection
+	:type qms2_nu: float
+	:param S_knee: Sensibility of the kneed algorithm used by QMS2
+	:type S_knee: float
+	:param n_jobs: Number of models fitted in parallel
+	:type n_jobs: int, optional
+	:param output: CSV file to which the rows are written as soon as they are produced, so that an interrupted sweep keeps the completed settings
+	:type output: str, optional
+	:returns: a row for each model, with the number of support vectors, the fraction of training graphs inside the boundary, the fit time and the error message of the failed settings
+	:rtype: pandas DataFrame
+	'''
+	if K_values is None:
+		K_values = [max(10, int(0.03*len(graphs)))]
+
+	rows = list()
+	for name, kernel in kernels.items():
+		if verbose:
+			print(f'Computing the Gram matrix of the {name} kernel')
+		start = time.perf_counter()
+		gram = kernel.fit_transform(graphs)
+		gram_time = time.perf_counter() - start
+
+		tasks = [dict(kernel = name, method = 'nu', K = np.nan, nu = nu, mask = None) for nu in nu_values]
+		for K in K_values:
+			try:
+				trainer_mad = MAD_KNN(graphs, kernel, gram)
+				trainer_mad.fit(n = K, plots = False)
+				tasks.append(dict(kernel = name, method = 'mad', K = K, nu = trainer_mad.nu, mask = None))
+			except ValueError as error:
+				_add_row(rows, {'kernel': name, 'method': 'mad', 'K': K, 'gram_time': gram_time, 'error': str(error)}, output)
+			try:
+				trainer_qms2 = QMS2(graphs, kernel, gram)
+				trainer_qms2.fit(n = K, direction = 'increasing', curve = 'concave', S_knee = S_knee, plots = False)
+				tasks.append(dict(kernel = name, method = 'qms2', K = K, nu = qms2_nu, mask = trainer_qms2.mask))
+			except ValueError as error:
+				_add_row(rows, {'kernel': name, 'method': 'qms2', 'K': K, 'nu': qms2_nu, 'gram_time': gram_time, 'error': str(error)}, output)
+
+		if verbose:
+			print(f'Fitting {len(tasks)} models')
+		# the results are returned in the order of the tasks as soon as they are available
+		results = Parallel(n_jobs = n_jobs, return_as = 'generator')(delayed(_fit_model)(gram, task['nu'], task['mask']) for task in tasks)
+		for task, result in zip(tasks, results):
+			_add_row(rows, {'kernel': task['kernel'], 'method': task['method'], 'K': task['K'], 'nu': task['nu'], 'gram_time': gram_time, **result}, output)
+
+	return pd.DataFrame(rows, columns = COLUMNS)
+
+def _add_row(rows, row, output = None):
+	'''
+	Adds a row of results, and appends it to the output file if given, the missing columns are left empty.
+	'''
+	rows.append(row)
+	if output is not None:
+		pd.DataFrame([row], columns = COLUMNS).to_csv(output, index = False, mode = 'w' if len(rows) == 1 else 'a', header = len(rows) == 1)
+
+def _fit_model(gram, nu, mask = None):
+	'''
+	Fits a precomputed OCSVM on the Gram matrix, or on the rows and columns of the selected graphs.
+	Returns the columns of the results, or the error message if the model cannot be fitted (e.g. nu not in (0, 1]).
+	'''
+	if mask is not None:
+		gram = gram[np.ix_(mask, mask)]
+	start = time.perf_counter()
+	try:
+		model = OCSVM(kernel = 'precomputed', nu = nu).fit(gram)
+	except ValueError as error:
+		return {'graphs': gram.shape[0], 'error': str(error)}
+	fit_time = time.perf_counter() - start
+	inliers = np.mean(model.decision_function(gram) >= 0)
+
+	return {'graphs': gram.shape[0], 'support_vectors': model.n_support_[0], 'inliers': inliers, 'fit_time': fit_time}
+
+def main(args):
+	from pyichem import ints
+	from ocsvm_training.shortest_path import IPAShortestPath
+
+	graphs = list()
+	for i, file in enumerate(args.file):
+		interactions = ints.Ints([], [], type_int = args.type)
+		interactions.read_map_file(file)
+		if args.folder is not None:
+			interactions.output_location = [args.folder[i]+loc for loc in interactions.output_location]
+		graphs.append(interactions.compute_graphs(subgraph = args.subgraph, graph_type = args.graph_type))
+	g = np.concatenate(graphs)
+	g = g[np.array([gt.n for gt in g]) > 2]
+	print(f'Interaction graphs generated: {len(g)}')
+
+	kernels = dict()
+	for normalize in args.normalize:
+		if args.graph_kernel == 'grakel':
+			from grakel import ShortestPath
+			kernels[normalize] = ShortestPath(normalize = normalize == 'normalized')
+		else:
+			kernels[normalize] = IPAShortestPath(normalize = normalize == 'normalized')
+
+	results = sweep(g, kernels, K_values = args.K, nu_values = args.nu, qms2_nu = args.qms2_nu, S_knee = args.sensibility, n_jobs = args.n_jobs, output = args.output)
+	print(f'Results saved as: {args.output}, failed settings: {results["error"].notna().sum()}')
+
+
+if __name__ == "__main__":
+	parser=argparse.ArgumentParser(description = 'Sweep of the OCSVM training heuristics and parameters, the Gram matrix is computed once for each kernel configuration')
+	parser.add_argument('-f', '--file', nargs = '+', help='Map file generated by a script calculating the interactions', required = True)
+	parser.add_argument('-fo', '--folder', nargs = '+', default = None, help='Folder conatining the interaction files')
+	parser.add_argument('-t', '--type', default = 'MERG', help='Type of interactions used in interaction detection.\navailble types: MERG, CENT, LIG, PROT')
+	parser.add_argument('-sg', '--subgraph', default = None, help='Available subgraph types: CENT, LIG, PROT, ELEC')
+	parser.add_argument('-gt', '--graph_type', default = 'grakel', choices = ['grakel', 'compact'], help = 'Format of the interaction graphs held in memory')
+	parser.add_argument('-gk', '--graph_kernel', default = 'grakel', choices = ['ipa', 'grakel'], help = 'Implementation of the ShortestPath kernel, grakel or explicit sparse features (ipa)')
+	parser.add_argument('-n', '--normalize', nargs = '+', default = ['normalized', 'unnormalized'], choices = ['normalized', 'unnormalized'], help = 'Kernel configurations tested')
+	parser.add_argument('-K', '--K', type = int, nargs = '+', default = None, help = 'Number of nearest neighbours of MAD-KNN and QMS2, by default 3%% of the graphs')
+	parser.add_argument('-nu', '--nu', type = float, nargs = '+', default = [0.01, 0.05, 0.1], help = 'nu values of the models trained on all the graphs')
+	parser.add_argument('-qn', '--qms2_nu', type = float, default = 0.01, help = 'nu of the models trained on the QMS2 selection')
+	parser.add_argument('-s', '--sensibility', type = float, default = 1, help = 'Sensibility of the kneed algorithm used by QMS2')
+	parser.add_argument('-j', '--n_jobs', type = int, default = None, help = 'Number of models fitted in parallel')
+	parser.add_argument('-o', '--output', default = 'sweep_results.csv', help = 'Name of the results table')
+
+	parser.set_defaults(func=main)
+	args=parser.parse_args()
+	status = args.func(args)
+	sys.exit(status)
@@ -8,6 +8,6 @@ setup(name='ocsvm_training',
       author_email='luca.chiesa@unistra.com',
       license='MIT',
       packages=['ocsvm_training'],
-      install_requires=['numpy', 'matplotlib', 'kneed', 'scipy'],
+      install_requires=['numpy', 'matplotlib', 'kneed', 'scipy', 'scikit-learn', 'pandas', 'grakel'],
       include_package_data=True,
       zip_safe=False)
\ No newline at end of file
@@ -0,0 +1,68 @@
+import warnings
+import numpy as np
+import pytest
+from test_shortest_path import random_graphs
+from ocsvm_training.shortest_path import IPAShortestPath
+from ocsvm_training.ann import LSHNeighbours
+from ocsvm_training.mad_knn import MAD_KNN
+
+@pytest.mark.parametrize('normalize', [True, False])
+@pytest.mark.parametrize('candidates', [2, 4])
+def test_neighbours(normalize, candidates):
+	'''The neighbours are distinct, include the graph itself with normalized kernels, their values are the exact kernel values and the cost does not grow with the number of graphs'''
+	graphs = random_graphs(0, 300, 'compact', 1)
+	n = 9
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		kernel = IPAShortestPath(normalize = normalize)
+		gram = kernel.fit_transform(graphs)
+	approximate = LSHNeighbours(candidates = candidates)
+	vals, idx = approximate.neighbours(kernel, n)
+
+	assert idx.shape == (len(graphs), n+1)
+	assert np.all(idx >= 0)
+	assert all(len(np.unique(row)) == n+1 for row in idx)
+	if normalize:
+		# without normalization other graphs can be more similar than the graph itself
+		assert np.all(np.any(idx == np.arange(len(graphs))[:, None], axis = 1))
+	assert np.array_equal(vals, gram[np.arange(len(graphs))[:, None], idx])
+	# tiles of the band of the window, about twice the candidates of each graph
+	assert approximate.n_evaluations <= 2*(candidates+1)*(n+1)*len(graphs)
+
+@pytest.mark.parametrize('n_tables', [1, 4])
+def test_small_window(n_tables):
+	'''With the smallest number of candidates every graph still has n+1 distinct neighbours, at the ends of the orderings too'''
+	graphs = random_graphs(0, 200, 'compact', 1)
+	n = 20
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		kernel = IPAShortestPath(normalize = True).fit(graphs)
+	approximate = LSHNeighbours(n_tables = n_tables, candidates = 1)
+	vals, idx = approximate.neighbours(kernel, n)
+
+	assert np.all(np.isfinite(vals))
+	assert all(len(np.unique(row)) == n+1 for row in idx)
+	assert np.all(np.isfinite(approximate.knn_average(kernel, n)))
+
+def test_mad_fit():
+	'''MAD-KNN on the approximate values gives the exact nu when all the pairs are compared, and a clear error instead of nu = 0'''
+	# frames repeating 10 conformations, with 20 unrelated graphs as outliers
+	graphs = np.concatenate([random_graphs(0, 10, 'compact', 1)]*10 + [random_graphs(1, 20, 'compact', 1)])
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		exact = MAD_KNN(graphs, IPAShortestPath(normalize = True), IPAShortestPath(normalize = True).fit_transform(graphs))
+		exact.fit(find_n = True, plots = False)
+		approximate = MAD_KNN(graphs, IPAShortestPath(normalize = True), approximate = LSHNeighbours())
+		approximate.fit(find_n = True, plots = False)
+		# the window covers all the graphs
+		complete = MAD_KNN(graphs, IPAShortestPath(normalize = True), approximate = LSHNeighbours(candidates = 100))
+		complete.fit(find_n = True, plots = False)
+
+		# 12 copies of each graph, none of them is an outlier
+		copies = MAD_KNN(np.concatenate([random_graphs(0, 10, 'compact', 1)]*12), IPAShortestPath(normalize = True), approximate = LSHNeighbours())
+		with pytest.raises(ValueError, match = 'number of candidates'):
+			copies.fit(find_n = True, plots = False)
+
+	assert 0 < approximate.nu < 1
+	assert complete.nu == exact.nu
+	assert copies.nu == 0
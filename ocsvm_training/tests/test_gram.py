@@ -0,0 +1,56 @@
+import warnings
+import numpy as np
+import pytest
+from test_shortest_path import random_graphs
+from ocsvm_training.shortest_path import IPAShortestPath
+from ocsvm_training.gram import BlockedGram
+
+def _gram(graphs, folder, normalize = True):
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		return np.array(BlockedGram(IPAShortestPath(normalize = normalize), folder, tile_size = 16, verbose = False).compute(graphs))
+
+def test_resume(tmp_path):
+	'''An interrupted computation restarts from the missing tiles only'''
+	graphs = random_graphs(0, 50, 'compact', 1)
+	expected = _gram(graphs, str(tmp_path/'full'))
+
+	blocked = BlockedGram(IPAShortestPath(normalize = True), str(tmp_path/'resumed'), tile_size = 16, verbose = False)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		gram = blocked.compute(graphs)
+	done = np.lib.format.open_memmap(blocked.progress_file, mode = 'r+')
+	# the last tile is lost, the first one is marked so that recomputing it would be noticed
+	done[3, 3] = 0
+	done.flush()
+	gram[48:, 48:] = 0
+	gram[:16, :16] = -1
+	gram.flush()
+	del gram, done
+	resumed = _gram(graphs, str(tmp_path/'resumed'))
+
+	assert np.array_equal(resumed[48:, 48:], expected[48:, 48:], equal_nan = True)
+	assert np.all(resumed[:16, :16] == -1)
+
+def test_other_graphs(tmp_path):
+	'''A folder left by other graphs or kernel settings of the same size is recomputed'''
+	graphs = random_graphs(0, 40, 'compact', 1)
+	other = random_graphs(1, 40, 'compact', 1)
+	_gram(graphs, str(tmp_path))
+
+	assert np.array_equal(_gram(other, str(tmp_path)), _gram(other, str(tmp_path/'other')), equal_nan = True)
+	assert np.array_equal(_gram(other, str(tmp_path), normalize = False), _gram(other, str(tmp_path/'raw'), normalize = False), equal_nan = True)
+
+@pytest.mark.parametrize('normalize', [True, False])
+@pytest.mark.parametrize('n_jobs, tile_size', [(1, 64), (3, 64), (4, 37), (2, 1000), (3, 7)])
+def test_parallel(tmp_path, normalize, n_jobs, tile_size):
+	'''The parallel Gram matrix is bit-identical to the serial one whatever the number of processes and the tiles, also when they do not divide the number of graphs'''
+	graphs = random_graphs(0, 150, 'compact', 1)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		serial = IPAShortestPath(normalize = normalize).fit_transform(graphs)
+		parallel = IPAShortestPath(normalize = normalize, n_jobs = n_jobs, tile_size = tile_size).fit_transform(graphs)
+		blocked = np.array(BlockedGram(IPAShortestPath(normalize = normalize), str(tmp_path), tile_size = tile_size, n_jobs = n_jobs, verbose = False).compute(graphs))
+
+	assert np.array_equal(parallel, serial, equal_nan = True)
+	assert np.array_equal(blocked, serial, equal_nan = True)
@@ -0,0 +1,29 @@
+import multiprocessing
+import numpy as np
+from ocsvm_training.gram_store import GramStore
+
+def test_round_trip(tmp_path):
+	'''Stored matrices are loaded memory mapped and identical, NaN values included'''
+	gram = np.random.default_rng(0).uniform(size = (50, 50))
+	gram[3, 7] = np.nan
+	store = GramStore(str(tmp_path), block_size = 16)
+	store.put('key', gram)
+	loaded = store.get('key')
+
+	assert isinstance(loaded, np.memmap)
+	assert np.array_equal(loaded, gram, equal_nan = True)
+	assert store.get('missing') is None
+
+def _put(folder, key):
+	GramStore(folder).put(key, np.full((20, 20), float(key)))
+
+def test_concurrent_puts(tmp_path):
+	'''Processes sharing a store do not lose each other's entries'''
+	keys = [str(i) for i in range(8)]
+	with multiprocessing.get_context('fork').Pool(4) as pool:
+		pool.starmap(_put, [(str(tmp_path), key) for key in keys])
+	store = GramStore(str(tmp_path))
+
+	assert sorted(store._read_index()) == keys
+	for key in keys:
+		assert np.all(store.get(key) == float(key))
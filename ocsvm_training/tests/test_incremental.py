@@ -0,0 +1,41 @@
+import os
+import warnings
+import numpy as np
+import pytest
+from test_shortest_path import random_graphs
+from ocsvm_training.shortest_path import IPAShortestPath
+from ocsvm_training.incremental import IncrementalGram
+
+SETTINGS = {'type': 'MERG', 'subgraph': None, 'graph_type': 'compact'}
+
+@pytest.mark.parametrize('normalize', [True, False])
+def test_update(tmp_path, normalize):
+	'''Updates from the stored state give the same graphs and Gram matrix as a full rebuild'''
+	parts = [random_graphs(seed, 30, 'compact', 1) for seed in range(3)]
+	folder = str(tmp_path)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		for i, part in enumerate(parts):
+			incremental = IncrementalGram(folder, IPAShortestPath(normalize = normalize), tile_size = 16, settings = SETTINGS)
+			graphs, gram, _ = incremental.update([f'map_{i}.csv'], part)
+		expected = IPAShortestPath(normalize = normalize).fit_transform(np.concatenate(parts))
+
+	assert len(graphs) == 90
+	assert np.array_equal(gram, expected, equal_nan = True)
+	# only the files of the last version are kept
+	assert sorted(os.listdir(folder)) == ['gram_3.npy', 'graphs_3.sav', 'kernel_3.sav', 'state.sav']
+
+def test_no_new_graphs(tmp_path):
+	'''Sources without graphs reuse the stored matrix, other graph settings are rejected'''
+	folder = str(tmp_path)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		_, gram, _ = IncrementalGram(folder, IPAShortestPath(), settings = SETTINGS).update(['map_0.csv'], random_graphs(0, 20, 'compact', 1))
+	incremental = IncrementalGram(folder, IPAShortestPath(), settings = SETTINGS)
+	_, same, _ = incremental.update(['empty.csv'], np.array([], dtype = object))
+
+	assert same.filename == gram.filename
+	assert np.array_equal(same, gram, equal_nan = True)
+	assert IncrementalGram(folder, IPAShortestPath(), settings = SETTINGS).sources == ['map_0.csv', 'empty.csv']
+	with pytest.raises(ValueError):
+		IncrementalGram(folder, IPAShortestPath(), settings = dict(SETTINGS, subgraph = 'LIG'))
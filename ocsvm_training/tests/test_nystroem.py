@@ -0,0 +1,80 @@
+import warnings
+import numpy as np
+import pytest
+from sklearn.svm import OneClassSVM
+from test_shortest_path import random_graphs
+from ocsvm_training.shortest_path import IPAShortestPath
+from ocsvm_training.nystroem import NystroemOCSVM, nystroem_training
+from ocsvm_training.knn import TiledNeighbours
+from ocsvm_training.mad_knn import MAD_KNN
+from ocsvm_training.qms import QMS2
+
+def md_graphs():
+	'''Frames repeating 10 conformations, with 20 unrelated graphs as outliers'''
+	return np.concatenate([random_graphs(0, 10, 'compact', 1)]*10 + [random_graphs(1, 20, 'compact', 1)])
+
+@pytest.mark.parametrize('nu', [0.1, 0.5])
+def test_all_landmarks(nu):
+	'''With all the graphs as landmarks the features reproduce the kernel and the libsvm model is the exact OCSVM'''
+	graphs = random_graphs(0, 80, 'compact', 1)
+	test = random_graphs(1, 40, 'compact', 1)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		kernel = IPAShortestPath(normalize = True)
+		gram = np.nan_to_num(kernel.fit_transform(graphs))
+		test_gram = np.nan_to_num(kernel.transform(test))
+	exact = OneClassSVM(kernel = 'precomputed', nu = nu).fit(gram)
+	model = NystroemOCSVM(nu = nu).fit(gram, gram)
+
+	features = model.transform(gram)
+	assert np.allclose(features @ features.T, gram, atol = 1e-6)
+	assert np.allclose(model.decision_function(test_gram), exact.decision_function(test_gram), atol = 1e-3)
+	assert model.n_landmarks_ == len(graphs)
+
+@pytest.mark.parametrize('solver', ['libsvm', 'sgd'])
+def test_training(solver):
+	'''The kernel is fitted on the landmarks only, the sgd models have landmarks and no support vectors'''
+	graphs = random_graphs(0, 80, 'compact', 1)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		kernel, model, gram = nystroem_training(graphs, IPAShortestPath(normalize = True), 0.1, 20, solver)
+		scores = model.decision_function(kernel.transform(graphs))
+
+	assert gram.shape == (80, 20)
+	assert kernel.features().shape[0] == 20
+	assert model.n_landmarks_ == 20
+	assert np.all(np.isfinite(scores))
+	assert hasattr(model, 'n_support_') == (solver == 'libsvm')
+
+def test_heuristics_without_gram():
+	'''The heuristics of the Nyström training (-ny) computed by blocks of rows give the nu and knee of the exact path, and the models are trained on them'''
+	graphs = md_graphs()
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		gram = IPAShortestPath(normalize = True).fit_transform(graphs)
+		exact_mad = MAD_KNN(graphs, IPAShortestPath(normalize = True), gram)
+		exact_mad.fit(find_n = True, plots = False)
+		exact_qms2 = QMS2(graphs, IPAShortestPath(normalize = True), gram)
+		exact_qms2.fit(find_n = True, direction = 'increasing', curve = 'concave', plots = False)
+
+		tiled = TiledNeighbours(block_size = 50)
+		trainer_mad = MAD_KNN(graphs, IPAShortestPath(normalize = True), approximate = tiled)
+		trainer_mad.fit(find_n = True, plots = False)
+		trainer_qms2 = QMS2(graphs, IPAShortestPath(normalize = True), approximate = tiled)
+		fitted_graphs = trainer_qms2.fit(find_n = True, direction = 'increasing', curve = 'concave', plots = False)
+
+		mad_kernel, mad_model, _ = nystroem_training(graphs, trainer_mad.kernel, trainer_mad.nu, 30)
+		qms2_kernel, qms2_model, _ = nystroem_training(fitted_graphs, trainer_qms2.kernel, 0.01, 30)
+
+	assert 0 < exact_mad.nu < 1
+	assert trainer_mad.nu == exact_mad.nu
+	assert trainer_qms2.knee == exact_qms2.knee
+	assert np.array_equal(trainer_qms2.mask, exact_qms2.mask)
+	assert not hasattr(trainer_mad, 'dist') and tiled.n_evaluations == len(graphs)**2
+	# the kernels fitted on all the graphs by the heuristics are not copied, the saved kernels hold only the landmarks
+	assert trainer_mad.kernel.features().shape[0] == len(graphs)
+	assert mad_kernel.features().shape[0] == qms2_kernel.features().shape[0] == 30
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		assert np.all(np.isfinite(mad_model.decision_function(mad_kernel.transform(graphs))))
+		assert np.all(np.isfinite(qms2_model.decision_function(qms2_kernel.transform(graphs))))
@@ -0,0 +1,55 @@
+import warnings
+import numpy as np
+import pytest
+from sklearn.svm import OneClassSVM
+from test_shortest_path import random_graphs
+from ocsvm_training.shortest_path import IPAShortestPath, QueryFeatures
+from ocsvm_training.prefilter import decision_bound
+
+@pytest.mark.parametrize('bin_width', [None, 2.0, 0.5])
+@pytest.mark.parametrize('nu', [0.1, 0.5])
+@pytest.mark.parametrize('normalize', [True, False])
+def test_bound(normalize, nu, bin_width):
+	'''Both levels of the bound are above the exact decision values, the pruned poses have negative decision values'''
+	train = random_graphs(0, 80, 'compact', 1)
+	test = random_graphs(1, 60, 'compact', 1)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		kernel = IPAShortestPath(normalize = normalize)
+		gram = np.nan_to_num(kernel.fit_transform(train))
+		model = OneClassSVM(kernel = 'precomputed', nu = nu).fit(gram)
+		decision = model.decision_function(np.nan_to_num(kernel.transform(test)))
+
+	bound = decision_bound(kernel, model, bin_width)
+	query = QueryFeatures(test)
+	norms, _ = bound._query_norms(query)
+	tolerance = 1e-9*(1 + np.abs(decision))
+	assert np.all(bound._first_level(norms, query.diag) >= decision - tolerance)
+	assert np.all(bound._second_level(norms, query.diag) >= decision - tolerance)
+	assert np.all(bound.bound(query) >= decision - tolerance)
+	assert np.all(decision[bound.prunable(query)] < 0)
+
+@pytest.mark.parametrize('calibration_size', [10, 1000])
+def test_decision(calibration_size):
+	'''The exact decision values are kept for the poses not pruned, the pruned poses get their negative bound'''
+	train = random_graphs(0, 80, 'compact', 1)
+	test = random_graphs(1, 60, 'compact', 1)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		kernel = IPAShortestPath(normalize = True)
+		model = OneClassSVM(kernel = 'precomputed', nu = 0.5).fit(np.nan_to_num(kernel.fit_transform(train)))
+		decision = model.decision_function(np.nan_to_num(kernel.transform(test)))
+
+	bound = decision_bound(kernel, model, 2.0)
+	bound.calibration_size = calibration_size
+	query = QueryFeatures(test)
+	values, pruned = bound.decision(query, lambda index: decision[index])
+
+	assert bound.n_levels in (0, 1, 2)
+	if calibration_size > len(test):
+		# all the poses are in the calibration, both levels are applied
+		assert np.array_equal(pruned, bound.prunable(query))
+	assert np.array_equal(values[~pruned], decision[~pruned])
+	assert np.all(values[pruned] < 0)
+	assert np.all(values[pruned] >= decision[pruned] - 1e-9*(1 + np.abs(decision[pruned])))
+	assert np.array_equal(values >= 0, decision >= 0)
@@ -0,0 +1,158 @@
+import os
+import hashlib
+import warnings
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pytest
+from ocsvm_training.score_cache import ScoreCache, file_key, pose_keys
+from test_scoring import write_poses, read_poses, train_models, scoring_args, run_scoring
+
+OPTIONS = {'type': 'MERG', 'subgraph': None, 'graph_type': 'compact'}
+
+def fake_keys(start, n):
+	return [hashlib.sha256(str(i).encode()).hexdigest() for i in range(start, start + n)]
+
+def put_scores(folder, model_key, start, n, n_puts):
+	'''Scores added one small batch at a time, as by a scoring run'''
+	cache = ScoreCache(folder)
+	keys = fake_keys(start, n)
+	for batch in np.array_split(np.arange(n), n_puts):
+		cache.put(model_key, [keys[j] for j in batch], (start + batch)/1000)
+
+def test_put_get(tmp_path):
+	'''The scores put are found, NaN scores included, other poses and other models are missing'''
+	cache = ScoreCache(str(tmp_path/'cache'))
+	keys = fake_keys(0, 5)
+	cache.put('model', keys[:3], [0.5, np.nan, -1.0])
+	scores, found = cache.get('model', keys)
+
+	assert found.tolist() == [True, True, True, False, False]
+	assert np.array_equal(scores, [0.5, np.nan, -1.0, np.nan, np.nan], equal_nan = True)
+	assert not cache.get('other_model', keys)[1].any()
+
+	cache.put('model', keys[2:], [2.0, 3.0, 4.0])
+	scores, found = cache.get(model_key = 'model', pose_keys = keys)
+	assert found.all()
+	assert np.array_equal(scores, [0.5, np.nan, 2.0, 3.0, 4.0], equal_nan = True)
+
+def test_missing_pose(tmp_path):
+	'''Poses without IPA file have no key, they are never stored nor found'''
+	map_file = write_poses(str(tmp_path/'poses'), 4, 0)
+	files = [f'{output}_INTS_M.mol2' for output in pd.read_csv(map_file)['Output_file']]
+	os.remove(files[1])
+	keys = pose_keys(files, OPTIONS)
+	assert keys[1] is None and None not in keys[:1] + keys[2:]
+
+	cache = ScoreCache(str(tmp_path/'cache'))
+	cache.put('model', keys, [0.1, 0.2, 0.3, 0.4])
+	scores, found = cache.get('model', keys)
+	assert found.tolist() == [True, False, True, True]
+	assert np.isnan(scores[1])
+	assert len(np.load(os.path.join(cache.folder, 'model.npz'))['keys']) == 3
+
+def test_pose_keys(tmp_path):
+	'''The key of a pose depends on the content of its IPA file and on the graph options, not on its path'''
+	map_file = write_poses(str(tmp_path/'poses'), 3, 0)
+	files = [f'{output}_INTS_M.mol2' for output in pd.read_csv(map_file)['Output_file']]
+	keys = pose_keys(files, OPTIONS)
+	assert len(set(keys)) == 3
+
+	moved = str(tmp_path/'moved.mol2')
+	os.rename(files[0], moved)
+	assert pose_keys([moved], OPTIONS) == keys[:1]
+	assert pose_keys([moved], {**OPTIONS, 'subgraph': 'LIG'}) != keys[:1]
+
+	cache = ScoreCache(str(tmp_path/'cache'))
+	cache.put('model', keys, [0.1, 0.2, 0.3])
+	with open(files[1], 'a') as mol2:
+		mol2.write('\n')
+	scores, found = cache.get('model', pose_keys([moved] + files[1:], OPTIONS))
+	assert found.tolist() == [True, False, True]
+	assert np.array_equal(scores, [0.1, np.nan, 0.3], equal_nan = True)
+
+def test_file_key(tmp_path):
+	'''A modified model and the prefilter give new model keys, their scores are not mixed with the exact ones'''
+	kernel_file, model_file = str(tmp_path/'kernel.sav'), str(tmp_path/'model.sav')
+	for file in [kernel_file, model_file]:
+		with open(file, 'wb') as f:
+			f.write(os.urandom(64))
+	key = file_key([kernel_file, model_file])
+	prefilter_key = file_key([kernel_file, model_file], {'prefilter': 2.0})
+
+	assert file_key([kernel_file, model_file]) == key
+	assert len({key, prefilter_key, file_key([kernel_file, model_file], {'prefilter': 0.0}), file_key([model_file, kernel_file])}) == 4
+
+	cache = ScoreCache(str(tmp_path/'cache'))
+	keys = fake_keys(0, 3)
+	cache.put(key, keys, [0.1, 0.2, 0.3])
+	cache.put(prefilter_key, keys[:2], [-0.5, 0.2])
+	assert np.array_equal(cache.get(key, keys)[0], [0.1, 0.2, 0.3])
+	assert cache.get(prefilter_key, keys)[1].tolist() == [True, True, False]
+	assert np.array_equal(cache.get(prefilter_key, keys)[0][:2], [-0.5, 0.2])
+
+	with open(model_file, 'ab') as f:
+		f.write(b'\0')
+	assert not cache.get(file_key([kernel_file, model_file]), keys)[1].any()
+
+def test_concurrent_put(tmp_path):
+	'''Processes adding scores to the same model at the same time keep all the scores'''
+	folder = str(tmp_path/'cache')
+	processes = [multiprocessing.Process(target = put_scores, args = (folder, 'model', 100*i, 100, 25)) for i in range(4)]
+	for process in processes:
+		process.start()
+	for process in processes:
+		process.join()
+	assert all(process.exitcode == 0 for process in processes)
+
+	scores, found = ScoreCache(folder).get('model', fake_keys(0, 400))
+	assert found.all()
+	assert np.array_equal(scores, np.arange(400)/1000)
+	assert sorted(file for file in os.listdir(folder) if not file.endswith('.lock')) == ['model.npz']
+
+def test_unreadable(tmp_path):
+	'''A corrupted file is an empty cache with a warning, it is replaced by the next scores'''
+	cache = ScoreCache(str(tmp_path/'cache'))
+	keys = fake_keys(0, 2)
+	with open(os.path.join(cache.folder, 'model.npz'), 'wb') as f:
+		f.write(b'PK\x03\x04 truncated')
+
+	with pytest.warns(UserWarning, match = 'cannot be read'):
+		assert not cache.get('model', keys)[1].any()
+	with pytest.warns(UserWarning, match = 'cannot be read'):
+		cache.put('model', keys, [0.1, 0.2])
+	with warnings.catch_warnings():
+		warnings.simplefilter('error')
+		assert cache.get('model', keys)[1].all()
+
+@pytest.mark.parametrize('prefilter', [None, 2.0])
+def test_cached_main(tmp_path, monkeypatch, prefilter):
+	'''Runs with the cache give the tables of a run without it, only the modified poses are scored again'''
+	monkeypatch.chdir(tmp_path)
+	kernel_files, model_files = train_models(str(tmp_path))
+	map_file = write_poses(str(tmp_path/'poses'), 30, 1, small = (3,))
+	cache = str(tmp_path/'cache')
+
+	expected = run_scoring(str(tmp_path/'no_cache'), monkeypatch, scoring_args(kernel_files, model_files, map_file, prefilter = prefilter))
+	first = run_scoring(str(tmp_path/'first'), monkeypatch, scoring_args(kernel_files, model_files, map_file, prefilter = prefilter, cache = cache, batch_size = 7))
+	second = run_scoring(str(tmp_path/'second'), monkeypatch, scoring_args(kernel_files, model_files, map_file, prefilter = prefilter, cache = cache))
+	with open(tmp_path/'second'/'rescoring_report.txt') as report:
+		assert '60 / 60 scores reused' in report.read()
+
+	for table, cached_table, reference in zip(first, second, expected):
+		pd.testing.assert_frame_equal(cached_table, table)
+		if prefilter is None:
+			pd.testing.assert_frame_equal(table, reference)
+		else:
+			assert np.array_equal(table['Score'] >= 0, reference['Score'] >= 0)
+
+	# the IPA file of a pose is replaced, only this pose is scored again
+	ipa_files = read_poses(map_file).ipa_files()
+	write_poses(str(tmp_path/'new_poses'), 30, 2)
+	os.replace(str(tmp_path/'new_poses'/'pose_5_INTS_M.mol2'), ipa_files[5])
+	third = run_scoring(str(tmp_path/'third'), monkeypatch, scoring_args(kernel_files, model_files, map_file, prefilter = prefilter, cache = cache, n_jobs = 2))
+	with open(tmp_path/'third'/'rescoring_report.txt') as report:
+		assert '58 / 60 scores reused (hit rate 96.67%), 1 poses scored' in report.read()
+	for table, cached_table in zip(third, second):
+		assert table.drop(index = 5).equals(cached_table.drop(index = 5))
+		assert table['Score'][5] != cached_table['Score'][5]
@@ -0,0 +1,165 @@
+import os
+import sys
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+import joblib
+from sklearn.svm import OneClassSVM
+from pyichem import ints
+from pyichem.tables import read_table, table_name
+from test_shortest_path import LABELS
+from ocsvm_training.shortest_path import IPAShortestPath
+from ocsvm_training.prefilter import decision_bound
+
+# scoring.py is a script at the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import scoring
+
+def write_poses(folder, n_poses, seed, small = ()):
+	'''
+	IPA files of random poses and their map file, as written by compute_interactions.py with the MERG interaction type.
+	The poses in small have two IPAs, their graphs are not scored.
+	:returns: the map file
+	:rtype: str
+	'''
+	rng = np.random.default_rng(seed)
+	os.makedirs(folder, exist_ok = True)
+	outputs = list()
+	for i in range(n_poses):
+		n_ipas = 2 if i in small else rng.integers(4, 20)
+		coordinates = rng.uniform(0, 12, size = (n_ipas, 3))
+		labels = rng.choice(LABELS[:rng.integers(4, len(LABELS))], size = n_ipas)
+		outputs.append(os.path.join(folder, f'pose_{i}'))
+		with open(f'{outputs[-1]}_INTS_M.mol2', 'w') as mol2:
+			mol2.write(f'@<TRIPOS>MOLECULE\nIPA\n{n_ipas} 0 0 0 0\nSMALL\nNO_CHARGES\n\n@<TRIPOS>ATOM\n')
+			for j, (xyz, label) in enumerate(zip(coordinates, labels)):
+				mol2.write(f'{j+1:7d} X{j+1:<5d} {xyz[0]:10.4f} {xyz[1]:10.4f} {xyz[2]:10.4f} Du {j+1:5d} {label:<8s} 0.0000\n')
+			mol2.write('@<TRIPOS>BOND\n')
+	map_file = os.path.join(folder, 'map.csv')
+	pd.DataFrame({'Receptor_file': [f'frame_{i % 3}.mol2' for i in range(n_poses)], 'Ligand_file': [f'ligand_{i}.mol2' for i in range(n_poses)], 'Output_file': outputs}).to_csv(map_file, index = False)
+
+	return map_file
+
+def read_poses(map_file):
+	interactions = ints.Ints([], [])
+	interactions.read_map_file(map_file)
+
+	return interactions
+
+def train_models(folder, nu_values = (0.1, 0.5)):
+	'''
+	Kernel and model files of OCSVM models trained on random poses.
+	:returns: the kernel files and the model files
+	:rtype: list of str, list of str
+	'''
+	graphs = read_poses(write_poses(os.path.join(folder, 'training'), 60, 0)).compute_graphs(graph_type = 'compact')
+	kernel_files, model_files = list(), list()
+	for i, nu in enumerate(nu_values):
+		kernel = IPAShortestPath(normalize = True)
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', RuntimeWarning)
+			gram = np.nan_to_num(kernel.fit_transform(graphs))
+		kernel_files.append(os.path.join(folder, f'kernel_{i}.sav'))
+		model_files.append(os.path.join(folder, f'model_{i}.sav'))
+		joblib.dump(kernel, kernel_files[-1])
+		joblib.dump(OneClassSVM(kernel = 'precomputed', nu = nu).fit(gram), model_files[-1])
+
+	return kernel_files, model_files
+
+def load_models(kernel_files, model_files, prefilter):
+	kernels = [joblib.load(file) for file in kernel_files]
+	models = [joblib.load(file) for file in model_files]
+	bounds = [None]*len(models)
+	if prefilter:
+		bounds = [decision_bound(kernel, model, bin_width = 2.0) for kernel, model in zip(kernels, models)]
+		for bound in bounds:
+			# the calibration depends on measured times, both levels are used so that the pruned poses do not depend on it
+			bound.n_levels = 2
+
+	return kernels, models, bounds
+
+def scoring_args(kernel_files, model_files, map_file, **options):
+	'''Arguments of scoring.py, with the defaults of its parser'''
+	args = dict(model = model_files, kernel = kernel_files, file = map_file, folder = None, type = 'MERG', subgraph = None, graph_type = 'compact', report = 'rescoring_report.txt', batch_size = None, prefilter = None, prefilter_check = False, cache = None, output_format = 'csv', n_jobs = None)
+	args.update(options)
+
+	return argparse.Namespace(**args)
+
+def run_scoring(folder, monkeypatch, args):
+	'''
+	Runs scoring.py in a new folder.
+	:returns: the MD_rescoring tables of the models
+	:rtype: list of pandas DataFrame
+	'''
+	os.makedirs(folder)
+	monkeypatch.chdir(folder)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		scoring.main(args)
+
+	return [read_table(os.path.join(folder, table_name(f'MD_rescoring_{i}', args.output_format))) for i in range(len(args.model))]
+
+def concatenate(batches, n_models):
+	'''Scores and pruned flags of each model over all the batches'''
+	return [(np.concatenate([scores[i][0] for scores, _ in batches]), np.concatenate([scores[i][1] for scores, _ in batches])) for i in range(n_models)]
+
+@pytest.mark.parametrize('prefilter', [False, True])
+@pytest.mark.parametrize('batch_size', [7, 50])
+def test_parallel(tmp_path, monkeypatch, prefilter, batch_size):
+	'''The processes sharing the memory mapped models give the scores and the order of the serial scoring'''
+	monkeypatch.chdir(tmp_path)
+	kernel_files, model_files = train_models(str(tmp_path))
+	interactions = read_poses(write_poses(str(tmp_path/'poses'), 40, 1, small = (3, 17)))
+
+	results = dict()
+	for n_jobs in [None, 2]:
+		kernels, models, bounds = load_models(kernel_files, model_files, prefilter)
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', RuntimeWarning)
+			results[n_jobs] = list(scoring.iter_scores(interactions, kernels, models, batch_size, n_jobs, graph_type = 'compact', bounds = bounds))
+
+	assert [n for _, n in results[None]] == [n for _, n in results[2]]
+	assert sum(n for _, n in results[2]) == 38
+	for (serial, serial_pruned), (parallel, parallel_pruned) in zip(concatenate(results[None], 2), concatenate(results[2], 2)):
+		assert np.array_equal(parallel, serial, equal_nan = True)
+		assert np.array_equal(parallel_pruned, serial_pruned)
+		assert np.flatnonzero(np.isnan(parallel)).tolist() == [3, 17]
+		assert prefilter or not parallel_pruned.any()
+	if prefilter:
+		assert any(pruned.any() for _, pruned in concatenate(results[2], 2))
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet', 'npz'])
+@pytest.mark.parametrize('n_jobs', [None, 2])
+def test_batch_main(tmp_path, monkeypatch, output_format, n_jobs):
+	'''Scoring in batches appends or accumulates the rows of the tables written by a single scoring'''
+	monkeypatch.chdir(tmp_path)
+	kernel_files, model_files = train_models(str(tmp_path))
+	map_file = write_poses(str(tmp_path/'poses'), 40, 1, small = (3, 17))
+
+	expected = run_scoring(str(tmp_path/'single'), monkeypatch, scoring_args(kernel_files, model_files, map_file, output_format = output_format))
+	tables = run_scoring(str(tmp_path/'batches'), monkeypatch, scoring_args(kernel_files, model_files, map_file, output_format = output_format, batch_size = 7, n_jobs = n_jobs))
+
+	for table, reference in zip(tables, expected):
+		assert len(table) == 40
+		assert table['Score'].isna().sum() == 2
+		pd.testing.assert_frame_equal(table, reference)
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+def test_batch_main_prefilter(tmp_path, monkeypatch, output_format):
+	'''With the prefilter the batches select the poses of a single scoring, the scores of the poses evaluated in both runs are the same'''
+	monkeypatch.chdir(tmp_path)
+	kernel_files, model_files = train_models(str(tmp_path))
+	map_file = write_poses(str(tmp_path/'poses'), 40, 1, small = (3, 17))
+
+	expected = run_scoring(str(tmp_path/'single'), monkeypatch, scoring_args(kernel_files, model_files, map_file, output_format = output_format, prefilter = 2.0))
+	tables = run_scoring(str(tmp_path/'batches'), monkeypatch, scoring_args(kernel_files, model_files, map_file, output_format = output_format, prefilter = 2.0, batch_size = 7))
+
+	for table, reference in zip(tables, expected):
+		assert list(table.columns) == list(reference.columns) == ['Protein structure', 'Ligand pose', 'Score', 'Pruned']
+		assert table['Ligand pose'].tolist() == reference['Ligand pose'].tolist()
+		# the pruned poses depend on the calibration of the levels of the bound, not the selected ones
+		assert np.array_equal(table['Score'] >= 0, reference['Score'] >= 0)
+		exact = ~(table['Pruned'] | reference['Pruned'])
+		assert np.array_equal(table['Score'][exact], reference['Score'][exact], equal_nan = True)
@@ -0,0 +1,46 @@
+import warnings
+import joblib
+import numpy as np
+import pytest
+from grakel import ShortestPath
+from sklearn.svm import OneClassSVM
+from test_shortest_path import random_graphs
+from ocsvm_training.shortest_path import IPAShortestPath
+from ocsvm_training.scoring_model import ScoringModel, export_scoring_model
+
+def _fit(kernel, train, nu):
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		gram = np.nan_to_num(kernel.fit_transform(train))
+	return OneClassSVM(kernel = 'precomputed', nu = nu).fit(gram), gram
+
+@pytest.mark.parametrize('nu', [0.05, 0.5])
+def test_decision_function(nu):
+	'''The decision values computed from the support vectors are the ones of OneClassSVM'''
+	train = random_graphs(0, 80, 'compact', 1)
+	kernel = IPAShortestPath(normalize = True)
+	model, gram = _fit(kernel, train, nu)
+	scoring_model = ScoringModel(None, model.dual_coef_[0], model.intercept_[0])
+
+	assert np.allclose(scoring_model.decision_function(gram[:, model.support_]), model.decision_function(gram))
+
+@pytest.mark.parametrize('normalize', [True, False])
+@pytest.mark.parametrize('kernel_type, graph_type', [(IPAShortestPath, 'compact'), (ShortestPath, 'grakel')])
+def test_export(tmp_path, kernel_type, graph_type, normalize):
+	'''Exported models score new graphs as the full kernel and model, also after being saved and loaded'''
+	train = random_graphs(0, 80, graph_type, 1)
+	test = random_graphs(1, 40, graph_type, 1)
+	kernel = kernel_type(normalize = normalize)
+	model, _ = _fit(kernel, train, 0.3)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		expected = model.decision_function(np.nan_to_num(kernel.transform(test)))
+		scoring_model = export_scoring_model(kernel, model, train)
+		joblib.dump(scoring_model, tmp_path/'scoring.sav')
+		loaded = joblib.load(tmp_path/'scoring.sav')
+		scores = scoring_model.score(test)
+		loaded_scores = loaded.score(test)
+
+	assert len(scoring_model.dual_coef) == len(model.support_)
+	assert np.allclose(scores, expected)
+	assert np.array_equal(loaded_scores, scores)
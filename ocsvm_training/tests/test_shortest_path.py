@@ -0,0 +1,112 @@
+import os
+import warnings
+import numpy as np
+import pytest
+from scipy.spatial.distance import pdist
+from grakel import ShortestPath
+from pyichem import ints
+from ocsvm_training.shortest_path import IPAShortestPath, QueryFeatures, transform_query, shares_query_features
+
+LABELS = ['SEC1', 'ALC2', 'LYC3', 'ASC4', 'GLC5', 'PHC6', 'SEL1', 'ALL2', 'LYL3', 'ASL4', 'GLL5', 'PHL6', 'SEP1', 'ALP2', 'LYP3', 'ASP4', 'GLP5', 'PHP6']
+
+def random_graphs(seed, n_graphs, graph_type, round_val):
+	'''
+	Random interaction graphs built as in Ints.compute_graphs, with the distances rounded as in graph_reader.
+	Rounding can break the triangle inequality, so the shortest paths differ from the direct distances.
+	'''
+	rng = np.random.default_rng(seed)
+	graphs = list()
+	for _ in range(n_graphs):
+		n_nodes = rng.integers(3, 30)
+		dist = pdist(rng.uniform(0, 12, size = (n_nodes, 3)))
+		if round_val is not None:
+			dist = np.rint(dist/round_val)*round_val
+			dist[dist == 0] = round_val*0.1
+		labels = list(rng.choice(LABELS[:rng.integers(2, len(LABELS))], size = n_nodes))
+		graphs.append(ints._build_graph(ints.graph_node_labels, dist, labels, graph_type, round_val))
+
+	return np.array(graphs, dtype = object)
+
+def map_graphs(map_file, graph_type):
+	'''Graphs of a map file generated by compute_interactions.py, as used by training.py'''
+	interactions = ints.Ints([], [])
+	interactions.read_map_file(map_file)
+	graphs = interactions.compute_graphs(graph_type = graph_type)
+
+	return graphs[np.array([graph.n for graph in graphs]) > 2]
+
+def check_equivalence(train, test, normalize, grakel_train = None, grakel_test = None):
+	'''
+	Compares IPAShortestPath with grakel ShortestPath (node labels), the matrices must be identical, NaN values included.
+	The grakel kernel is given the grakel graphs, IPAShortestPath the graphs in the format tested.
+	'''
+	grakel_train = train if grakel_train is None else grakel_train
+	grakel_test = test if grakel_test is None else grakel_test
+	with warnings.catch_warnings():
+		# normalization of graphs without paths divides by zero in both kernels
+		warnings.simplefilter('ignore', RuntimeWarning)
+		expected_kernel = ShortestPath(normalize = normalize)
+		expected_gram = expected_kernel.fit_transform(grakel_train)
+		expected_diagonal = expected_kernel.diagonal()
+		expected_transform = expected_kernel.transform(grakel_test)
+		expected_diagonals = expected_kernel.diagonal()
+
+		kernel = IPAShortestPath(normalize = normalize)
+		gram = kernel.fit_transform(train)
+		diagonal = kernel.diagonal()
+		transform = kernel.transform(test)
+		diagonals = kernel.diagonal()
+
+	assert np.array_equal(gram, expected_gram, equal_nan = True)
+	assert np.array_equal(transform, expected_transform, equal_nan = True)
+	assert np.array_equal(np.ravel(diagonal), np.ravel(expected_diagonal), equal_nan = True)
+	for values, expected in zip(diagonals, expected_diagonals):
+		assert np.array_equal(np.ravel(values), np.ravel(expected), equal_nan = True)
+
+	# fit followed by transform gives the same matrix as fit_transform
+	kernel = IPAShortestPath(normalize = normalize).fit(train)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		assert np.array_equal(kernel.transform(train), gram, equal_nan = True)
+
+@pytest.mark.parametrize('normalize', [True, False])
+@pytest.mark.parametrize('round_val', [1, 0.5, None])
+@pytest.mark.parametrize('graph_type', ['grakel', 'compact'])
+def test_random_graphs(graph_type, round_val, normalize):
+	train = random_graphs(0, 60, graph_type, round_val)
+	test = random_graphs(1, 40, graph_type, round_val)
+	grakel_train = random_graphs(0, 60, 'grakel', round_val)
+	grakel_test = random_graphs(1, 40, 'grakel', round_val)
+
+	check_equivalence(train, test, normalize, grakel_train, grakel_test)
+
+@pytest.mark.skipif('IPA_TRAINING_MAP' not in os.environ or 'IPA_TEST_MAP' not in os.environ, reason = 'set IPA_TRAINING_MAP and IPA_TEST_MAP to map files generated by compute_interactions.py to compare the kernels on real data')
+@pytest.mark.parametrize('normalize', [True, False])
+@pytest.mark.parametrize('graph_type', ['grakel', 'compact'])
+def test_map_files(graph_type, normalize):
+	train = map_graphs(os.environ['IPA_TRAINING_MAP'], graph_type)
+	test = map_graphs(os.environ['IPA_TEST_MAP'], graph_type)
+	grakel_train = map_graphs(os.environ['IPA_TRAINING_MAP'], 'grakel')
+	grakel_test = map_graphs(os.environ['IPA_TEST_MAP'], 'grakel')
+
+	check_equivalence(train, test, normalize, grakel_train, grakel_test)
+
+@pytest.mark.parametrize('normalize', [True, False])
+@pytest.mark.parametrize('fit_transform', [True, False])
+def test_transform_query(normalize, fit_transform):
+	'''The shared query features give the same values as the transform of both kernels, without modifying the kernels'''
+	train = random_graphs(0, 60, 'grakel', 1)
+	test = random_graphs(1, 40, 'grakel', 1)
+	query = QueryFeatures(test)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		for kernel in (ShortestPath(normalize = normalize), IPAShortestPath(normalize = normalize)):
+			if fit_transform:
+				kernel.fit_transform(train)
+			else:
+				kernel.fit(train)
+			assert shares_query_features(kernel)
+			state = set(vars(kernel))
+			values = transform_query(kernel, query)
+			assert set(vars(kernel)) == state
+			assert np.array_equal(values, kernel.transform(test), equal_nan = True)
@@ -0,0 +1,27 @@
+import warnings
+import pandas as pd
+from test_shortest_path import random_graphs
+from ocsvm_training.shortest_path import IPAShortestPath
+from ocsvm_training import sweep as sweep_module
+from ocsvm_training.sweep import sweep
+
+def test_failed_settings(tmp_path, monkeypatch):
+	'''A setting without knee is recorded with its error and the sweep goes on, the rows are written to the output file'''
+	fit = sweep_module.QMS2.fit
+	def fit_without_knee(self, n = None, **kwargs):
+		if n == 5:
+			raise ValueError('The given dataset does not present a knee/elbow with the desired characteristics')
+		return fit(self, n = n, **kwargs)
+	monkeypatch.setattr(sweep_module.QMS2, 'fit', fit_without_knee)
+
+	graphs = random_graphs(0, 60, 'compact', 1)
+	output = str(tmp_path/'sweep.csv')
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		results = sweep(graphs, {'normalized': IPAShortestPath(normalize = True)}, K_values = [5, 8], nu_values = [0.1, 0], output = output, verbose = False)
+
+	failed = results[results['error'].notna()]
+	assert sorted(zip(failed['method'], failed['K'].fillna(-1))) == [('nu', -1), ('qms2', 5)]
+	assert results[results['error'].isna()]['support_vectors'].notna().all()
+	assert len(results) == 6
+	assert pd.read_csv(output).shape == results.shape
@@ -1,3 +1,5 @@
+from . import tables
+from . import similarity
 from . import base_models
 from . import grim
 from . import tifp
@@ -3,6 +3,7 @@ import yaml
 import os
 import subprocess
 import numpy as np
+from pyichem.tables import read_table
 
 
 
@@ -288,10 +289,10 @@ class BatchCalculation(IChem):
 		'''
 		Reads a previously generated map file to obtain the location of the structural input and output files
 
-		:param map_file: file containing the inputs generated by IChem
+		:param map_file: file containing the inputs generated by IChem, in CSV, Parquet or npz format
 		:type map_file: str
 		'''
-		map_df = pd.read_csv(map_file)
+		map_df = read_table(map_file)
 
 		self.receptor_mol2 = map_df['Receptor_file'].tolist()
 		self.ligand_mol2 = map_df['Ligand_file'].tolist()
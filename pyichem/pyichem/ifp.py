@@ -2,8 +2,10 @@ import pandas as pd
 import numpy as np
 import subprocess
 import sys
-import pdb
+import os
 from pyichem.base_models import BatchCalculation
+from pyichem.tables import read_table
+from pyichem.similarity import PackedIfp
 
 IFP_PATH = 'ichem_outputs/IFP'
 
@@ -32,27 +34,43 @@ class Ifp(BatchCalculation):
 			raise ValueError(f'Invalid fingerprint type for {ifp_format}')
 		super().__init__(receptor_mol2, ligand_mol2, IFP_PATH, f'{IFP_PATH}/ligands.ifp', 'IFP', output_f = False, stdout_name = f'{IFP_PATH}/{output_file}', opt = self.ifp_option)
 
-	def read_ifp(self):
+	def read_ifp(self, file = None):
 		'''
 		Reads the generated IFP files in a single pandas DataFrame.
 		The function reads both a series of file or a single file.
 		If a file is missing or it is empty NaN values are given to all the interactions
+		The bits of the IFPs are also kept as a uint8 matrix (bits attribute) with the mask of the missing IFPs (missing attribute).
 
+		:param file: table of IFPs previously saved with write_table (CSV, Parquet or npz), read instead of the IChem outputs
+		:type file: str, optional
 		:returns: fingerprints attribute of the IFP object
 		:rtype: pandas DataFrame
 		'''
 
-		if hasattr(self, 'output_location'):
-			for file in self.output_location:
-				if hasattr(self, 'fingerprints'):
-					if file_check(file):
-						self.fingerprints = self.fingerprints.append(ifp_reader(file, self.ifp_format), ignore_index = True)
-					else:
-						self.fingerprints = self.fingerprints.append(pd.DataFrame(np.full((1,self.fingerprints.shape[1]), np.nan), columns = self.fingerprints.columns), ignore_index = True)
-				else:
-					self.fingerprints = ifp_reader(file, self.ifp_format)
-		else:
-			self.fingerprints = ifp_reader(self.stdout, self.ifp_format)
+		if file is not None:
+			self.fingerprints = read_table(file)
+			return self.fingerprints
+
+		files = self.output_location if hasattr(self, 'output_location') else [self.stdout]
+		parts = list()
+		columns = None
+		for ifp_file in files:
+			bits, missing, file_columns = ifp_matrix(ifp_file, self.ifp_format) if os.path.isfile(ifp_file) else (None, None, [])
+			if missing is None or len(missing) == 0:
+				# missing or empty output, a single missing IFP
+				bits, missing = None, np.ones(1, dtype = bool)
+			elif file_columns:
+				if columns is None:
+					columns = file_columns
+				elif len(file_columns) != len(columns):
+					raise Exception(f'Inconsistent number of residues with previous fingerprints in {ifp_file}\nImpossible to create the output file')
+			parts.append((bits, missing))
+		columns = columns if columns is not None else []
+
+		# files containing only missing IFPs have no bits
+		self.bits = np.concatenate([bits if bits is not None and bits.shape[1] == len(columns) else np.zeros((len(missing), len(columns)), dtype = np.uint8) for bits, missing in parts])
+		self.missing = np.concatenate([missing for _, missing in parts])
+		self.fingerprints = ifp_frame(self.bits, self.missing, columns)
 
 		return self.fingerprints
 
@@ -70,6 +88,17 @@ class Ifp(BatchCalculation):
 			raise ValueError("Arrays must all be same length \n Check IChem output file to detect missing results \n If there are missing values try to run the calculation manually using IChem with the generated input file \n Possible segmentation fault for one of the calculations")
 
 
+	def packed(self, drop_zero = True):
+		'''
+		Packs the IFPs for similarity searches.
+
+		:param drop_zero: drop the bits that are 0 in all the IFPs
+		:type drop_zero: bool, optional
+		:return: the packed IFPs, the missing IFPs are masked
+		:rtype: PackedIfp
+		'''
+		return PackedIfp.from_frame(self.fingerprints, drop_zero = drop_zero)
+
 	def fp_interaction(self, interactions):
 		'''
 		Filters the IFP table selecting only the specified interactions types.
@@ -147,59 +176,125 @@ def ifp_reader(file, ifp_type = 'regular'):
 	:type file: str
 	:param ifp_type: type of IFP
 	:type tifp_type: str
-	:return: table containing all the detected IFPs
+	:return: table containing all the detected IFPs, NaN values are given to the IFPs IChem was not able to calculate
 	:rtype: pandas DataFrame
 	:raises :class:'Exception': should there be a difference in the length of the IFPs stored in the same output file
 	:raises :class:'ValueError': should be the type of IFP not implemented
 	'''
-	values = []
-	header = None
-	counter = 0
+	return ifp_frame(*ifp_matrix(file, ifp_type))
 
-	if ifp_type == 'regular':
-		interactions = ['HYD', 'FTF', 'ETF', 'HBD', 'HBA', 'CAT', 'ANI']
-	elif ifp_type == 'polar':
-		interactions = ['HBD', 'HBA', 'CAT', 'ANI', 'MCO']
-	elif ifp_type == 'extended':
-		interactions = ['HYD', 'FTF', 'ETF', 'HBD', 'HBA', 'CAT', 'ANI', 'PCI', 'MCO']
-	else:
-		raise Exception('Fingerprint format non-available')
+def ifp_matrix(file, ifp_type = 'regular', chunk_size = 4096):
+	'''
+	Reads an IFP file in a single pass into a matrix of bits.
+	The matrix is allocated once from the size of the file, and the bitstrings are converted by blocks of lines from their bytes instead of character by character.
+	The IFPs IChem was not able to calculate (WARNING lines) are recorded in a mask, their bits are set to 0.
 
-	with open(file, 'r') as ifp_file:
-		for line in ifp_file:
-			if line.startswith('|') and not line.startswith('|ERROR'):
-				if line.startswith('|WARNING'):
-					values.append([np.nan for _ in range(len(values[0]))])
-				elif header is None or header == line:
+	:param file: file containing the IFPs
+	:type file: str
+	:param ifp_type: type of IFP
+	:type ifp_type: str
+	:param chunk_size: number of lines converted at once
+	:type chunk_size: int
+	:return: bits of the IFPs with one row per IFP, mask of the missing IFPs and names of the columns
+	:rtype: numpy array of uint8, numpy array of bool, list of str
+	:raises :class:'Exception': should there be a difference in the length of the IFPs stored in the same output file
+	'''
+	interactions = _interaction_codes(ifp_type)
+	header = None
+	columns = list()
+	n_bits = 0
+	bits = np.zeros((0, 0), dtype = np.uint8)
+	missing = list()
+	n_rows = 0
+	pending = list()
+	pending_rows = list()
+
+	def flush():
+		nonlocal bits
+		if not pending:
+			return
+		if pending_rows[-1] >= len(bits):
+			# more IFPs than expected from the size of the file, the capacity is doubled
+			bits = np.concatenate((bits, np.zeros((max(len(bits), pending_rows[-1] + 1), n_bits), dtype = np.uint8)))
+		block = np.frombuffer(b''.join(pending), dtype = np.uint8).reshape(len(pending), n_bits) - ord('0')
+		if block.max(initial = 0) > 1:
+			raise ValueError(f'Invalid character in the fingerprints of {file}')
+		bits[pending_rows] = block
+		pending.clear()
+		pending_rows.clear()
+
+	with open(file, 'rb') as ifp_file:
+		for counter, line in enumerate(ifp_file):
+			if line.startswith(b'|') and not line.startswith(b'|ERROR'):
+				if line.startswith(b'|WARNING'):
+					missing.append(n_rows)
+					n_rows += 1
+				elif header is None:
 					header = line
+					columns = _header_columns(line.decode(), interactions)
+					n_bits = len(columns)
+					# each IFP line holds at least n_bits characters and the end of line
+					bits = np.zeros((os.path.getsize(file)//(n_bits + 1) + 1, n_bits), dtype = np.uint8)
+				elif header == line:
+					continue
 				elif len(header) == len(line):
-					print(f'Fingerprint header changed during execution at fingerprint {counter}, please check the output.\nThe fingerprint is still generated with the first detected fingerprint head')
+					print(f'Fingerprint header changed during execution at line {counter}, please check the output.\nThe fingerprint is still generated with the first detected fingerprint head')
 				else:
 					raise Exception(f'Inconsistent number of residues with previous fingerprints at line {counter}\nImpossible to create the output file')
-				
-			elif line.startswith('0') or line.startswith('1'):
-				try:
-					values.append([int(char) for char in line[:-1]])
-				except ValueError as ve:
-					pdb.set_trace()
-
-	header_residues = header.split('|')
-	header_residues[-1]=header_residues[-1][:-1]
-
-	interaction_header = []
-	
 
-	for residue in header_residues[1:]:
-		for code in interactions:
-			interaction_header.append(f'{residue} {code}')
+			elif line.startswith(b'0') or line.startswith(b'1'):
+				line = line.rstrip()
+				if len(line) != n_bits:
+					raise Exception(f'Inconsistent length of the fingerprint at line {counter} with the fingerprint header\nImpossible to create the output file')
+				pending.append(line)
+				pending_rows.append(n_rows)
+				n_rows += 1
+				if len(pending) == chunk_size:
+					flush()
+		flush()
+
+	if len(bits) < n_rows:
+		bits = np.concatenate((bits, np.zeros((n_rows - len(bits), n_bits), dtype = np.uint8)))
+	mask = np.zeros(n_rows, dtype = bool)
+	mask[missing] = True
+
+	return bits[:n_rows], mask, columns
+
+def ifp_frame(bits, missing, columns):
+	'''
+	Table of IFPs from a matrix of bits, the missing IFPs are given NaN values.
+
+	:param bits: bits of the IFPs
+	:type bits: numpy array
+	:param missing: mask of the missing IFPs
+	:type missing: numpy array of bool
+	:param columns: names of the columns
+	:type columns: list of str
+	:return: table of the IFPs, of uint8 values if no IFP is missing
+	:rtype: pandas DataFrame
+	'''
+	if missing.any():
+		values = bits.astype(np.float64)
+		values[missing] = np.nan
+		return pd.DataFrame(data = values, columns = columns)
 
-	if len(values[0]) != len(interaction_header):
-		return pd.DataFrame(data = ['' for _ in range(len(interaction_header))])
+	return pd.DataFrame(data = bits, columns = columns)
 
+def _interaction_codes(ifp_type):
+	if ifp_type == 'regular':
+		return ['HYD', 'FTF', 'ETF', 'HBD', 'HBA', 'CAT', 'ANI']
+	elif ifp_type == 'polar':
+		return ['HBD', 'HBA', 'CAT', 'ANI', 'MCO']
+	elif ifp_type == 'extended':
+		return ['HYD', 'FTF', 'ETF', 'HBD', 'HBA', 'CAT', 'ANI', 'PCI', 'MCO']
 	else:
+		raise Exception('Fingerprint format non-available')
+
+def _header_columns(header, interactions):
+	'''Names of the bits of the IFP, residue and interaction code, from the header line'''
+	header_residues = header.rstrip('\r\n').split('|')
 
-		return pd.DataFrame(data = values, columns = interaction_header)
-		
+	return [f'{residue} {code}' for residue in header_residues[1:] for code in interactions]
 
 def filter_interaction(fingerprint, interactions):
 	'''
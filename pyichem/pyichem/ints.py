@@ -5,10 +5,7 @@ from pyichem.base_models import BatchCalculation
 from biopandas.mol2 import PandasMol2
 from scipy.spatial.distance import squareform, pdist
 import os.path
-import decimal
-from itertools import permutations, combinations
-
-import pdb
+import sys
 
 INTERACTIONS_PATH='ichem_outputs/interactions'
 
@@ -22,6 +19,13 @@ hb_simplification = {'SEC1': 'HBC8', 'ALC2': 'HBC8',
                     'SEP1': 'HBP8', 'ALP2': 'HBP8',
                     'SEL1': 'HBL8', 'ALL2': 'HBL8'}
 
+IPA_LABELS = ('SEC1', 'ALC2', 'LYC3', 'ASC4', 'GLC5', 'PHC6',
+            'SEL1', 'ALL2', 'LYL3', 'ASL4', 'GLL5', 'PHL6',
+            'SEP1', 'ALP2', 'LYP3', 'ASP4', 'GLP5', 'PHP6',
+            'HBC8', 'HBP8', 'HBL8')
+
+_label_index = {lab: i for i, lab in enumerate(IPA_LABELS)}
+
 
 class Ints(BatchCalculation):
     '''
@@ -64,12 +68,12 @@ class Ints(BatchCalculation):
 
         super().__init__(receptor_mol2, ligand_mol2, INTERACTIONS_PATH, f'{INTERACTIONS_PATH}/out_ints_', 'ints', opt = opt)
 
-    def compute_graphs(self, graph_type = 'grakel', threshold = None, subgraph = None, round_val = 1, simplify = False):
+    def compute_graphs(self, graph_type = 'grakel', threshold = None, subgraph = None, round_val = 1, simplify = False, mode = 'node'):
         '''
         Computes interaction graphs.
-        Currently the output is given only as grakel graphs.
+        The output is given as grakel graphs or as compact IPAGraph objects.
 
-        :param graph_type: graph format used for the outputs, currently only grakel graphs are generated
+        :param graph_type: graph format used for the outputs, grakel graphs (grakel) or compact graphs (compact, only with node labels)
         :type graph_type: str, optional
         :param threshold: distance threshold for edge deinition, currently not implemented in this version
         :type threshold: float, optional
@@ -79,21 +83,226 @@ class Ints(BatchCalculation):
         :type round_val: float
         :param simplify: simplify the description of hydrogen bonds by treating hydrogen bond donor and acceptors as the same interaction type.
         :type simplify: bool
+        :param mode: Describe the position of the labels in the graph
+        :type mode: str
         :returns: Array containing the generated graphs
         :rtype: numpy array
         '''
         graphs = list()
-        if protein:
-            if len(self.output_location) != len(self.receptor_mol2):
-                raise ValueError('The same number of interaction files and receptor structure file are required for residue relabelling')
-            for file, prot_file in zip(self.output_location, self.receptor_mol2):
-                graphs.append(graph_generator(file+f'_INTS_{self.type_int[0]}.mol2', graph_type = graph_type, threshold = threshold, subgraph = subgraph, round_val = round_val, simplify = simplify, protein_file = prot_file, backbone = backbone, mode = mode))
-        else:
-            for file in self.output_location:
-                graphs.append(graph_generator(file+f'_INTS_{self.type_int[0]}.mol2', graph_type = graph_type, threshold = threshold, subgraph = subgraph, round_val = round_val, simplify = simplify, mode = mode))
+        for file in self.output_location:
+            graphs.append(graph_generator(self._ipa_file(file), graph_type = graph_type, threshold = threshold, subgraph = subgraph, round_val = round_val, simplify = simplify, mode = mode))
 
         return np.array(graphs)
 
+    def iter_graphs(self, batch_size = 1000, graph_type = 'grakel', threshold = None, subgraph = None, round_val = 1, simplify = False, mode = 'node'):
+        '''
+        Generates the interaction graphs in batches, following the order of the output files.
+        Only the graphs of the current batch are kept in memory, allowing to process datasets that do not fit in memory.
+
+        :param batch_size: number of graphs in each batch
+        :type batch_size: int
+        :param graph_type: graph format used for the outputs, grakel graphs (grakel) or compact graphs (compact, only with node labels)
+        :type graph_type: str, optional
+        :param threshold: distance threshold for edge deinition, currently not implemented in this version
+        :type threshold: float, optional
+        :param subgraph: extract a specific subgraph from the IPA data
+        :type subgraph: bool
+        :param round_val: closest value to which the Euclidean distance is approximated to define the edge weight
+        :type round_val: float
+        :param simplify: simplify the description of hydrogen bonds by treating hydrogen bond donor and acceptors as the same interaction type.
+        :type simplify: bool
+        :param mode: Describe the position of the labels in the graph
+        :type mode: str
+        :returns: Array containing the graphs of the batch
+        :rtype: generator of numpy arrays
+        '''
+        if batch_size < 1:
+            raise ValueError(f'The batch size must be a positive integer, {batch_size} was given')
+
+        for start in range(0, len(self.output_location), batch_size):
+            graphs = list()
+            for file in self.output_location[start:start+batch_size]:
+                graphs.append(graph_generator(self._ipa_file(file), graph_type = graph_type, threshold = threshold, subgraph = subgraph, round_val = round_val, simplify = simplify, mode = mode))
+
+            yield np.array(graphs)
+
+    def compute_graph_views(self, views, graph_type = 'grakel', threshold = None, round_val = 1, mode = 'node'):
+        '''
+        Computes the interaction graphs of several subgraph and simplification settings reading each IPA file only once.
+        The distances of every view are taken from a single distance matrix computed on all the IPAs of the file.
+        The graphs of each view are identical to the ones obtained by compute_graphs with the same settings.
+
+        :param views: pairs of subgraph and simplify values, e.g. [(None, False), ('LIG', True)]
+        :type views: list of tuples
+        :param graph_type: graph format used for the outputs, grakel graphs (grakel) or compact graphs (compact, only with node labels)
+        :type graph_type: str, optional
+        :param threshold: distance threshold for edge deinition, currently not implemented in this version
+        :type threshold: float, optional
+        :param round_val: closest value to which the Euclidean distance is approximated to define the edge weight
+        :type round_val: float
+        :param mode: Describe the position of the labels in the graph
+        :type mode: str
+        :returns: Array containing the generated graphs for each view
+        :rtype: dict of numpy arrays
+        '''
+        func = _label_modes(mode)
+        views = [tuple(view) for view in views]
+        graphs = {view: list() for view in views}
+        for file in self.output_location:
+            for view, (dist, labels) in graph_views_reader(self._ipa_file(file), views, threshold, round_val).items():
+                graphs[view].append(_build_graph(func, dist, labels, graph_type, round_val))
+
+        return {view: np.array(view_graphs) for view, view_graphs in graphs.items()}
+
+    def _ipa_file(self, output):
+        '''
+        Name of the .mol2 file containing the IPAs generated for an output prefix.
+
+        :param output: prefix of the output file
+        :type output: str
+        :returns: the .mol2 file name
+        :rtype: str
+        '''
+        return output+f'_INTS_{self.type_int[0]}.mol2'
+
+    def ipa_files(self):
+        '''
+        Names of the .mol2 files containing the IPAs, in the order of the output files.
+
+        :returns: the .mol2 file names
+        :rtype: list of str
+        '''
+        return [self._ipa_file(output) for output in self.output_location]
+
+def _build_graph(func, dist, labels, graph_type, round_val):
+    '''
+    Calls a graph builder, compact graphs are generated directly since they are supported only with node labels.
+    '''
+    if graph_type == 'compact':
+        if func is not graph_node_labels:
+            raise ValueError('Compact graphs support only labels on the nodes')
+        return IPAGraph.from_condensed(dist, labels, round_val)
+    return func(dist, labels, graph_type = graph_type)
+
+def _label_modes(mode):
+    '''
+    Returns the graph builder corresponding to a label mode.
+    '''
+    func = {'node': graph_node_labels, 'edge': graph_edge_labels, 'node_edge': graph_node_edge_labels}
+    if mode in func:
+        return func[mode]
+    else:
+        raise ValueError(f'Graph label mode {mode} is not recognized')
+
+class IPAGraph():
+    '''
+    Compact interaction graph storing only the IPA label codes and the condensed distance matrix.
+    Labels are stored as integer codes, their positions in the fixed IPA_LABELS vocabulary, so the codes are the same in every process and pickled graphs decode correctly anywhere.
+    When the distances are rounded they are stored as the number of round_val steps (uint8, or uint16 for steps above 255), otherwise as float32.
+
+    The object is an iterable of adjacency matrix and node labels, so it can be given directly to grakel kernels.
+    The dense matrix and the label dictionary are generated only when requested.
+
+    :param labels: global codes of the node labels
+    :type labels: numpy array
+    :param dist: quantized upper triangular distance matrix as a 1D array
+    :type dist: numpy array
+    :param round_val: value used to quantize the distances, None if they are not quantized
+    :type round_val: float, optional
+    '''
+    __slots__ = ('labels', 'dist', 'round_val')
+
+    def __init__(self, labels, dist, round_val = None):
+        self.labels = labels
+        self.dist = dist
+        self.round_val = round_val
+
+    @classmethod
+    def from_condensed(cls, dist, node_labels, round_val = None):
+        '''
+        Generates a compact graph from the outputs of graph_reader.
+
+        :param dist: triangular upper distance matrix as a 1D array
+        :type dist: array
+        :param node_labels: labels of the nodes in the graph
+        :type node_labels: list
+        :param round_val: value used to round the distances, None if the distances were not rounded
+        :type round_val: float, optional
+        :returns: Interaction graph
+        :rtype: IPAGraph
+        '''
+        dist = np.asarray(dist)
+        if round_val is None:
+            quantized = dist.astype(np.float32)
+        else:
+            steps = np.rint(dist/round_val)
+            dtype = np.uint8 if steps.size == 0 or steps.max() <= np.iinfo(np.uint8).max else np.uint16
+            quantized = steps.astype(dtype)
+
+        return cls(label_codes(node_labels), quantized, round_val)
+
+    @property
+    def n(self):
+        '''Number of nodes in the graph'''
+        return len(self.labels)
+
+    @property
+    def node_labels(self):
+        '''Labels of the nodes as a dictionary, as in grakel graphs'''
+        return {i: IPA_LABELS[code] for i, code in enumerate(self.labels.tolist())}
+
+    def distances(self):
+        '''
+        Decodes the quantized distances, giving the same values returned by graph_reader.
+
+        :returns: the upper triangular distance matrix as a 1D array
+        :rtype: numpy array
+        '''
+        if self.round_val is None:
+            return self.dist.astype(np.float64)
+        dist = self.dist.astype(np.float64)*self.round_val
+        dist[self.dist == 0] = self.round_val*0.1
+
+        return dist
+
+    def adjacency(self):
+        '''
+        :returns: the weighted adjacency matrix of the graph
+        :rtype: numpy array
+        '''
+        return squareform(self.distances())
+
+    def to_grakel(self):
+        '''
+        :returns: the equivalent grakel graph
+        :rtype: grakel Graph
+        '''
+        return grakelGraph(self.adjacency(), node_labels = self.node_labels)
+
+    def __iter__(self):
+        return iter((self.adjacency(), self.node_labels))
+
+    def __len__(self):
+        return 2
+
+def label_codes(node_labels):
+    '''
+    Converts IPA labels to their integer codes, their positions in IPA_LABELS.
+
+    :param node_labels: labels of the nodes
+    :type node_labels: list
+    :returns: code of each label
+    :rtype: numpy array
+    :raises ValueError: if a label is not in IPA_LABELS
+    '''
+    codes = np.empty(len(node_labels), dtype = np.uint8)
+    for i, lab in enumerate(node_labels):
+        if lab not in _label_index:
+            raise ValueError(f'Label {lab} is not an IPA label, compact graphs support only the labels in IPA_LABELS')
+        codes[i] = _label_index[lab]
+
+    return codes
+
 def graph_generator(file, mode = 'node', threshold = None, subgraph = None, round_val = None, simplify = False, graph_type = 'grakel'):
     '''
     Generates an interaction graph from a single .mol2 containing IPAs.
@@ -114,17 +323,14 @@ def graph_generator(file, mode = 'node', threshold = None, subgraph = None, roun
     :type round_val: float
     :param simplify: simplify the description of hydrogen bonds by treating hydrogen bond donor and acceptors as the same interaction type.
     :type simplify: bool
-    :param graph_type: graph format used for the outputs, currently only grakel graphs are generated
+    :param graph_type: graph format used for the outputs, grakel graphs (grakel) or compact graphs (compact, only with node labels)
     :type graph_type: str, optional
     :returns: An interaction graph with the desired characteristics
-    :rtype: grakel Graph
+    :rtype: grakel Graph or IPAGraph
     '''
-    func = {'node': graph_node_labels, 'edge': graph_edge_labels, 'node_edge': graph_node_edge_labels}
-    if mode in func:
-        dist, labels = graph_reader(file, threshold, subgraph, round_val, simplify, protein_file, backbone)
-        return func[mode](dist, labels, graph_type = 'grakel')
-    else:
-        raise ValueError(f'Graph label mode {mode} is not recognized')
+    func = _label_modes(mode)
+    dist, labels = graph_reader(file, threshold, subgraph, round_val, simplify)
+    return _build_graph(func, dist, labels, graph_type, round_val)
 
 def graph_reader(file, threshold = None, subgraph = None, round_val = None, simplify = False):
     '''
@@ -164,6 +370,56 @@ def graph_reader(file, threshold = None, subgraph = None, round_val = None, simp
 
     return dist, labels_list
 
+def graph_views_reader(file, views, threshold = None, round_val = None):
+    '''
+    Function converting the IPAs in the .mol2 file to the labels and distance matrices of several subgraph and simplification settings.
+    The file is read once and a single distance matrix is computed, the distances of each view are sliced from it.
+    :param file: .mol2 file containing the IPAs location and types
+    :type file: str
+    :param views: pairs of subgraph and simplify values
+    :type views: list of tuples
+    :param threshold: distance threshold for edge deinition, currently not implemented in this version
+    :type threshold: float, optional
+    :param round_val: closest value to which the Euclidean distance is approximated to define the edge weight
+    :type round_val: float
+    :returns: the upper triangular distance matrix as a 1D array and the list of node labels for each view
+    :rtype: dict of tuples
+    '''
+    for subgraph, _ in views:
+        if subgraph is not None and subgraph not in subst:
+            raise ValueError(f'The subgraph type {subgraph} is not supported')
+
+    if os.path.isfile(file):
+        pmol = PandasMol2().read_mol2(file)
+        all_labels = np.asarray(pmol.df['subst_name'].tolist(), dtype = object)
+        n = len(all_labels)
+
+        dist = pdist(pmol.df[['x', 'y', 'z']])
+        if round_val is not None:
+            dist = np.rint(dist/round_val)*round_val
+            dist[dist == 0] = round_val*0.1
+    else:
+        raise Exception(f'File {file} does not exist, impossible to compute the graph.')
+
+    results = dict()
+    for subgraph, simplify in views:
+        if subgraph is None:
+            idx = np.arange(n)
+            view_dist = dist
+        else:
+            idx = np.flatnonzero(np.isin(all_labels, subst[subgraph]))
+            rows, cols = np.triu_indices(len(idx), k = 1)
+            i, j = idx[rows], idx[cols]
+            view_dist = dist[n*i - i*(i+1)//2 + j - i - 1]
+
+        labels_list = all_labels[idx].tolist()
+        if simplify:
+            labels_list = [hb_simplification.get(lab, lab) for lab in labels_list]
+
+        results[(subgraph, simplify)] = (view_dist, labels_list)
+
+    return results
+
 def graph_node_labels(dist, node_labels, graph_type = 'grakel'):
     '''
     Function generating the interaction graph with labels on the nodes
@@ -203,16 +459,15 @@ def graph_edge_labels(dist, node_labels, graph_type = 'grakel'):
     priority = {'SEC1':0, 'ALC2':1, 'LYC3':2, 'ASC4':3, 'GLC5':4, 'PHC6':5, 'SEL1':6, 'ALL2':7, 'LYL3':8, 'ASL4':9, 'GLL5':10, 'PHL6': 11, 'SEP1':12, 'ALP2':13,'LYP3':14, 'ASP4':15, 'GLP5':16, 'PHP6':17}
 
     if graph_type == 'grakel':
-        
-        permutation = combinations(node_labels, 2)
-        idxs = combinations(np.arange(len(node_labels)), 2)
+
+        rows, cols, forward, backward, vocabulary = edge_label_codes(dist, node_labels)
         adj = squareform(np.ones(len(dist)))
 
-        edge_labels = dict()
+        source = np.column_stack([rows, cols]).ravel().tolist()
+        target = np.column_stack([cols, rows]).ravel().tolist()
+        codes = np.column_stack([forward, backward]).ravel()
 
-        for node_labels, d, idx in zip(permutation, dist, idxs):
-            edge_labels[(idx[0], idx[1])] = node_labels[0]+' '+node_labels[1]+' '+str(d)
-            edge_labels[(idx[1], idx[0])] = node_labels[1]+' '+node_labels[0]+' '+str(d)
+        edge_labels = dict(zip(zip(source, target), vocabulary[codes].tolist()))
 
         return grakelGraph(adj, edge_labels = edge_labels)
     else:
@@ -238,8 +493,41 @@ def graph_node_edge_labels(dist, node_labels, graph_type = 'grakel'):
         n_labels = {i:lab for i,lab in enumerate(node_labels)}
         sq_dist = squareform(dist)
 
-        e_labels = {ind: sq_dist[ind[0], ind[1]] for ind in combinations(range(len(n_labels)), r = 2)}
+        rows, cols = np.triu_indices(len(n_labels), k = 1)
+        e_labels = dict(zip(zip(rows.tolist(), cols.tolist()), np.asarray(dist).tolist()))
 
         return grakelGraph(sq_dist, node_labels = n_labels, edge_labels = e_labels)
     else:
-        raise ValueError(f'Unsupported graph type {graph_type}')
\ No newline at end of file
+        raise ValueError(f'Unsupported graph type {graph_type}')
+
+def edge_label_codes(dist, node_labels):
+    '''
+    Computes integer codes for the edge labels used in graph_edge_labels, without building the labels pair by pair.
+    The pairs are listed in the same order as the condensed distance matrix returned by pdist.
+    Each pair (i, j) with i < j has two labels:
+    A B distance, for the edge going from i to j
+    B A distance, for the edge going from j to i
+    :param dist: triangular upper distance matrix as a 1D array
+    :type dist: array
+    :param node_labels: labels of the nodes in the graph
+    :type node_labels: list
+    :returns: row indices, column indices, codes of the i to j labels, codes of the j to i labels, interned labels indexed by code
+    :rtype: numpy array, numpy array, numpy array, numpy array, numpy array
+    '''
+    dist = np.asarray(dist)
+    rows, cols = np.triu_indices(len(node_labels), k = 1)
+
+    label_values, label_codes = np.unique(np.asarray(node_labels, dtype = str), return_inverse = True)
+    dist_values, dist_codes = np.unique(dist, return_inverse = True)
+    n_labels = max(len(label_values), 1)
+    n_dist = max(len(dist_values), 1)
+
+    forward = (label_codes[rows]*n_labels + label_codes[cols])*n_dist + dist_codes
+    backward = (label_codes[cols]*n_labels + label_codes[rows])*n_dist + dist_codes
+
+    used, inverse = np.unique(np.concatenate([forward, backward]), return_inverse = True)
+    first, rest = np.divmod(used, n_labels*n_dist)
+    second, d = np.divmod(rest, n_dist)
+    vocabulary = np.array([sys.intern(f'{label_values[a]} {label_values[b]} {dist_values[c]}') for a, b, c in zip(first, second, d)], dtype = object)
+
+    return rows, cols, inverse[:len(rows)], inverse[len(rows):], vocabulary
@@ -0,0 +1,229 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+# number of 64 bit words of the temporary array of a block of pairs
+BLOCK_WORDS = 1 << 21
+
+if hasattr(np, 'bitwise_count'):
+	_popcount = np.bitwise_count
+else:
+	_BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype = np.uint8)
+
+	def _popcount(words):
+		return _BYTE_COUNTS[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis = -1, dtype = np.uint8)
+
+class PackedIfp():
+	'''
+	Matrix of IFPs stored as packed bits, for similarity searches between IFPs (e.g. MD frames against docking poses).
+	The columns that are 0 in all the IFPs are dropped, the number of bits set in each IFP is computed before dropping them.
+	The bits are packed in 64 bit words, the number of common bits of two IFPs is the number of bits set in the AND of their words.
+	Missing IFPs (IChem warnings, NaN rows) are kept as rows with no bits, their similarities are NaN and they are never returned by the searches.
+
+	:param bits: bits of the IFPs, one row per IFP
+	:type bits: numpy array of 0/1
+	:param columns: names of the columns, residue and interaction code
+	:type columns: list of str
+	:param missing: mask of the missing IFPs
+	:type missing: numpy array of bool, optional
+	:param drop_zero: drop the columns that are 0 in all the IFPs
+	:type drop_zero: bool, optional
+	'''
+
+	def __init__(self, bits, columns, missing = None, drop_zero = True):
+		bits = np.asarray(bits, dtype = np.uint8)
+		if bits.ndim != 2 or bits.shape[1] != len(columns):
+			raise ValueError(f'The matrix of bits ({bits.shape}) does not match the {len(columns)} columns')
+		self.all_columns = list(columns)
+		self.missing = np.zeros(len(bits), dtype = bool) if missing is None else np.asarray(missing, dtype = bool)
+		bits = np.where(self.missing[:, None], 0, bits).astype(np.uint8)
+
+		self.counts = bits.sum(axis = 1, dtype = np.int64)
+		keep = np.flatnonzero(bits.any(axis = 0)) if drop_zero else np.arange(bits.shape[1])
+		self.columns = [self.all_columns[j] for j in keep]
+		self.residues = np.array([column[:-4] for column in self.columns], dtype = str)
+		self.interactions = np.array([column[-3:] for column in self.columns], dtype = str)
+		self.packed = _pack(bits[:, keep])
+
+	@classmethod
+	def from_frame(cls, fingerprints, drop_zero = True):
+		'''
+		:param fingerprints: table of IFPs, e.g. Ifp.fingerprints, rows containing NaN values are missing IFPs
+		:type fingerprints: pandas DataFrame
+		:param drop_zero: drop the columns that are 0 in all the IFPs
+		:type drop_zero: bool, optional
+		:returns: the packed IFPs
+		:rtype: PackedIfp
+		'''
+		values = fingerprints.to_numpy()
+		missing = None
+		if values.dtype.kind not in 'biu':
+			values = values.astype(np.float64)
+			missing = np.isnan(values).any(axis = 1)
+			values = np.nan_to_num(values)
+
+		return cls(values, [str(column) for column in fingerprints.columns], missing, drop_zero)
+
+	def __len__(self):
+		return len(self.counts)
+
+	def unpack(self):
+		'''
+		:returns: bits of the IFPs on the columns kept
+		:rtype: numpy array of uint8
+		'''
+		return np.unpackbits(self.packed.view(np.uint8), axis = 1, count = len(self.columns))
+
+	def _align(self, query):
+		'''Words of the query on the columns of this matrix and number of bits set in each query IFP'''
+		if isinstance(query, pd.DataFrame):
+			query = PackedIfp.from_frame(query, drop_zero = False)
+		elif isinstance(query, pd.Series):
+			query = PackedIfp.from_frame(query.to_frame().T, drop_zero = False)
+		if not isinstance(query, PackedIfp):
+			raise TypeError('The query should be a PackedIfp or a table of IFPs')
+		if query.columns == self.columns:
+			return query.packed, query.counts, query.missing
+
+		# bits of the query absent from this matrix count only in the number of bits of the query
+		position = {column: j for j, column in enumerate(self.columns)}
+		shared = [(i, position[column]) for i, column in enumerate(query.columns) if column in position]
+		bits = np.zeros((len(query), len(self.columns)), dtype = np.uint8)
+		if shared:
+			source, target = np.array(shared).T
+			bits[:, target] = query.unpack()[:, source]
+
+		return _pack(bits), query.counts, query.missing
+
+	def _block_similarity(self, words, counts, rows, alpha, beta):
+		'''Tversky similarity of the query words against a block of rows'''
+		common = _popcount(words[:, None, :] & self.packed[None, rows, :]).sum(axis = 2, dtype = np.int64)
+		denominator = alpha*(counts[:, None] - common) + beta*(self.counts[None, rows] - common) + common
+		with np.errstate(divide = 'ignore', invalid = 'ignore'):
+			similarity = np.where(denominator > 0, common/denominator, 0.0)
+
+		return similarity
+
+	def _blocks(self, n_words, n_queries, block_size):
+		'''Blocks of queries and of rows whose temporary array holds at most BLOCK_WORDS words'''
+		if block_size is None:
+			block_size = max(1, BLOCK_WORDS//max(1, n_words*max(1, min(n_queries, 256))))
+		query_size = max(1, BLOCK_WORDS//max(1, n_words*block_size))
+
+		query_blocks = [slice(start, start + query_size) for start in range(0, n_queries, query_size)]
+		row_blocks = [slice(start, start + block_size) for start in range(0, len(self), block_size)]
+
+		return query_blocks, row_blocks
+
+	def similarity(self, query, alpha = 1.0, beta = 1.0, block_size = None, n_jobs = None):
+		'''
+		Tversky similarity of each query IFP with each IFP of the matrix, common/(alpha*(query only) + beta*(matrix only) + common).
+		alpha = beta = 1 gives the Tanimoto similarity, alpha = beta = 0.5 the Dice similarity. Two IFPs without bits have similarity 0.
+
+		:param query: query IFPs, matched to the columns of the matrix by name
+		:type query: PackedIfp, pandas DataFrame or pandas Series
+		:param alpha: weight of the bits set only in the query
+		:type alpha: float, optional
+		:param beta: weight of the bits set only in the IFP of the matrix
+		:type beta: float, optional
+		:param block_size: number of IFPs of the matrix compared at once, by default set from the length of the IFPs
+		:type block_size: int, optional
+		:param n_jobs: number of threads, by default the number of processors
+		:type n_jobs: int, optional
+		:returns: similarity matrix, one row per query IFP, NaN for the missing IFPs
+		:rtype: numpy array
+		'''
+		words, counts, query_missing = self._align(query)
+		query_blocks, row_blocks = self._blocks(words.shape[1], len(words), block_size)
+		result = np.empty((len(words), len(self)), dtype = np.float64)
+
+		def fill(blocks):
+			query_block, row_block = blocks
+			result[query_block, row_block] = self._block_similarity(words[query_block], counts[query_block], row_block, alpha, beta)
+
+		_run(fill, [(q, r) for q in query_blocks for r in row_blocks], n_jobs)
+		result[query_missing] = np.nan
+		result[:, self.missing] = np.nan
+
+		return result
+
+	def search(self, query, k = 10, alpha = 1.0, beta = 1.0, block_size = None, n_jobs = None):
+		'''
+		Top-k search of the most similar IFPs of the matrix for each query IFP, without storing the whole similarity matrix.
+		Each block of IFPs keeps its k best hits, the hits of the blocks are merged at the end.
+
+		:param query: query IFPs, matched to the columns of the matrix by name, a single IFP for a one-vs-many search
+		:type query: PackedIfp, pandas DataFrame or pandas Series
+		:param k: number of hits of each query
+		:type k: int, optional
+		:param alpha: weight of the bits set only in the query
+		:type alpha: float, optional
+		:param beta: weight of the bits set only in the IFP of the matrix
+		:type beta: float, optional
+		:param block_size: number of IFPs of the matrix compared at once, by default set from the length of the IFPs
+		:type block_size: int, optional
+		:param n_jobs: number of threads, by default the number of processors
+		:type n_jobs: int, optional
+		:returns: indices of the hits in the matrix and their similarities, sorted by decreasing similarity, one row per query IFP. Missing queries and queries with less than k hits are padded with index -1 and NaN similarity
+		:rtype: numpy array, numpy array
+		'''
+		words, counts, query_missing = self._align(query)
+		query_blocks, row_blocks = self._blocks(words.shape[1], len(words), block_size)
+
+		def block_hits(blocks):
+			query_block, row_block = blocks
+			similarity = self._block_similarity(words[query_block], counts[query_block], row_block, alpha, beta)
+			rows = np.arange(len(self))[row_block]
+			similarity[:, self.missing[rows]] = -np.inf
+			best = _top_k(similarity, k)
+
+			return rows[best], np.take_along_axis(similarity, best, axis = 1)
+
+		hits = _run(block_hits, [(q, r) for q in query_blocks for r in row_blocks], n_jobs)
+
+		indices = np.full((len(words), k), -1, dtype = np.int64)
+		scores = np.full((len(words), k), np.nan)
+		for i, query_block in enumerate(query_blocks):
+			block_indices = np.concatenate([index for index, _ in hits[i*len(row_blocks):(i + 1)*len(row_blocks)]], axis = 1)
+			block_scores = np.concatenate([score for _, score in hits[i*len(row_blocks):(i + 1)*len(row_blocks)]], axis = 1)
+			# ties are broken by the index in the matrix
+			order = np.lexsort((block_indices, -block_scores), axis = 1)[:, :k]
+			n_hits = order.shape[1]
+			indices[query_block, :n_hits] = np.take_along_axis(block_indices, order, axis = 1)
+			scores[query_block, :n_hits] = np.take_along_axis(block_scores, order, axis = 1)
+
+		invalid = np.isneginf(scores) | query_missing[:, None]
+		indices[invalid] = -1
+		scores[invalid] = np.nan
+
+		return indices, scores
+
+def _pack(bits):
+	'''Bits packed in 64 bit words, one row per IFP'''
+	packed = np.packbits(bits, axis = 1)
+	n_words = -(-packed.shape[1]//8)
+	words = np.zeros((len(packed), n_words*8), dtype = np.uint8)
+	words[:, :packed.shape[1]] = packed
+
+	return words.view(np.uint64)
+
+def _top_k(similarity, k):
+	'''Columns of the k best similarities of each row, in increasing order of column, the first columns are kept among equal similarities'''
+	if similarity.shape[1] <= k:
+		return np.broadcast_to(np.arange(similarity.shape[1]), similarity.shape).copy()
+
+	kth = np.take_along_axis(similarity, np.argpartition(-similarity, k - 1, axis = 1)[:, k - 1:k], axis = 1)
+	above = similarity > kth
+	tie = similarity == kth
+	take = above | (tie & (np.cumsum(tie, axis = 1) <= k - above.sum(axis = 1, keepdims = True)))
+
+	return np.nonzero(take)[1].reshape(len(similarity), k)
+
+def _run(function, tasks, n_jobs):
+	'''Runs the tasks in threads, the numpy operations on the blocks release the GIL'''
+	n_jobs = n_jobs if n_jobs is not None else os.cpu_count()
+	if n_jobs <= 1 or len(tasks) <= 1:
+		return [function(task) for task in tasks]
+	with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+		return list(executor.map(function, tasks))
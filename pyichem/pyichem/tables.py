@@ -0,0 +1,195 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'npz': '.npz'}
+
+def table_format(file):
+	'''
+	Format of a table file, deduced from the extension, files with unknown extensions are CSV files.
+
+	:param file: name of the file
+	:type file: str
+	:returns: csv, parquet or npz
+	:rtype: str
+	'''
+	extension = os.path.splitext(file)[1].lower()
+	for name, ext in FORMATS.items():
+		if extension == ext:
+			return name
+
+	return 'csv'
+
+def table_name(name, table_format):
+	'''
+	:param name: name of the file without extension
+	:type name: str
+	:param table_format: csv, parquet or npz
+	:type table_format: str
+	:returns: the name of the file with the extension of the format
+	:rtype: str
+	'''
+	if table_format not in FORMATS:
+		raise ValueError(f'Unknown table format {table_format}, available formats: {", ".join(FORMATS)}')
+
+	return name + FORMATS[table_format]
+
+def write_table(df, file):
+	'''
+	Writes a table in the format given by the extension of the file.
+	CSV files are written as before. Parquet and npz files are columnar and compressed: binary columns (fingerprint bits) are stored as uint8, bit-packed in npz files, and text columns (file paths) as categories.
+	Reading the file with read_table gives back the same table.
+
+	:param df: table
+	:type df: pandas DataFrame
+	:param file: name of the file, with extension .csv, .parquet or .npz
+	:type file: str
+	'''
+	fmt = table_format(file)
+	if fmt == 'csv':
+		df.to_csv(file, index = False)
+	elif fmt == 'parquet':
+		_write_parquet(df, file)
+	else:
+		_write_npz(df, file)
+
+def read_table(file):
+	'''
+	Reads a table written by write_table, or any CSV file.
+
+	:param file: name of the file
+	:type file: str
+	:returns: the table
+	:rtype: pandas DataFrame
+	'''
+	fmt = table_format(file)
+	if fmt == 'csv':
+		return pd.read_csv(file)
+	elif fmt == 'parquet':
+		return _read_parquet(file)
+	else:
+		return _read_npz(file)
+
+def _binary_columns(df):
+	'''
+	Columns containing only 0 and 1, NaN values are allowed only in whole missing rows (fingerprints that could not be computed).
+
+	:returns: names of the binary columns and mask of the missing rows
+	:rtype: list, numpy array
+	'''
+	candidates = list()
+	for column in df.columns:
+		values = df[column]
+		if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values) and np.isin(values.dropna().to_numpy(), (0, 1)).all():
+			candidates.append(column)
+	if not candidates:
+		return [], np.zeros(len(df), dtype = bool)
+
+	nan = df[candidates].isna().to_numpy()
+	missing = nan.all(axis = 1)
+	binary = [column for column, column_nan in zip(candidates, nan.T) if np.array_equal(column_nan, missing)]
+
+	return binary, missing
+
+def _is_text(values):
+	return pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)
+
+def _write_npz(df, file):
+	binary, missing = _binary_columns(df)
+	is_binary = set(binary)
+	arrays = {'missing': missing}
+	columns = list()
+
+	if binary:
+		bits = np.where(missing[:, None], 0, df[binary].to_numpy(dtype = np.float64)).astype(np.uint8)
+		arrays['bits'] = np.packbits(bits, axis = 1)
+	for i, column in enumerate(df.columns):
+		values = df[column]
+		if column in is_binary:
+			kind = 'bits'
+		elif _is_text(values):
+			kind = 'category'
+			codes, categories = pd.factorize(values)
+			arrays[f'codes_{i}'] = codes.astype(np.int32)
+			arrays[f'categories_{i}'] = np.array(categories, dtype = str)
+		else:
+			kind = 'values'
+			arrays[f'values_{i}'] = values.to_numpy()
+		columns.append({'name': str(column), 'kind': kind, 'dtype': str(values.dtype)})
+
+	arrays['columns'] = np.array(json.dumps(columns))
+	# np.savez_compressed adds the extension to names without it
+	with open(file, 'wb') as f:
+		np.savez_compressed(f, **arrays)
+
+def _read_npz(file):
+	with np.load(file, allow_pickle = False) as stored:
+		columns = json.loads(str(stored['columns']))
+		missing = stored['missing']
+		n_bits = sum(column['kind'] == 'bits' for column in columns)
+		if n_bits:
+			bits = np.unpackbits(stored['bits'], axis = 1, count = n_bits)
+
+		data = dict()
+		bit = 0
+		for i, column in enumerate(columns):
+			if column['kind'] == 'bits':
+				values = bits[:, bit]
+				bit += 1
+				if missing.any():
+					values = np.where(missing, np.nan, values)
+				data[column['name']] = pd.Series(values).astype(column['dtype'])
+			elif column['kind'] == 'category':
+				# code -1 is a missing value
+				values = pd.Categorical.from_codes(stored[f'codes_{i}'], stored[f'categories_{i}'])
+				data[column['name']] = pd.Series(values).astype(object).astype(column['dtype'])
+			else:
+				data[column['name']] = pd.Series(stored[f'values_{i}']).astype(column['dtype'])
+
+	return pd.DataFrame(data)
+
+def _write_parquet(df, file):
+	try:
+		import pyarrow as pa
+		import pyarrow.parquet as pq
+	except ImportError:
+		raise ImportError('Parquet files require pyarrow, use the npz format or install pyarrow')
+
+	binary, missing = _binary_columns(df)
+	is_binary = set(binary)
+	typed = dict()
+	for column in df.columns:
+		values = df[column]
+		if column in is_binary:
+			# missing fingerprints are stored as null values
+			typed[str(column)] = pd.array(values.to_numpy(dtype = np.float64), dtype = 'UInt8') if missing.any() else values.astype(np.uint8)
+		elif _is_text(values):
+			typed[str(column)] = values.astype('category')
+		else:
+			typed[str(column)] = values
+
+	table = pa.Table.from_pandas(pd.DataFrame(typed), preserve_index = False)
+	dtypes = json.dumps({str(column): str(df[column].dtype) for column in df.columns})
+	table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'pyichem_dtypes': dtypes.encode()})
+	pq.write_table(table, file, compression = 'zstd')
+
+def _read_parquet(file):
+	try:
+		import pyarrow.parquet as pq
+	except ImportError:
+		raise ImportError('Parquet files require pyarrow, use the npz format or install pyarrow')
+
+	table = pq.read_table(file)
+	df = table.to_pandas()
+	metadata = table.schema.metadata or {}
+	if b'pyichem_dtypes' in metadata:
+		for column, dtype in json.loads(metadata[b'pyichem_dtypes']).items():
+			values = df[column]
+			if isinstance(values.dtype, pd.CategoricalDtype):
+				values = values.astype(object)
+			elif pd.api.types.is_extension_array_dtype(values.dtype):
+				values = values.astype(np.float64)
+			df[column] = values.astype(dtype)
+
+	return df
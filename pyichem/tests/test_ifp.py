@@ -0,0 +1,137 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from pyichem.ifp import Ifp, ifp_matrix, ifp_frame, ifp_reader
+
+HEADER = '|A100|D113|F290|W313\n'
+
+def baseline_ifp_reader(file, ifp_type = 'regular'):
+    '''Line parser of ifp_reader before the streaming reader, kept verbatim as reference (without the debugger call)'''
+    values = []
+    header = None
+    counter = 0
+
+    if ifp_type == 'regular':
+        interactions = ['HYD', 'FTF', 'ETF', 'HBD', 'HBA', 'CAT', 'ANI']
+    elif ifp_type == 'polar':
+        interactions = ['HBD', 'HBA', 'CAT', 'ANI', 'MCO']
+    elif ifp_type == 'extended':
+        interactions = ['HYD', 'FTF', 'ETF', 'HBD', 'HBA', 'CAT', 'ANI', 'PCI', 'MCO']
+    else:
+        raise Exception('Fingerprint format non-available')
+
+    with open(file, 'r') as ifp_file:
+        for line in ifp_file:
+            if line.startswith('|') and not line.startswith('|ERROR'):
+                if line.startswith('|WARNING'):
+                    values.append([np.nan for _ in range(len(values[0]))])
+                elif header is None or header == line:
+                    header = line
+                elif len(header) == len(line):
+                    print(f'Fingerprint header changed during execution at fingerprint {counter}, please check the output.\nThe fingerprint is still generated with the first detected fingerprint head')
+                else:
+                    raise Exception(f'Inconsistent number of residues with previous fingerprints at line {counter}\nImpossible to create the output file')
+
+            elif line.startswith('0') or line.startswith('1'):
+                values.append([int(char) for char in line[:-1]])
+
+    header_residues = header.split('|')
+    header_residues[-1]=header_residues[-1][:-1]
+
+    interaction_header = []
+
+    for residue in header_residues[1:]:
+        for code in interactions:
+            interaction_header.append(f'{residue} {code}')
+
+    if len(values[0]) != len(interaction_header):
+        return pd.DataFrame(data = ['' for _ in range(len(interaction_header))])
+
+    else:
+
+        return pd.DataFrame(data = values, columns = interaction_header)
+
+def write_ifp(file, n_ifps, seed, warnings = (), header = HEADER, n_bits = 28):
+    '''
+    Output of calculate_lbl: each IFP is preceded by its IChem command and the header, the IFPs IChem could not compute are WARNING lines.
+    IChem errors are also written to the file.
+    '''
+    rng = np.random.default_rng(seed)
+    with open(file, 'w') as out:
+        for i in range(n_ifps):
+            out.write(f'\nIFP from receptor_{i}.mol2 ligand_{i}.mol2\n')
+            if i in warnings:
+                out.write(f'|WARNING IChem was not able to calculate the IFP with the line : receptor_{i}.mol2 ligand_{i}.mol2 \n')
+                continue
+            if i % 5 == 1:
+                out.write('|ERROR unknown atom type\n')
+            out.write(header)
+            out.write(''.join(rng.choice(['0', '1'], size = n_bits)) + '\n')
+
+@pytest.mark.parametrize('ifp_type, n_bits', [('regular', 28), ('polar', 20), ('extended', 36)])
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 4096])
+def test_baseline(tmp_path, ifp_type, n_bits, chunk_size):
+    '''Same table as the line parser, WARNING rows and repeated headers included, whatever the chunk boundaries'''
+    file = str(tmp_path/'ligands.ifp')
+    write_ifp(file, 23, 0, warnings = (2, 9, 10, 22), n_bits = n_bits)
+    expected = baseline_ifp_reader(file, ifp_type)
+
+    bits, missing, columns = ifp_matrix(file, ifp_type, chunk_size = chunk_size)
+    fingerprints = ifp_frame(bits, missing, columns)
+
+    assert bits.dtype == np.uint8 and bits.shape == (23, n_bits)
+    assert np.flatnonzero(missing).tolist() == [2, 9, 10, 22]
+    assert not bits[missing].any()
+    assert list(fingerprints.columns) == list(expected.columns)
+    assert np.array_equal(fingerprints.to_numpy(), expected.to_numpy(dtype = np.float64), equal_nan = True)
+    pd.testing.assert_frame_equal(ifp_reader(file, ifp_type), fingerprints)
+
+def test_first_warning(tmp_path):
+    '''An IFP that IChem could not compute before the first header is a missing row, the line parser failed on it'''
+    file = str(tmp_path/'ligands.ifp')
+    write_ifp(file, 6, 0, warnings = (0, 1))
+    bits, missing, columns = ifp_matrix(file)
+
+    assert missing.tolist() == [True, True, False, False, False, False]
+    assert bits.shape == (6, len(columns)) == (6, 28)
+
+def test_read_ifp(tmp_path, monkeypatch):
+    '''Several output files, missing and empty ones included, are read as by concatenating the line parser results'''
+    monkeypatch.chdir(tmp_path)
+    files = ['out_0.ifp', 'out_1.ifp', 'absent.ifp', 'empty.ifp', 'out_2.ifp']
+    fingerprint = Ifp([f'receptor_{i}.mol2' for i in range(len(files))], [f'ligand_{i}.mol2' for i in range(len(files))])
+    for seed, file in enumerate(files[:2] + files[-1:]):
+        write_ifp(file, 5 + seed, seed, warnings = (seed + 1,))
+    open('empty.ifp', 'w').close()
+    fingerprint.output_location = files
+    fingerprints = fingerprint.read_ifp()
+
+    expected = list()
+    for file in files:
+        if os.path.isfile(file) and os.path.getsize(file) > 0:
+            expected.append(baseline_ifp_reader(file))
+        else:
+            expected.append(pd.DataFrame(np.full((1, expected[0].shape[1]), np.nan), columns = expected[0].columns))
+    expected = pd.concat(expected, ignore_index = True)
+
+    assert list(fingerprints.columns) == list(expected.columns)
+    assert np.array_equal(fingerprints.to_numpy(), expected.to_numpy(dtype = np.float64), equal_nan = True)
+    assert np.array_equal(fingerprint.missing, expected.isna().all(axis = 1).to_numpy())
+    assert np.array_equal(fingerprint.bits[~fingerprint.missing], expected[~fingerprint.missing].to_numpy(dtype = np.uint8))
+
+def test_wrong_length(tmp_path):
+    '''Bitstrings longer or shorter than the header and invalid characters are refused'''
+    file = str(tmp_path/'ligands.ifp')
+    for n_bits in [27, 29]:
+        write_ifp(file, 3, 0)
+        with open(file, 'a') as out:
+            out.write(HEADER + '1'*n_bits + '\n')
+        with pytest.raises(Exception, match = 'Inconsistent length'):
+            ifp_matrix(file)
+
+    write_ifp(file, 3, 0)
+    with open(file, 'a') as out:
+        out.write(HEADER + '1'*27 + '2\n')
+    with pytest.raises(ValueError, match = 'Invalid character'):
+        ifp_matrix(file)
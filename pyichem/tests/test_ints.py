@@ -0,0 +1,127 @@
+import os
+import pickle
+import numpy as np
+import pytest
+from grakel import Graph as grakelGraph
+from scipy.spatial.distance import squareform, pdist
+from itertools import combinations
+from pyichem.ints import Ints, graph_edge_labels, graph_node_edge_labels, IPAGraph, IPA_LABELS
+
+LABELS = ['SEC1', 'ALC2', 'LYC3', 'ASC4', 'GLC5', 'PHC6', 'SEL1', 'ALL2', 'LYL3', 'ASL4', 'GLL5', 'PHL6', 'SEP1', 'ALP2', 'LYP3', 'ASP4', 'GLP5', 'PHP6']
+
+def baseline_graph_edge_labels(dist, node_labels):
+    '''Builder of graph_edge_labels before vectorization, kept verbatim as reference'''
+    permutation = combinations(node_labels, 2)
+    idxs = combinations(np.arange(len(node_labels)), 2)
+    adj = squareform(np.ones(len(dist)))
+
+    edge_labels = dict()
+
+    for node_labels, d, idx in zip(permutation, dist, idxs):
+        edge_labels[(idx[0], idx[1])] = node_labels[0]+' '+node_labels[1]+' '+str(d)
+        edge_labels[(idx[1], idx[0])] = node_labels[1]+' '+node_labels[0]+' '+str(d)
+
+    return grakelGraph(adj, edge_labels = edge_labels)
+
+def baseline_graph_node_edge_labels(dist, node_labels):
+    '''Builder of graph_node_edge_labels before vectorization, kept verbatim as reference'''
+    n_labels = {i:lab for i,lab in enumerate(node_labels)}
+    sq_dist = squareform(dist)
+
+    e_labels = {ind: sq_dist[ind[0], ind[1]] for ind in combinations(range(len(n_labels)), r = 2)}
+
+    return grakelGraph(sq_dist, node_labels = n_labels, edge_labels = e_labels)
+
+def random_graph(rng, n_nodes, round_val):
+    '''Condensed distances and node labels of a random interaction graph, distances rounded as in graph_reader'''
+    coordinates = rng.uniform(0, 15, size = (n_nodes, 3))
+    dist = pdist(coordinates)
+    if round_val is not None:
+        dist = np.rint(dist/round_val)*round_val
+        dist[dist == 0] = round_val*0.1
+    labels = list(rng.choice(LABELS, size = n_nodes))
+
+    return dist, labels
+
+def write_ipas(folder, n_files, seed):
+    '''IPA files of MERG interactions as written by IChem, one output per pose, some with less than three IPAs'''
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok = True)
+    outputs = list()
+    for i in range(n_files):
+        n_ipas = rng.integers(1, 15)
+        outputs.append(os.path.join(folder, f'out_{i}'))
+        with open(f'{outputs[-1]}_INTS_M.mol2', 'w') as mol2:
+            mol2.write(f'@<TRIPOS>MOLECULE\nIPA\n{n_ipas} 0 0 0 0\nSMALL\nNO_CHARGES\n\n@<TRIPOS>ATOM\n')
+            for j, (xyz, label) in enumerate(zip(rng.uniform(0, 15, size = (n_ipas, 3)), rng.choice(LABELS, size = n_ipas))):
+                mol2.write(f'{j+1:7d} X{j+1:<5d} {xyz[0]:10.4f} {xyz[1]:10.4f} {xyz[2]:10.4f} Du {j+1:5d} {label:<8s} 0.0000\n')
+            mol2.write('@<TRIPOS>BOND\n')
+
+    return outputs
+
+def edge_labels(graph):
+    # graphs with less than two nodes have no edge labels
+    labels = graph.get_labels(purpose = 'adjacency', label_type = 'edge', return_none = True)
+    return None if labels is None else list(labels.items())
+
+@pytest.mark.parametrize('round_val', [None, 1, 0.5])
+@pytest.mark.parametrize('n_nodes', [0, 1, 2, 3, 5, 10, 25, 40])
+def test_graph_edge_labels(n_nodes, round_val):
+    rng = np.random.default_rng(n_nodes)
+    for _ in range(5):
+        dist, labels = random_graph(rng, n_nodes, round_val)
+        expected = baseline_graph_edge_labels(dist, labels)
+        graph = graph_edge_labels(dist, labels)
+
+        # same labels, in the same insertion order
+        assert edge_labels(graph) == edge_labels(expected)
+        assert np.array_equal(graph.get_adjacency_matrix(), expected.get_adjacency_matrix())
+
+@pytest.mark.parametrize('round_val', [None, 1, 0.5])
+@pytest.mark.parametrize('n_nodes', [2, 3, 5, 10, 25, 40])
+def test_graph_node_edge_labels(n_nodes, round_val):
+    rng = np.random.default_rng(n_nodes)
+    for _ in range(5):
+        dist, labels = random_graph(rng, n_nodes, round_val)
+        expected = baseline_graph_node_edge_labels(dist, labels)
+        graph = graph_node_edge_labels(dist, labels)
+
+        assert edge_labels(graph) == edge_labels(expected)
+        assert graph.get_labels(purpose = 'adjacency', label_type = 'vertex') == expected.get_labels(purpose = 'adjacency', label_type = 'vertex')
+        assert np.array_equal(graph.get_adjacency_matrix(), expected.get_adjacency_matrix())
+
+def test_compact_labels():
+    rng = np.random.default_rng(0)
+    dist, labels = random_graph(rng, 10, 1)
+    graph = pickle.loads(pickle.dumps(IPAGraph.from_condensed(dist, labels, 1)))
+
+    # codes are positions in the fixed vocabulary, so they decode the same in any process
+    assert graph.node_labels == dict(enumerate(labels))
+    assert np.array_equal(graph.distances(), dist)
+    with pytest.raises(ValueError):
+        IPAGraph.from_condensed(dist, labels[:-1]+['XXX'], 1)
+    assert 'XXX' not in IPA_LABELS
+
+@pytest.mark.parametrize('graph_type', ['grakel', 'compact'])
+@pytest.mark.parametrize('batch_size', [1, 4, 7, 100])
+def test_iter_graphs(tmp_path, monkeypatch, graph_type, batch_size):
+    '''The batches hold the graphs of compute_graphs, in the order of the output files'''
+    monkeypatch.chdir(tmp_path)
+    interactions = Ints([], [])
+    interactions.output_location = write_ipas(str(tmp_path/'ipas'), 25, 0)
+    expected = interactions.compute_graphs(graph_type = graph_type)
+    batches = list(interactions.iter_graphs(batch_size = batch_size, graph_type = graph_type))
+
+    assert [len(batch) for batch in batches] == [min(batch_size, 25 - start) for start in range(0, 25, batch_size)]
+    graphs = np.concatenate(batches)
+    assert len(graphs) == len(expected)
+    for graph, reference in zip(graphs, expected):
+        if graph_type == 'compact':
+            assert np.array_equal(graph.labels, reference.labels)
+            assert np.array_equal(graph.dist, reference.dist)
+        else:
+            assert edge_labels(graph) == edge_labels(reference)
+            assert graph.get_labels(purpose = 'adjacency', label_type = 'vertex') == reference.get_labels(purpose = 'adjacency', label_type = 'vertex')
+            assert np.array_equal(graph.get_adjacency_matrix(), reference.get_adjacency_matrix())
+    with pytest.raises(ValueError):
+        next(interactions.iter_graphs(batch_size = 0))
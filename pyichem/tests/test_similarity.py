@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pyichem.similarity import PackedIfp
+
+def random_ifps(seed, n_ifps, n_columns = 150, missing = ()):
+    '''Sparse random IFPs with columns always 0 and repeated IFPs, as a table with NaN rows for the missing IFPs'''
+    rng = np.random.default_rng(seed)
+    bits = (rng.random((n_ifps, n_columns)) < 0.1).astype(np.uint8)
+    bits[:, ::3] = 0
+    # repeated IFPs give equal similarities
+    bits[1::4] = bits[0::4][:len(bits[1::4])]
+    values = bits.astype(np.float64)
+    values[list(missing)] = np.nan
+    columns = [f'R{j//7:03d} {["HYD", "FTF", "ETF", "HBD", "HBA", "CAT", "ANI"][j % 7]}' for j in range(n_columns)]
+
+    return pd.DataFrame(data = values, columns = columns)
+
+def dense_similarity(query, reference, alpha, beta):
+    '''Tversky similarity computed on the unpacked bits, NaN for the missing IFPs'''
+    q = np.nan_to_num(query.to_numpy(dtype = np.float64))
+    r = np.nan_to_num(reference.to_numpy(dtype = np.float64))
+    common = q @ r.T
+    denominator = alpha*(q.sum(axis = 1)[:, None] - common) + beta*(r.sum(axis = 1)[None, :] - common) + common
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        similarity = np.where(denominator > 0, common/denominator, 0.0)
+    similarity[query.isna().any(axis = 1).to_numpy()] = np.nan
+    similarity[:, reference.isna().any(axis = 1).to_numpy()] = np.nan
+
+    return similarity
+
+@pytest.mark.parametrize('alpha, beta', [(1, 1), (0.5, 0.5), (0.9, 0.1), (0.2, 0.8)])
+@pytest.mark.parametrize('block_size', [None, 1, 7, 64])
+@pytest.mark.parametrize('n_jobs', [1, 4])
+def test_similarity(alpha, beta, block_size, n_jobs):
+    '''Tanimoto and Tversky similarities are the ones of the dense bits, whatever the blocks and the number of threads'''
+    reference = random_ifps(0, 101, missing = (5, 50))
+    query = random_ifps(1, 13, missing = (2,))
+    packed = PackedIfp.from_frame(reference)
+    expected = dense_similarity(query, reference, alpha, beta)
+
+    assert np.allclose(packed.similarity(query, alpha, beta, block_size = block_size, n_jobs = n_jobs), expected, equal_nan = True)
+    assert np.allclose(packed.similarity(PackedIfp.from_frame(query), alpha, beta, block_size = block_size, n_jobs = n_jobs), expected, equal_nan = True)
+
+def test_drop_zero():
+    '''Dropping the columns always 0 keeps the bits of the queries on them in their number of bits'''
+    reference = random_ifps(0, 60)
+    query = random_ifps(1, 9)
+    query.iloc[:, ::3] = 1
+    dropped = PackedIfp.from_frame(reference)
+    kept = PackedIfp.from_frame(reference, drop_zero = False)
+
+    assert len(dropped.columns) < len(kept.columns) == reference.shape[1]
+    assert np.array_equal(dropped.unpack(), reference[dropped.columns].to_numpy(dtype = np.uint8))
+    assert np.array_equal(dropped.counts, kept.counts)
+    for alpha, beta in [(1, 1), (0.9, 0.1)]:
+        expected = dense_similarity(query, reference, alpha, beta)
+        assert np.allclose(dropped.similarity(query, alpha, beta), expected)
+        assert np.allclose(kept.similarity(query, alpha, beta), expected)
+        assert np.allclose(dropped.similarity(query.iloc[3], alpha, beta), expected[3:4])
+
+@pytest.mark.parametrize('k', [1, 5, 12])
+@pytest.mark.parametrize('block_size', [None, 1, 5, 16])
+@pytest.mark.parametrize('n_jobs', [1, 4])
+def test_search(k, block_size, n_jobs):
+    '''Top-k hits of the dense similarities, equal similarities ordered by index, missing IFPs never returned'''
+    reference = random_ifps(0, 80, missing = (4, 20, 41))
+    query = random_ifps(0, 10, missing = (3,))
+    packed = PackedIfp.from_frame(reference)
+    indices, scores = packed.search(query, k, alpha = 0.7, beta = 0.3, block_size = block_size, n_jobs = n_jobs)
+
+    expected = dense_similarity(query, reference, 0.7, 0.3)
+    for i, row in enumerate(expected):
+        if np.isnan(row).all():
+            assert np.all(indices[i] == -1) and np.all(np.isnan(scores[i]))
+            continue
+        valid = np.flatnonzero(~np.isnan(row))
+        order = valid[np.lexsort((valid, -row[valid]))][:k]
+        assert indices[i].tolist() == order.tolist()
+        assert np.allclose(scores[i], row[order])
+
+def test_search_few_ifps():
+    '''Queries with less than k valid IFPs are padded'''
+    reference = random_ifps(0, 6, missing = (0, 2))
+    indices, scores = PackedIfp.from_frame(reference).search(random_ifps(1, 2), k = 6)
+
+    assert np.all(indices[:, 4:] == -1) and np.all(np.isnan(scores[:, 4:]))
+    assert np.all(np.isin(indices[:, :4], [1, 3, 4, 5]))
+    assert np.all(np.diff(scores[:, :4], axis = 1) <= 0)
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pyichem.tables import read_table, write_table, table_name, table_format
+
+FORMATS = ['csv', 'parquet', 'npz']
+
+def fingerprint_frame(missing):
+    '''IFPs as built by ifp_frame, uint8 bits or float bits with NaN rows for the missing IFPs'''
+    rng = np.random.default_rng(0)
+    bits = rng.integers(0, 2, size = (40, 21), dtype = np.uint8)
+    columns = [f'{residue} {code}' for residue in ['A100', 'D113', 'F290'] for code in ['HYD', 'FTF', 'ETF', 'HBD', 'HBA', 'CAT', 'ANI']]
+    if not missing:
+        return pd.DataFrame(data = bits, columns = columns)
+    values = bits.astype(np.float64)
+    values[[0, 7, 39]] = np.nan
+
+    return pd.DataFrame(data = values, columns = columns)
+
+def map_frame():
+    '''Map file of compute_interactions.py and ifp.py'''
+    return pd.DataFrame({'Receptor_file': [f'frames/frame_{i % 3}.mol2' for i in range(30)],
+        'Ligand_file': [f'poses/pose_{i}.mol2' for i in range(30)],
+        'Output_file': [f'ichem_outputs/IPA/out_{i}' for i in range(30)],
+        'IFP_index': np.arange(30)})
+
+def score_frame(pruned):
+    '''Output of scoring.py, poses without graph have a NaN score'''
+    scores = np.linspace(-1, 1, 30)
+    scores[[3, 4]] = np.nan
+    results = {'Protein structure': [f'frames/frame_{i % 3}.mol2' for i in range(30)], 'Ligand pose': [f'poses/pose_{i}.mol2' for i in range(30)], 'Score': scores}
+    if pruned:
+        results['Pruned'] = np.arange(30) % 4 == 0
+
+    return pd.DataFrame.from_dict(results)
+
+def round_trip(df, tmp_path, fmt):
+    file = table_name(str(tmp_path/'table'), fmt)
+    write_table(df, file)
+
+    return read_table(file)
+
+@pytest.mark.parametrize('fmt', FORMATS)
+@pytest.mark.parametrize('missing', [False, True])
+def test_fingerprints(tmp_path, fmt, missing):
+    '''The bits and the NaN rows of the missing IFPs are read back, with their type in the typed formats'''
+    df = fingerprint_frame(missing)
+    read = round_trip(df, tmp_path, fmt)
+
+    assert np.array_equal(read.to_numpy(dtype = np.float64), df.to_numpy(dtype = np.float64), equal_nan = True)
+    assert list(read.columns) == list(df.columns)
+    if fmt != 'csv':
+        pd.testing.assert_frame_equal(read, df)
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_map(tmp_path, fmt):
+    '''The paths of a map file are read back as by read_map_file'''
+    df = map_frame()
+    read = round_trip(df, tmp_path, fmt)
+
+    pd.testing.assert_frame_equal(read, df)
+    assert read['Output_file'].tolist() == df['Output_file'].tolist()
+
+@pytest.mark.parametrize('fmt', FORMATS)
+@pytest.mark.parametrize('pruned', [False, True])
+def test_scores(tmp_path, fmt, pruned):
+    '''NaN scores and the boolean Pruned column are read back'''
+    df = score_frame(pruned)
+    read = round_trip(df, tmp_path, fmt)
+
+    pd.testing.assert_frame_equal(read, df)
+
+@pytest.mark.parametrize('fmt', ['parquet', 'npz'])
+def test_missing_text(tmp_path, fmt):
+    '''None values of text columns and a binary column that is not a fingerprint are read back'''
+    df = pd.DataFrame({'Ligand_file': ['a.mol2', None, 'c.mol2'], 'Selected': [1, 0, 1], 'Score': [0.5, np.nan, -0.5]})
+    read = round_trip(df, tmp_path, fmt)
+
+    assert read['Ligand_file'].isna().tolist() == [False, True, False]
+    assert read['Ligand_file'].dropna().tolist() == ['a.mol2', 'c.mol2']
+    assert read['Selected'].tolist() == [1, 0, 1] and read['Selected'].dtype == df['Selected'].dtype
+    assert np.array_equal(read['Score'], df['Score'], equal_nan = True)
+
+def test_names():
+    '''Unknown extensions are CSV files, unknown formats are refused'''
+    assert table_format('scores.PARQUET') == 'parquet'
+    assert table_format('interactions_map.txt') == 'csv'
+    assert table_name('ifp', 'npz') == 'ifp.npz'
+    with pytest.raises(ValueError):
+        table_name('ifp', 'feather')
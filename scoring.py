@@ -1,15 +1,240 @@
 import argparse
 import sys
+import os
+import tempfile
+import time
+import warnings
+import multiprocessing
 import pdb
 import numpy as np
 from pyichem import ints
 from grakel import ShortestPath
 from sklearn.svm import OneClassSVM as OCSVM
 import joblib
+from ocsvm_training.scoring_model import ScoringModel
+from ocsvm_training.shortest_path import QueryFeatures, shares_query_features, transform_query
+from ocsvm_training.score_cache import ScoreCache, file_key, pose_keys
+from ocsvm_training.prefilter import decision_bound
 import matplotlib.pyplot as plt
 import pandas as pd
+from pyichem.tables import write_table, table_name
+
+def kernel_values(g, kernel, query = None):
+	'''
+	Kernel values between the graphs and the training graphs of a kernel, NaN values are set to 0.
+	Kernels supported by shares_query_features use the query features shared by all the kernels, if given.
+	'''
+	if query is not None and shares_query_features(kernel):
+		dist = transform_query(kernel, query)
+	else:
+		dist = kernel.transform(g)
+	dist[np.isnan(dist)] = 0
+
+	return dist
+
+def score_graphs(g, kernel, model, query = None, bound = None):
+	'''
+	Scores interaction graphs with a trained kernel and OCSVM model.
+	Graphs with less than three nodes are not scored and receive a NaN score.
+	The query features, if given, must be computed on the scored graphs only.
+	With the upper bound of the decision function (DecisionBound) and the query features, the graphs that cannot be selected are not evaluated, their score is the upper bound of their decision value, which is negative.
+	:returns: the scores, and the mask of the graphs pruned by the bound
+	:rtype: numpy array, numpy array
+	'''
+	ng = np.array([gt.n for gt in g])
+	mask = ng > 2
+	scores = np.full(len(g), np.nan)
+	pruned = np.zeros(len(g), dtype = bool)
+	if not mask.any():
+		return scores, pruned
+
+	if bound is None or query is None:
+		scores[mask] = model.decision_function(kernel_values(g[mask], kernel, query))
+	else:
+		rows = np.flatnonzero(mask)
+		scores[rows], pruned[rows] = bound.decision(query, lambda index: model.decision_function(kernel_values(g[rows[index]], kernel, query.select(index))))
+
+	return scores, pruned
+
+def shared_features(g, kernels):
+	'''
+	Extracts once the features of the graphs used by all the kernels supported by shares_query_features (IPAShortestPath and grakel ShortestPath with node labels).
+	A warning is issued for the kernels that cannot use them, they extract the features of the graphs again.
+	:returns: the query features, None if no kernel can use them
+	:rtype: QueryFeatures
+	'''
+	shared = [shares_query_features(kernel) for kernel in kernels]
+	if not all(shared):
+		unshared = sorted({type(kernel).__name__ for kernel, share in zip(kernels, shared) if not share})
+		warnings.warn(f'The query features cannot be shared with the kernels {", ".join(unshared)}, each of them extracts the features of the graphs')
+	if not any(shared):
+		return None
+
+	return QueryFeatures(g)
+
+def iter_models(args):
+	'''
+	Loads the kernel and model pairs given as arguments.
+	Scoring models exported by training.py contain their own kernel, the corresponding kernel file can be omitted.
+	:returns: description, kernel and model of each pair
+	:rtype: generator of tuples
+	'''
+	kernel_files = args.kernel if args.kernel is not None else [None]*len(args.model)
+	if len(kernel_files) != len(args.model):
+		raise ValueError('A kernel must be given for each model')
+	for kernel_file, model_file in zip(kernel_files, args.model):
+		model = joblib.load(model_file)
+		if isinstance(model, ScoringModel):
+			yield model_file, model.kernel, model
+		elif kernel_file is None:
+			raise ValueError(f'No kernel given for the model {model_file}')
+		else:
+			yield f'{kernel_file} and {model_file}', joblib.load(kernel_file), model
+
+def model_files(args, models):
+	'''
+	:param models: Models loaded by iter_models
+	:type models: list of models
+	:returns: the files of each kernel and model pair given as arguments, the kernel files given for scoring models are not used
+	:rtype: list of lists of str
+	'''
+	kernel_files = args.kernel if args.kernel is not None else [None]*len(args.model)
+
+	return [[model_file] if isinstance(model, ScoringModel) else [kernel_file, model_file] for kernel_file, model_file, model in zip(kernel_files, args.model, models)]
+
+def score_batch(g, kernels, models, bounds = None):
+	'''
+	Scores a batch of graphs with all the models, the query features are extracted once.
+	:returns: the scores and the mask of the pruned graphs of each model, and the number of scored graphs
+	:rtype: list of tuples, int
+	'''
+	scored = np.array([gt.n for gt in g]) > 2
+	query = shared_features(g[scored], kernels)
+	if bounds is None:
+		bounds = [None]*len(models)
+
+	return [score_graphs(g, kernel, model, query, bound) for kernel, model, bound in zip(kernels, models, bounds)], int(np.sum(scored))
+
+def prefilter_bounds(args, kernels, models):
+	'''
+	:returns: the upper bound of the decision function of each model if the prefilter is enabled, None for the unsupported models
+	:rtype: list
+	'''
+	if args.prefilter is None:
+		return [None]*len(models)
+
+	return [decision_bound(kernel, model, bin_width = args.prefilter) for kernel, model in zip(kernels, models)]
+
+def pruned_report(pruned, n_scored, bound = None):
+	'''
+	:param pruned: Number of pruned poses
+	:type pruned: int
+	:param n_scored: Number of scored poses
+	:type n_scored: int
+	:param bound: Bound used in this process, its calibration and measured times are reported
+	:type bound: DecisionBound, optional
+	:returns: lines of the report
+	:rtype: list of str
+	'''
+	report = [f'Poses pruned by the upper bound: {pruned} / {n_scored} ({pruned/max(n_scored, 1):.2%}), their score is the upper bound of their decision value and they are flagged in the Pruned column']
+	if bound is not None and bound.n_levels is not None:
+		report.append(f'Levels of the bound used after the calibration: {bound.n_levels}, bound time {bound.bound_time:.3f} s, estimated exact time saved {bound.saved_time:.3f} s')
+
+	return report
+
+def prefilter_check(g, kernel, model, query, scores, pruned, wall_time):
+	'''
+	Scores the graphs again without the prefilter and compares the wall times and the selected poses of the two runs.
+	:param scores: Scores computed with the prefilter
+	:type scores: numpy array
+	:param pruned: Mask of the pruned graphs
+	:type pruned: numpy array
+	:param wall_time: Wall time of the scoring with the prefilter
+	:type wall_time: float
+	:returns: lines of the report
+	:rtype: list of str
+	'''
+	start = time.time()
+	exact, _ = score_graphs(g, kernel, model, query)
+	exact_time = time.time() - start
+	evaluated = ~pruned
+	identical = np.array_equal(scores >= 0, exact >= 0) and np.allclose(scores[evaluated], exact[evaluated], equal_nan = True)
+
+	return [f'Wall time with the prefilter: {wall_time:.3f} s, exact run: {exact_time:.3f} s (speedup {exact_time/max(wall_time, 1e-12):.2f})',
+		f'Selected poses and scores identical to the exact run: {identical}']
+
+
+def share_models(kernels, models, folder):
+	'''
+	Saves the kernel and model pairs uncompressed, so that the worker processes memory map their arrays (features of the training graphs, coefficients) instead of receiving a copy.
+	:returns: the saved files
+	:rtype: list of str
+	'''
+	files = list()
+	for i, pair in enumerate(zip(kernels, models)):
+		files.append(os.path.join(folder, f'model_{i}.sav'))
+		joblib.dump(pair, files[-1])
+
+	return files
+
+_worker_state = dict()
+
+def _init_worker(files, bounds, type_int, subgraph, graph_type):
+	'''
+	Loads the memory mapped kernels and models in a worker process.
+	'''
+	# copy-on-write mapping, the arrays are shared by the processes until written
+	pairs = [joblib.load(file, mmap_mode = 'c') for file in files]
+	_worker_state['kernels'] = [kernel for kernel, _ in pairs]
+	_worker_state['models'] = [model for _, model in pairs]
+	_worker_state['bounds'] = bounds
+	_worker_state['interactions'] = ints.Ints([], [], type_int = type_int)
+	_worker_state['graphs'] = {'subgraph': subgraph, 'graph_type': graph_type}
+
+def _score_worker(locations):
+	interactions = _worker_state['interactions']
+	interactions.output_location = locations
+	g = interactions.compute_graphs(**_worker_state['graphs'])
+
+	return score_batch(g, _worker_state['kernels'], _worker_state['models'], _worker_state['bounds'])
+
+def iter_scores(interactions, kernels, models, batch_size, n_jobs = None, subgraph = None, graph_type = 'grakel', bounds = None):
+	'''
+	Scores the poses one batch at a time, in the order of the output files.
+	With n_jobs the batches are distributed to a pool of processes sharing the memory mapped kernels and models, the results are still returned in the order of the poses.
+	:returns: the scores of each model and the number of scored graphs of each batch
+	:rtype: generator of tuples
+	'''
+	locations = interactions.output_location
+	if n_jobs is None or n_jobs == 1 or len(locations) == 0:
+		# without poses there is no batch to distribute to the processes
+		for g in interactions.iter_graphs(batch_size = batch_size, subgraph = subgraph, graph_type = graph_type):
+			yield score_batch(g, kernels, models, bounds)
+		return
+
+	batches = [locations[start:start+batch_size] for start in range(0, len(locations), batch_size)]
+	with tempfile.TemporaryDirectory() as folder:
+		files = share_models(kernels, models, folder)
+		with multiprocessing.Pool(min(n_jobs, len(batches)), initializer = _init_worker, initargs = (files, bounds, interactions.type_int, subgraph, graph_type)) as pool:
+			yield from pool.imap(_score_worker, batches)
+
+def _batch_size(args, n_poses):
+	'''
+	Size of the batches of poses, by default a single batch or a few batches for each process to balance the load.
+	'''
+	if args.batch_size is not None:
+		return args.batch_size
+	if args.n_jobs is None or args.n_jobs == 1:
+		return max(1, n_poses)
+
+	return max(1, -(-n_poses // (4*args.n_jobs)))
 
 def main(args):
+
+	if args.cache is not None:
+		return cached_main(args)
+	if args.batch_size is not None or (args.n_jobs is not None and args.n_jobs > 1):
+		return batch_main(args)
 	
 	graphs = list()
 	report = list()
@@ -20,7 +245,7 @@ def main(args):
 	interactions.read_map_file(args.file)
 	if args.folder is not None:
 		interactions.output_location = [args.folder+loc for loc in interactions.output_location]
-	graphs.append(interactions.compute_graphs(subgraph = args.subgraph))
+	graphs.append(interactions.compute_graphs(subgraph = args.subgraph, graph_type = args.graph_type))
 
 	g = np.concatenate(graphs)
 	ng = np.array([gt.n for gt in g])
@@ -31,24 +256,166 @@ def main(args):
 	print('Interaction graphs generated')
 	report.append(f'Interaction graphs generated for rescoring: {len(g)}\n')
 
-	for i, (kernel_file, model_file) in enumerate(zip(args.kernel, args.model)):
-		print(f'Rescoring using {kernel_file} and {model_file}')
-		report.append(f'Rescoring using {kernel_file} and {model_file}')
-		kernel = joblib.load(kernel_file)
-		model = joblib.load(model_file)
+	names, kernels, models = zip(*iter_models(args))
+	bounds = prefilter_bounds(args, kernels, models)
+	query = shared_features(g, kernels)
 
-		dist = kernel.transform(g)
-		dist[np.isnan(dist)] = 0
-		scores = model.decision_function(dist)
+	for i, (name, kernel, model, bound) in enumerate(zip(names, kernels, models, bounds)):
+		print(f'Rescoring using {name}')
+		report.append(f'Rescoring using {name}')
+
+		start = time.time()
+		scores, pruned = score_graphs(g, kernel, model, query, bound)
+		wall_time = time.time() - start
 		scores_tmp = np.full(len(mask), np.nan)
 		scores_tmp[mask]=scores
 
+		if bound is not None:
+			report.extend(pruned_report(np.sum(pruned), len(g), bound))
+			if args.prefilter_check:
+				report.extend(prefilter_check(g, kernel, model, query, scores, pruned, wall_time))
 		report.append(f'Docking poses selected: {len(scores[scores >= 0])} / {len(g)}\n')
 
 		results_dict = {'Protein structure': interactions.receptor_mol2, 'Ligand pose': interactions.ligand_mol2, 'Score': scores_tmp}
+		if bound is not None:
+			pruned_tmp = np.zeros(len(mask), dtype = bool)
+			pruned_tmp[mask] = pruned
+			results_dict['Pruned'] = pruned_tmp
 		print('Saving results ...')
 
-		pd.DataFrame.from_dict(results_dict).to_csv(f'MD_rescoring_{i}.csv', index = False)
+		write_table(pd.DataFrame.from_dict(results_dict), table_name(f'MD_rescoring_{i}', args.output_format))
+
+	with open(args.report, 'w') as rep:
+		rep.writelines('\n'.join(report))
+	print('Calculations completed')
+
+def batch_main(args):
+	'''
+	Rescoring performed one batch of docking poses at a time.
+	The results of each batch are appended to the output files, so that only one batch of graphs and kernel values is kept in memory.
+	'''
+	report = list()
+
+	interactions = ints.Ints([], [], type_int = args.type)
+	interactions.read_map_file(args.file)
+	if args.folder is not None:
+		interactions.output_location = [args.folder+loc for loc in interactions.output_location]
+
+	names, kernels, models = zip(*iter_models(args))
+	bounds = prefilter_bounds(args, kernels, models)
+	selected = np.zeros(len(models), dtype = int)
+	pruned = np.zeros(len(models), dtype = int)
+	n_scored = 0
+	n_poses = len(interactions.output_location)
+	results = [list() for _ in models]
+
+	batch_size = _batch_size(args, n_poses)
+	if args.n_jobs is not None and args.n_jobs > 1:
+		print(f'Rescoring in batches of {batch_size} poses with {args.n_jobs} processes')
+	else:
+		print(f'Rescoring in batches of {batch_size} poses')
+
+	start = 0
+	for b, (scores, n_batch) in enumerate(iter_scores(interactions, kernels, models, batch_size, args.n_jobs, subgraph = args.subgraph, graph_type = args.graph_type, bounds = bounds)):
+		size = len(scores[0][0])
+		receptors = interactions.receptor_mol2[start:start+size]
+		ligands = interactions.ligand_mol2[start:start+size]
+		for i, (model_scores, model_pruned) in enumerate(scores):
+			selected[i] += np.sum(model_scores >= 0)
+			pruned[i] += np.sum(model_pruned)
+
+			results_dict = {'Protein structure': receptors, 'Ligand pose': ligands, 'Score': model_scores}
+			if bounds[i] is not None:
+				results_dict['Pruned'] = model_pruned
+			if args.output_format == 'csv':
+				pd.DataFrame.from_dict(results_dict).to_csv(f'MD_rescoring_{i}.csv', index = False, mode = 'w' if b == 0 else 'a', header = b == 0)
+			else:
+				# columnar files cannot be appended, the scores are written once all the batches are scored
+				results[i].append((model_scores, model_pruned))
+
+		n_scored += n_batch
+		start += size
+		print(f'Poses rescored: {start} / {n_poses}')
+
+	if args.output_format != 'csv':
+		for i, model_results in enumerate(results):
+			model_scores, model_pruned = zip(*model_results)
+			results_dict = {'Protein structure': interactions.receptor_mol2, 'Ligand pose': interactions.ligand_mol2, 'Score': np.concatenate(model_scores)}
+			if bounds[i] is not None:
+				results_dict['Pruned'] = np.concatenate(model_pruned)
+			write_table(pd.DataFrame.from_dict(results_dict), table_name(f'MD_rescoring_{i}', args.output_format))
+
+	report.append(f'Interaction graphs generated for rescoring: {n_scored}\n')
+	for i, name in enumerate(names):
+		report.append(f'Rescoring using {name}')
+		if bounds[i] is not None:
+			# with several processes the bounds are calibrated in the workers
+			report.extend(pruned_report(pruned[i], n_scored, bounds[i]))
+		report.append(f'Docking poses selected: {selected[i]} / {n_scored}\n')
+
+	with open(args.report, 'w') as rep:
+		rep.writelines('\n'.join(report))
+	print('Calculations completed')
+
+def cached_main(args):
+	'''
+	Rescoring reusing the scores stored in the score cache.
+	Only the poses missing from the cache of at least one model are scored, in batches and processes as set by the arguments, and their scores are added to the cache.
+	'''
+	report = list()
+
+	interactions = ints.Ints([], [], type_int = args.type)
+	interactions.read_map_file(args.file)
+	if args.folder is not None:
+		interactions.output_location = [args.folder+loc for loc in interactions.output_location]
+
+	names, kernels, models = zip(*iter_models(args))
+	bounds = prefilter_bounds(args, kernels, models)
+	cache = ScoreCache(args.cache)
+	# the bounds of the pruned poses are cached separately from the exact scores, with the pruned flags
+	model_keys = [file_key(files, {'prefilter': args.prefilter} if bound is not None else None) for files, bound in zip(model_files(args, models), bounds)]
+	keys = pose_keys(interactions.ipa_files(), {'type': args.type, 'subgraph': args.subgraph, 'graph_type': args.graph_type})
+
+	cached = [cache.get(model_key, keys) for model_key in model_keys]
+	scores = np.array([model_scores for model_scores, _ in cached])
+	found = np.array([model_found for _, model_found in cached])
+	pruned = np.zeros(scores.shape, dtype = bool)
+	for i, model_key in enumerate(model_keys):
+		if bounds[i] is not None:
+			pruned[i] = cache.get(f'{model_key}_pruned', keys)[0] == 1
+	missing = np.flatnonzero(~found.all(axis = 0))
+	print(f'Poses found in the score cache: {len(keys) - len(missing)} / {len(keys)}')
+
+	if len(missing):
+		subset = ints.Ints([], [], type_int = args.type)
+		subset.output_location = [interactions.output_location[j] for j in missing]
+		computed = [list() for _ in models]
+		for batch_scores, _ in iter_scores(subset, kernels, models, _batch_size(args, len(missing)), args.n_jobs, subgraph = args.subgraph, graph_type = args.graph_type, bounds = bounds):
+			for i, model_results in enumerate(batch_scores):
+				computed[i].append(model_results)
+		missing_keys = [keys[j] for j in missing]
+		for i, model_key in enumerate(model_keys):
+			model_scores, model_pruned = zip(*computed[i])
+			scores[i, missing] = np.concatenate(model_scores)
+			pruned[i, missing] = np.concatenate(model_pruned)
+			cache.put(model_key, missing_keys, scores[i, missing])
+			if bounds[i] is not None:
+				cache.put(f'{model_key}_pruned', missing_keys, pruned[i, missing])
+
+	n_scored = np.sum(~np.isnan(scores[0]))
+	report.append(f'Interaction graphs generated for rescoring: {n_scored}')
+	report.append(f'Score cache {args.cache}: {np.sum(found)} / {found.size} scores reused (hit rate {np.mean(found):.2%}), {len(missing)} poses scored\n')
+
+	for i, name in enumerate(names):
+		report.append(f'Rescoring using {name}')
+		if bounds[i] is not None:
+			report.extend(pruned_report(np.sum(pruned[i]), n_scored, bounds[i]))
+		report.append(f'Docking poses selected: {np.sum(scores[i] >= 0)} / {n_scored}\n')
+
+		results_dict = {'Protein structure': interactions.receptor_mol2, 'Ligand pose': interactions.ligand_mol2, 'Score': scores[i]}
+		if bounds[i] is not None:
+			results_dict['Pruned'] = pruned[i]
+		write_table(pd.DataFrame.from_dict(results_dict), table_name(f'MD_rescoring_{i}', args.output_format))
 
 	with open(args.report, 'w') as rep:
 		rep.writelines('\n'.join(report))
@@ -57,13 +424,20 @@ def main(args):
 
 if __name__ == "__main__":
 	parser=argparse.ArgumentParser()
-	parser.add_argument('-m', '--model', nargs = '+', help = 'Model(s) used for pose rescoring', required = True)
-	parser.add_argument('-k', '--kernel', nargs = '+', help = 'Kernel(s) used for Gram matrix dertermination', required = True)
+	parser.add_argument('-m', '--model', nargs = '+', help = 'Model(s) used for pose rescoring, OCSVM models or scoring models exported by training.py', required = True)
+	parser.add_argument('-k', '--kernel', nargs = '+', default = None, help = 'Kernel(s) used for Gram matrix dertermination, not needed for scoring models exported by training.py')
 	parser.add_argument('-f', '--file', help='Inuput map file generated by a script calculating the interactions', required = True)
 	parser.add_argument('-fo', '--folder', default = None, help='folder conatining the interaction files')
 	parser.add_argument('-t', '--type', default = 'MERG', help='type of interactions used in interaction detection.\navailble types: MERG, CENT, LIG, PROT')
 	parser.add_argument('-sg', '--subgraph', default = None, help='Available subgraph types: CENT, LIG, PROT, ELEC')
+	parser.add_argument('-gt', '--graph_type', default = 'grakel', choices = ['grakel', 'compact'], help = 'Format of the interaction graphs held in memory, compact graphs store only label codes and quantized distances')
 	parser.add_argument('-r', '--report', default = 'rescoring_report.txt', help = 'Report file name')
+	parser.add_argument('-b', '--batch_size', type = int, default = None, help = 'Rescore the poses in batches of the given size, writing the results incrementally')
+	parser.add_argument('-pf', '--prefilter', type = float, nargs = '?', const = 2.0, default = None, help = 'Skip the exact evaluation of the poses whose upper bound of the decision value is negative, the score of the pruned poses is their negative upper bound, they are flagged in a Pruned column and the selected poses are unchanged. The levels of the bound used are calibrated on the first poses, the ones costing more time than they save are dropped. The optional value is the width of the bins of the path lengths used by the bound (default 2), 0 to group the paths by label pair only. Supported for IPA kernels')
+	parser.add_argument('-pfc', '--prefilter_check', action = 'store_true', help = 'Score the poses also without the prefilter and report the wall times of the two runs, not used in batch mode and with the score cache')
+	parser.add_argument('-c', '--cache', default = None, help = 'Folder of the score cache, only the poses whose IPA file or model changed since the previous runs are scored')
+	parser.add_argument('-of', '--output_format', default = 'csv', choices = ['csv', 'parquet', 'npz'], help = 'Format of the output tables MD_rescoring_i, Parquet and npz files are compressed and typed, in batch mode they are written once all the poses are scored')
+	parser.add_argument('-j', '--n_jobs', type = int, default = None, help = 'Number of processes generating the graphs and scoring the poses, the results are written in the order of the poses')
 
 	parser.set_defaults(func=main)
 	args=parser.parse_args()
@@ -0,0 +1,197 @@
+import argparse
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from pyichem import ints
+from scoring import iter_models, score_batch
+
+_models = None
+
+def _init_worker(models):
+	global _models
+	_models = models
+	# the server process stops the workers
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _interrupt(signum, frame):
+	raise KeyboardInterrupt
+
+def _warm_up():
+	return len(_models)
+
+def score_request(request, submitted):
+	'''
+	Scores the poses of a request with all the models, in a worker process.
+	The request gives a map file generated by a script calculating the interactions (map_file, optional folder) or a list of IPA .mol2 files (ipa_files).
+	:param request: Decoded JSON request
+	:type request: dict
+	:param submitted: Time at which the request was submitted to the pool
+	:type submitted: float
+	:returns: the scores of each model and the time spent waiting and in each stage
+	:rtype: dict
+	'''
+	started = time.time()
+	interactions = ints.Ints([], [], type_int = request.get('type', 'MERG'))
+	subgraph = request.get('subgraph')
+	graph_type = request.get('graph_type', 'grakel')
+
+	start = time.perf_counter()
+	if 'map_file' in request:
+		interactions.read_map_file(request['map_file'])
+		if request.get('folder') is not None:
+			interactions.output_location = [request['folder']+loc for loc in interactions.output_location]
+		g = interactions.compute_graphs(subgraph = subgraph, graph_type = graph_type)
+		poses = {'receptor': interactions.receptor_mol2, 'ligand': interactions.ligand_mol2}
+	elif 'ipa_files' in request:
+		# same rounding of the distances as compute_graphs
+		g = np.array([ints.graph_generator(file, subgraph = subgraph, round_val = 1, graph_type = graph_type) for file in request['ipa_files']])
+		poses = {'ipa_file': list(request['ipa_files'])}
+	else:
+		raise ValueError('The request must contain map_file or ipa_files')
+	graphs_time = time.perf_counter() - start
+
+	start = time.perf_counter()
+	names, kernels, models = zip(*_models)
+	results, _ = score_batch(g, kernels, models)
+	scores = [model_scores for model_scores, _ in results]
+	scoring_time = time.perf_counter() - start
+
+	return {**poses,
+		'models': list(names),
+		# NaN scores of the graphs with less than three nodes become null
+		'scores': [[None if np.isnan(s) else float(s) for s in model_scores] for model_scores in scores],
+		'selected': [int(np.sum(model_scores >= 0)) for model_scores in scores],
+		'latency': {'queue': started - submitted, 'graphs': graphs_time, 'scoring': scoring_time}}
+
+class LatencyMetrics():
+	'''
+	Latency of the requests served, shared by the threads of the server.
+	:param history: Number of recent requests whose latency is kept
+	:type history: int
+	'''
+	def __init__(self, history = 1000):
+		self.history = history
+		self.lock = threading.Lock()
+		self.recent = list()
+		self.requests = 0
+		self.errors = 0
+		self.poses = 0
+
+	def add(self, latency, n_poses):
+		with self.lock:
+			self.requests += 1
+			self.poses += n_poses
+			self.recent = (self.recent + [latency])[-self.history:]
+
+	def add_error(self):
+		with self.lock:
+			self.errors += 1
+
+	def summary(self):
+		'''
+		:returns: number of requests and poses served, and statistics of the latency of each stage over the recent requests in seconds
+		:rtype: dict
+		'''
+		with self.lock:
+			recent = list(self.recent)
+			summary = {'requests': self.requests, 'errors': self.errors, 'poses': self.poses}
+		stages = dict()
+		for stage in ('queue', 'graphs', 'scoring', 'total'):
+			values = np.array([latency[stage] for latency in recent])
+			if len(values):
+				stages[stage] = {'mean': float(np.mean(values)), 'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)), 'max': float(np.max(values))}
+		summary['latency'] = stages
+		summary['last'] = recent[-1] if recent else None
+
+		return summary
+
+class ScoringHandler(BaseHTTPRequestHandler):
+	'''
+	POST /score scores the poses given in the JSON body, GET /metrics returns the latency metrics, GET /models the loaded models.
+	'''
+	def _send(self, status, content):
+		body = json.dumps(content).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path == '/metrics':
+			self._send(200, self.server.metrics.summary())
+		elif self.path == '/models':
+			self._send(200, {'models': self.server.names})
+		else:
+			self._send(404, {'error': f'Unknown path {self.path}'})
+
+	def do_POST(self):
+		if self.path != '/score':
+			self._send(404, {'error': f'Unknown path {self.path}'})
+			return
+		start = time.perf_counter()
+		try:
+			request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+			result = self.server.pool.submit(score_request, request, time.time()).result()
+		except Exception as e:
+			self.server.metrics.add_error()
+			self._send(400, {'error': f'{type(e).__name__}: {e}'})
+			return
+		result['latency']['total'] = time.perf_counter() - start
+		self.server.metrics.add(result['latency'], len(result['scores'][0]) if result['scores'] else 0)
+		self._send(200, result)
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			super().log_message(format, *args)
+
+def main(args):
+	print('Loading models')
+	models = list(iter_models(args))
+	names = [name for name, _, _ in models]
+
+	# forked workers inherit the loaded models without copying them
+	workers = args.workers if args.workers is not None else os.cpu_count()
+	context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+	pool = ProcessPoolExecutor(max_workers = workers, mp_context = context, initializer = _init_worker, initargs = (models,))
+	# the workers are started before the threads of the server
+	pool.submit(_warm_up).result()
+
+	server = ThreadingHTTPServer((args.host, args.port), ScoringHandler)
+	server.pool = pool
+	server.names = names
+	server.metrics = LatencyMetrics()
+	server.verbose = args.verbose
+
+	signal.signal(signal.SIGTERM, _interrupt)
+	print(f'Serving {len(models)} models on http://{args.host}:{server.server_port} with {workers} workers')
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		pool.shutdown()
+	print('Server stopped')
+
+
+if __name__ == "__main__":
+	parser=argparse.ArgumentParser(description = 'Scoring server keeping the models in memory. Requests are JSON objects posted to /score, containing map_file (and optionally folder) or ipa_files, and optionally type, subgraph and graph_type. The latency metrics are available at /metrics.')
+	parser.add_argument('-m', '--model', nargs = '+', help = 'Model(s) used for pose rescoring, OCSVM models or scoring models exported by training.py', required = True)
+	parser.add_argument('-k', '--kernel', nargs = '+', default = None, help = 'Kernel(s) used for Gram matrix dertermination, not needed for scoring models exported by training.py')
+	parser.add_argument('-H', '--host', default = '127.0.0.1', help = 'Address of the server, by default only local connections are accepted')
+	parser.add_argument('-p', '--port', type = int, default = 8765, help = 'Port of the server')
+	parser.add_argument('-w', '--workers', type = int, default = None, help = 'Number of worker processes scoring the requests, by default the number of processors')
+	parser.add_argument('-v', '--verbose', action = 'store_true', help = 'Log every request')
+
+	parser.set_defaults(func=main)
+	args=parser.parse_args()
+	status = args.func(args)
+	sys.exit(status)
@@ -1,60 +1,127 @@
 import argparse
 import pdb
 import sys
+import os
+import copy
+import time
 import numpy as np
 from grakel import ShortestPath
 from ocsvm_training.mad_knn import MAD_KNN
-from ocsvm_training.qms import QMS2
+from ocsvm_training.qms import QMS2, select_sensibility, plot_knee_sweep, show_plot
+from ocsvm_training.shortest_path import IPAShortestPath, unfitted_copy
+from ocsvm_training.gram import BlockedGram, submatrix
+from ocsvm_training.incremental import IncrementalGram
+from ocsvm_training.gram_store import GramStore
+from ocsvm_training.scoring_model import export_scoring_model
+from ocsvm_training.ann import LSHNeighbours, compare_with_exact
+from ocsvm_training.knn import TiledNeighbours
+from ocsvm_training import nystroem
 from sklearn.svm import OneClassSVM as OCSVM
 import joblib
 from pyichem import ints
 import matplotlib.pyplot as plt
 
 
-def qms2_training(graphs, kernel, model_name, kernel_name):
+def export(kernel, model, graphs, scoring_name):
+	'''
+	Saves the support-vector-only scoring model of an OCSVM and returns the line of the report.
+	'''
+	if not isinstance(model, OCSVM):
+		return f'Scoring model not exported: {type(model).__name__} models are scored against the landmarks'
+	joblib.dump(export_scoring_model(kernel, model, graphs), scoring_name)
+
+	return f'Scoring model ({model.n_support_[0]} support vectors out of {len(graphs)} training graphs) saved as: {scoring_name}'
+
+def model_size(model):
+	'''
+	Line of the report with the size of the model, the sgd Nyström models have no support vectors and their size is the number of landmarks.
+	'''
+	if isinstance(model, nystroem.NystroemOCSVM):
+		if model.solver != 'libsvm':
+			return f'Landmarks: {model.n_landmarks_}'
+		return f'Size of the support vector: {model.n_support_[0]}, landmarks: {model.n_landmarks_}'
+
+	return f'Size of the support vector: {model.n_support_[0]}'
+
+def qms2_training(graphs, kernel, model_name, kernel_name, gram = None, approximate = None, n_landmarks = None, solver = 'libsvm', sensibilities = None, knee_rule = 'stable', plot_prefix = None, store = None, scoring_name = None, out_of_core = None, tile_size = 2048):
 	report = ['Training using QMS2 method']
-	trainer_qms2 = QMS2(graphs, kernel)
-	sensibility = 1
-	report.append(f'Kneedle algorithm sensibility: {sensibility}')
-	while sensibility != -1:
-		report[-1] = f'Kneedle algorithm sensibility: {sensibility}'
-		fitted_graphs = trainer_qms2.fit(find_n = True, direction = 'increasing', curve = 'concave', S_knee = sensibility)
-		sensibility = input(f'Please insert the new sensibility value (current sensibility: {sensibility}).\nSensibility is an integer value.\n If the correct knee has been selected please set the sensibility to -1.\n')
-		sensibility = int(sensibility)
-	ghram_matrix = kernel.fit_transform(fitted_graphs)
+	trainer_qms2 = QMS2(graphs, kernel, gram, approximate = approximate, store = store)
+	if sensibilities is not None:
+		# non-interactive selection of the sensibility from a sweep over the cached KNN-average similarity
+		knees = trainer_qms2.knee_sweep(sensibilities, find_n = True, direction = 'increasing', curve = 'concave')
+		sensibility = select_sensibility(sensibilities, knees, knee_rule)
+		report.append('Kneedle algorithm sensibility sweep: ' + ', '.join(f'{S:g} -> {knee:.4f}' for S, knee in zip(sensibilities, knees)))
+		report.append(f'Kneedle algorithm sensibility: {sensibility:g} (selected with the {knee_rule} rule)')
+		plot_knee_sweep(sensibilities, knees, sensibility, plot_prefix)
+		fitted_graphs = trainer_qms2.fit(find_n = True, direction = 'increasing', curve = 'concave', S_knee = sensibility, plot_prefix = plot_prefix)
+	else:
+		sensibility = 1
+		report.append(f'Kneedle algorithm sensibility: {sensibility}')
+		while sensibility != -1:
+			report[-1] = f'Kneedle algorithm sensibility: {sensibility}'
+			fitted_graphs = trainer_qms2.fit(find_n = True, direction = 'increasing', curve = 'concave', S_knee = sensibility, plot_prefix = plot_prefix)
+			sensibility = input(f'Please insert the new sensibility value (current sensibility: {sensibility}).\nSensibility is an integer value.\n If the correct knee has been selected please set the sensibility to -1.\n')
+			sensibility = int(sensibility)
 	report.append(f'Graphs selected for model training: {len(fitted_graphs)}/{len(graphs)}')
+	if n_landmarks is not None:
+		kernel, ocsvm_qms2, ghram_matrix = nystroem.nystroem_training(fitted_graphs, kernel, 0.01, n_landmarks, solver)
+		report.append(f'Nyström model trained using {ghram_matrix.shape[1]} landmark graphs, {solver} solver')
+	else:
+		if gram is None:
+			kernel = unfitted_copy(kernel)
+			ghram_matrix = kernel.fit_transform(fitted_graphs) if store is None else store.fit_transform(kernel, fitted_graphs)
+		else:
+			# the model is trained on the QMS2 selection, the saved kernel must be fitted on the same graphs
+			if out_of_core is not None:
+				# the selection is usually most of the graphs, its matrix is copied by tiles next to the full one
+				ghram_matrix = submatrix(gram, np.flatnonzero(trainer_qms2.mask), os.path.join(out_of_core, 'gram_qms2.npy'), tile_size)
+			else:
+				ghram_matrix = gram[np.ix_(trainer_qms2.mask, trainer_qms2.mask)]
+			kernel = unfitted_copy(kernel).fit(fitted_graphs)
 
-	ocsvm_qms2 = OCSVM( kernel = 'precomputed', nu = 0.01)
-
-	ocsvm_qms2.fit(ghram_matrix)
-	report.append(f'Size of the support vector: {ocsvm_qms2.n_support_[0]}')
+		ocsvm_qms2 = OCSVM( kernel = 'precomputed', nu = 0.01)
+		ocsvm_qms2.fit(ghram_matrix)
+	report.append(model_size(ocsvm_qms2))
 	plt.hist(ocsvm_qms2.decision_function(ghram_matrix), bins = 100)
-	plt.show()
+	show_plot(plot_prefix, 'qms2_decision')
 
 	report.append(f'Kernel saved as: {kernel_name}\nModel saved as: {model_name}\n')
 
 	joblib.dump(ocsvm_qms2, model_name)
 	joblib.dump(kernel, kernel_name)
+	if scoring_name is not None:
+		report.insert(-1, export(kernel, ocsvm_qms2, fitted_graphs, scoring_name))
 
 	return report
 
-def mad_training(graphs, kernel, model_name, kernel_name):
+def mad_training(graphs, kernel, model_name, kernel_name, gram = None, approximate = None, n_landmarks = None, solver = 'libsvm', plot_prefix = None, store = None, scoring_name = None):
 	report = ['Training using MAD-KNN method']
-	trainer_mad = MAD_KNN(graphs, kernel)
+	trainer_mad = MAD_KNN(graphs, kernel, gram, approximate = approximate, store = store)
 
-	trainer_mad.fit(find_n = True)
+	trainer_mad.fit(find_n = True, plot_prefix = plot_prefix)
 	report.append(f'Calculated nu value: {trainer_mad.nu}')
+	if n_landmarks is not None:
+		kernel, ocsvm_mad, ghram_matrix = nystroem.nystroem_training(graphs, kernel, trainer_mad.nu, n_landmarks, solver)
+		report.append(f'Nyström model trained using {ghram_matrix.shape[1]} landmark graphs, {solver} solver')
+	else:
+		if not hasattr(trainer_mad, 'dist'):
+			# the approximate search does not compute the Gram matrix, it is needed to train the model
+			trainer_mad.dist = trainer_mad.kernel.fit_transform(graphs) if store is None else store.fit_transform(trainer_mad.kernel, graphs)
+		kernel = trainer_mad.kernel
+		ghram_matrix = trainer_mad.dist
 
-	ocsvm_mad = OCSVM( kernel = 'precomputed', nu = trainer_mad.nu)
-	ocsvm_mad.fit(trainer_mad.dist)
-	report.append(f'Size of the support vector: {ocsvm_mad.n_support_[0]}')
-	plt.hist(ocsvm_mad.decision_function(trainer_mad.dist), bins = 100)
-	plt.show()
+		ocsvm_mad = OCSVM( kernel = 'precomputed', nu = trainer_mad.nu)
+		ocsvm_mad.fit(ghram_matrix)
+	report.append(model_size(ocsvm_mad))
+	plt.hist(ocsvm_mad.decision_function(ghram_matrix), bins = 100)
+	show_plot(plot_prefix, 'mad_decision')
 
 	report.append(f'Kernel saved as: {kernel_name}\nModel saved as: {model_name}\n')
 
 	joblib.dump(ocsvm_mad, model_name)
-	joblib.dump(trainer_mad.kernel, kernel_name)
+	joblib.dump(kernel, kernel_name)
+	if scoring_name is not None:
+		report.insert(-1, export(kernel, ocsvm_mad, graphs, scoring_name))
 
 	return report
 
@@ -65,38 +132,109 @@ def main(args):
 	report = list()
 	report.append('Report of the training:')
 
+	plot_prefix = None
+	if args.headless:
+		plt.switch_backend('Agg')
+		plot_prefix = args.plot_prefix
+
+	if args.graph_kernel == 'grakel':
+		base_kernel = ShortestPath(normalize = args.normalize)
+	else:
+		base_kernel = IPAShortestPath(normalize = args.normalize, n_jobs = args.n_jobs, tile_size = args.tile_size)
+
+	files = args.file
+	if args.incremental is not None:
+		# only the map files not yet stored in the incremental folder are read
+		incremental = IncrementalGram(args.incremental, base_kernel, tile_size = args.tile_size, settings = {'type': args.type, 'subgraph': args.subgraph, 'graph_type': args.graph_type})
+		files = incremental.new_sources(args.file)
+
 	print('Generating interaction graphs from IPAs')
+	start = time.perf_counter()
 
 	for i, file in enumerate(args.file):
+		if i < len(args.file) - len(files):
+			continue
 		interactions = ints.Ints([], [], type_int = args.type)
 		interactions.read_map_file(file)
 		if args.folder is not None:
 			interactions.output_location = [args.folder[i]+loc for loc in interactions.output_location]
-		graphs.append(interactions.compute_graphs(subgraph = args.subgraph))
+		graphs.append(interactions.compute_graphs(subgraph = args.subgraph, graph_type = args.graph_type))
 
-	g = np.concatenate(graphs)
+	g = np.concatenate(graphs) if len(graphs) else np.array([], dtype = object)
 	#pdb.set_trace()
 	ng = np.array([gt.n for gt in g])
 	mask = ng >2
 	g = g[mask]
+	graphs_time = time.perf_counter() - start
 
 	print('Interaction graphs generated')
 
+	gram = None
+	report_incremental = list()
+	if args.incremental is not None:
+		print('Updating the stored Gram matrix')
+		g, gram, report_incremental = incremental.update(files, g, graphs_time)
+		base_kernel = incremental.kernel
+
 	report.append(f'Generated graphs for model training: {len(g)}')
+	report.append(f'Selected graph kernel: {type(base_kernel).__name__}\nNormalized kernel: {args.normalize}\n')
+	report = report + report_incremental
+
+	approximate = None
+	if args.approximate:
+		if not hasattr(base_kernel, 'features'):
+			raise ValueError('The approximate nearest neighbours search requires the ipa graph kernel')
+		approximate = LSHNeighbours(n_tables = args.lsh_tables, n_bits = args.lsh_bits, candidates = args.lsh_candidates)
+		report.append(f'Approximate KNN-average similarity: {args.lsh_tables} hash tables of {args.lsh_bits} bits, {args.lsh_candidates}(n+1) candidates per graph')
+		if args.nystroem is None:
+			report.append('Without Nyström models (-ny) the OCSVM models are still fitted on the Gram matrix of their training graphs (O(N^2)), only the heuristics avoid it')
+		report.append('')
+		if args.approximate_check:
+			print('Comparing the approximate and exact KNN-average similarity')
+			report = report + compare_with_exact(g, copy.deepcopy(base_kernel), approximate)
+	elif args.nystroem is not None:
+		if hasattr(base_kernel, 'features'):
+			# the exact KNN-average similarity is computed by blocks of rows, the full Gram matrix is never stored
+			approximate = TiledNeighbours(block_size = args.tile_size)
+			report.append('Nyström training: exact KNN-average similarity computed by blocks of rows of the Gram matrix for the heuristics (O(N^2) time, the full matrix is not stored), use -ann for the approximate search\n')
+		else:
+			report.append(f'Nyström training with the {type(base_kernel).__name__} kernel: the heuristics still compute the full Gram matrix (O(N^2)), the ipa kernel is needed to avoid it\n')
+
+	store = None
+	if args.gram_store is not None:
+		store = GramStore(args.gram_store, budget = None if args.gram_store_budget is None else int(args.gram_store_budget*2**30))
+		report.append(f'Gram matrix store: {args.gram_store}\n')
+
+	if args.nystroem_benchmark is not None:
+		print('Benchmarking the Nyström models')
+		validation = None
+		if args.benchmark_file is not None:
+			interactions = ints.Ints([], [], type_int = args.type)
+			interactions.read_map_file(args.benchmark_file)
+			validation = interactions.compute_graphs(subgraph = args.subgraph, graph_type = args.graph_type)
+			validation = validation[np.array([gt.n for gt in validation]) > 2]
+		report = report + nystroem.benchmark(g, base_kernel, 0.01, args.nystroem_benchmark, validation, solver = args.nystroem_solver)
 
-	base_kernel = ShortestPath(normalize = args.normalize)
-	report.append(f'Selected graph kernel: ShortestPath\nNormalized kernel: {args.normalize}\n')
+	if (args.qms2 or args.mad) and approximate is None and gram is None:
+		print('Computing the Gram matrix')
+		if args.out_of_core is not None:
+			gram = BlockedGram(base_kernel, args.out_of_core, tile_size = args.tile_size, n_jobs = args.n_jobs).compute(g)
+			report.append(f'Gram matrix stored in: {args.out_of_core}\n')
+		elif store is not None:
+			gram = store.fit_transform(base_kernel, g)
+		else:
+			gram = base_kernel.fit_transform(g)
 
 	if args.qms2:
 		print('Training using QMS2')
-		report_qms2 = qms2_training(g, base_kernel, args.qms2_model, args.qms2_kernel)
+		report_qms2 = qms2_training(g, base_kernel, args.qms2_model, args.qms2_kernel, gram, approximate, args.nystroem, args.nystroem_solver, sensibilities = args.sensibilities if args.headless else None, knee_rule = args.knee_rule, plot_prefix = plot_prefix, store = store, scoring_name = args.qms2_scoring, out_of_core = args.out_of_core, tile_size = args.tile_size)
 		print('Training completed')
 
 		report = report + report_qms2
 
 	if args.mad:
 		print('Training using MAD-KNN')
-		report_mad = mad_training(g, base_kernel, args.mad_model, args.mad_kernel)
+		report_mad = mad_training(g, base_kernel, args.mad_model, args.mad_kernel, gram, approximate, args.nystroem, args.nystroem_solver, plot_prefix = plot_prefix, store = store, scoring_name = args.mad_scoring)
 		print('Training completed')
 		report = report + report_mad
 
@@ -110,6 +248,27 @@ if __name__ == "__main__":
 	parser.add_argument('-fo', '--folder', nargs = '+', default = None, help='Folder conatining the interaction files')
 	parser.add_argument('-t', '--type', default = 'MERG', help='Type of interactions used in interaction detection.\navailble types: MERG, CENT, LIG, PROT')
 	parser.add_argument('-sg', '--subgraph', default = None, help='Available subgraph types: CENT, LIG, PROT, ELEC')
+	parser.add_argument('-gt', '--graph_type', default = 'grakel', choices = ['grakel', 'compact'], help = 'Format of the interaction graphs held in memory, compact graphs store only label codes and quantized distances')
+	parser.add_argument('-gk', '--graph_kernel', default = 'grakel', choices = ['ipa', 'grakel'], help = 'Implementation of the ShortestPath kernel, grakel or explicit sparse features (ipa). The ipa kernel gives the same matrices (see ocsvm_training/tests/test_shortest_path.py) and is needed by the approximate (-ann), out-of-core (-oc) and incremental (-inc) modes')
+	parser.add_argument('-oc', '--out_of_core', default = None, help = 'Folder where the Gram matrix is computed by tiles and stored as a memory mapped file, an interrupted computation is resumed from the same folder')
+	parser.add_argument('-ts', '--tile_size', type = int, default = 2048, help = 'Size of the tiles used for the out-of-core and parallel Gram matrix')
+	parser.add_argument('-inc', '--incremental', default = None, help = 'Folder storing the graphs, features and Gram matrix of the previous training, only the graphs of map files not yet stored are computed and added to the matrix. The stored map files must be given first, in the same order')
+	parser.add_argument('-gs', '--gram_store', default = None, help = 'Folder of the persistent Gram matrix store, matrices of the same graphs and kernel settings are loaded instead of being recomputed')
+	parser.add_argument('-gsb', '--gram_store_budget', type = float, default = None, help = 'Maximum size of the Gram matrix store in GB, the least recently used matrices are removed')
+	parser.add_argument('-j', '--n_jobs', type = int, default = None, help = 'Number of processes used to compute the Gram matrix with the ipa kernel')
+	parser.add_argument('-ann', '--approximate', default = False, help = 'Compute the KNN-average similarity of the heuristics with an approximate nearest neighbours search (LSH) instead of the full Gram matrix, requires the ipa kernel. The OCSVM models still need the Gram matrix of their training graphs unless Nyström models (-ny) are trained', action = 'store_true')
+	parser.add_argument('-lt', '--lsh_tables', type = int, default = 4, help = 'Number of hash tables of the approximate search')
+	parser.add_argument('-lb', '--lsh_bits', type = int, default = 16, help = 'Number of bits of each hash table of the approximate search')
+	parser.add_argument('-lc', '--lsh_candidates', type = int, default = 4, help = 'Number of candidate neighbours of each graph in the approximate search, as a multiple of the number of neighbours n+1, each graph has at least n+1 candidates in every hash table')
+	parser.add_argument('-ac', '--approximate_check', default = False, help = 'Report the difference of nu and knee between the approximate and exact search, the exact search computes the full Gram matrix', action = 'store_true')
+	parser.add_argument('-ny', '--nystroem', type = int, default = None, help = 'Train low-rank Nyström models using the given number of landmark graphs, the saved kernels are fitted only on the landmarks. With the ipa kernel the KNN-average similarity of the heuristics is computed by blocks of rows so that the full Gram matrix is never stored, or with the approximate search if -ann is given, with the grakel kernel the heuristics still compute the full Gram matrix')
+	parser.add_argument('-nys', '--nystroem_solver', default = 'libsvm', choices = ['libsvm', 'sgd'], help = 'Linear one-class model of the Nyström models: libsvm (OneClassSVM with linear kernel, superlinear in the number of graphs) or sgd (SGDOneClassSVM, linear time in the number of graphs but about four times the decision error of libsvm, check it with -nb)')
+	parser.add_argument('-nb', '--nystroem_benchmark', type = int, nargs = '+', default = None, help = 'Numbers of landmarks compared with the exact model in the report')
+	parser.add_argument('-bf', '--benchmark_file', default = None, help = 'Map file of the graphs scored in the Nyström benchmark, by default the training graphs are scored')
+	parser.add_argument('-hl', '--headless', default = False, help = 'Train without user interaction, the QMS2 sensibility is selected from a sweep and the plots are saved to files', action = 'store_true')
+	parser.add_argument('-ss', '--sensibilities', type = float, nargs = '+', default = [float(S) for S in range(1, 11)], help = 'Sensibility values of the kneed algorithm tested in headless mode')
+	parser.add_argument('-kr', '--knee_rule', default = 'stable', choices = ['stable', 'min', 'max'], help = 'Rule selecting the sensibility in headless mode: the longest run of values giving the same knee (stable), the smallest (min) or the largest (max) value giving a knee')
+	parser.add_argument('-pp', '--plot_prefix', default = 'training', help = 'Prefix of the plot files saved in headless mode')
 	parser.add_argument('-nn', '--normalize', default =  True, help = 'Remove normalization of the graph similairty score' , action = 'store_false')
 	parser.add_argument('-m', '--mad', default = True, help = 'Skip training using the MAD heuristic', action = 'store_false')
 	parser.add_argument('-q', '--qms2', default = True, help = 'Skip training using the QMS2 heuristic', action = 'store_false')
@@ -117,6 +276,8 @@ if __name__ == "__main__":
 	parser.add_argument('-mm', '--mad_model', default = 'mad_ocsvm.sav', help = 'Name of the MAD trained model')
 	parser.add_argument('-qk', '--qms2_kernel', default = 'qms2_kernel.sav', help = 'Name of the QMS2 trained kernel')
 	parser.add_argument('-qm', '--qms2_model', default = 'qms2_ocsvm.sav', help = 'Name of the QMS2 trained model')
+	parser.add_argument('-ms', '--mad_scoring', default = None, help = 'Name of the MAD scoring model, containing only the support vectors, that can be used by scoring.py in place of the kernel and model')
+	parser.add_argument('-qs', '--qms2_scoring', default = None, help = 'Name of the QMS2 scoring model, containing only the support vectors, that can be used by scoring.py in place of the kernel and model')
 	parser.add_argument('-r', '--report', default = 'training_report.txt', help = 'Name of the report file')
 
 	parser.set_defaults(func=main)